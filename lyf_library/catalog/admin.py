@@ -1,7 +1,19 @@
 from django.contrib import admin
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.html import format_html
 
 # Register your models here.
-from .models import Author, Genre, Book, BookInstance
+from .autocomplete import prefix_q
+from .models import Author, Genre, Book, BookInstance, Hold, LoanEvent, normalize_search_key
+from .pagination import EstimatedCountPaginator
+
+def is_autocomplete(request, admin_site):
+    """
+    Whether ``request`` is for the admin's autocomplete endpoint.
+    """
+    return request.path == reverse('%s:autocomplete' % admin_site.name)
+
 
 # admin.site.register(Book)
 # admin.site.register(Author)
@@ -13,12 +25,51 @@ admin.site.register(Genre)
 class BooksInstanceInline(admin.TabularInline):
     list_dis = ('title', 'author', 'status', 'date_of_death', 'uuid')
     model = BookInstance
+    autocomplete_fields = ['borrower']
+    # Books with more copies than this link to the filtered copy list instead
+    max_copies = 50
 
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
     list_display = ('title', 'author', 'display_genre')
+    list_select_related = ('author',)
+    search_fields = ['title', 'isbn']
+    autocomplete_fields = ['author']
+    readonly_fields = ['display_copies']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [BooksInstanceInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Autocomplete: title prefix or exact ISBN, both served by an index
+        # (the default icontains over title and isbn scans the table). The
+        # changelist keeps the search_fields search.
+        if not is_autocomplete(request, self.admin_site):
+            return super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(prefix_q(normalize_search_key(term)) | Q(isbn=term)), False
+
+    def get_queryset(self, request):
+        # display_genre() slices genre.all(), which reads from the prefetch
+        return super().get_queryset(request).prefetch_related('genre')
+
+    def get_inlines(self, request, obj):
+        if obj is not None and obj.copies_total > BooksInstanceInline.max_copies:
+            return []
+        return super().get_inlines(request, obj)
+
+    def display_copies(self, obj):
+        if obj.pk is None:
+            return ''
+        url = '%s?book__id__exact=%s' % (reverse('admin:catalog_bookinstance_changelist'), obj.pk)
+        return format_html(
+            '{} copies, {} available, {} on loan (<a href="{}">manage copies</a>)',
+            obj.copies_total, obj.copies_available, obj.copies_on_loan, url,
+        )
+    display_copies.short_description = 'Copies'
+
 
 # Register the Admin classes for BookInstance using the decorator
 
@@ -26,6 +77,11 @@ class BookAdmin(admin.ModelAdmin):
 class BookInstanceAdmin(admin.ModelAdmin):
     list_display = ('book', 'status', 'display_borrower', 'due_back', 'id')
     list_filter = ('status', 'due_back')
+    # book for list_display and __str__, borrower for display_borrower
+    list_select_related = ('book', 'borrower')
+    autocomplete_fields = ['book', 'borrower']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     fieldsets = (
         (None, {
@@ -41,10 +97,57 @@ class BookInstanceAdmin(admin.ModelAdmin):
     display_borrower.short_description = 'Borrower'
 
 
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'user', 'status', 'priority', 'created_at', 'expires_at')
+    list_filter = ('status',)
+    list_select_related = ('book', 'user')
+    autocomplete_fields = ['book', 'user']
+    readonly_fields = ('copy', 'ready_at', 'expires_at')
+    ordering = ['-created_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(LoanEvent)
+class LoanEventAdmin(admin.ModelAdmin):
+    """
+    The loan history, read-only: events are only ever appended.
+    """
+    list_display = ('day', 'kind', 'book', 'borrower', 'copy_id', 'due_back')
+    list_filter = ('kind',)
+    list_select_related = ('book', 'borrower')
+    ordering = ['-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 # Define the admin class
 class AuthorAdmin(admin.ModelAdmin):
     list_display = ('last_name', 'first_name', 'date_of_birth', 'date_of_death')
     fields = ['first_name', 'last_name', ('date_of_birth', 'date_of_death')]
+    search_fields = ['last_name', 'first_name']
+    # Alphabetical, and a stable order for the paginated autocomplete results
+    ordering = ['search_key']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Autocomplete: "last_name first_name" prefix through the indexed
+        # search key. The changelist keeps the search_fields search.
+        if not is_autocomplete(request, self.admin_site):
+            return super().get_search_results(request, queryset, search_term)
+        term = normalize_search_key(search_term)
+        if not term:
+            return queryset, False
+        return queryset.filter(prefix_q(term)), False
 
 # Register the admin class with the associated model
 admin.site.register(Author, AuthorAdmin)
@@ -0,0 +1,160 @@
+"""
+Read-only JSON API for books, authors, genres and copies.
+
+Rows are read with ``values()`` and serialized straight from the dicts, without
+instantiating models. ``?fields=title,isbn`` selects only those columns,
+``?ids=1,2,3`` fetches a batch by primary key, and lists are paginated by
+primary key with the signed cursors of ``catalog.pagination``. Queries use
+the async ORM, for the async views in ``catalog.views``.
+"""
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.http import Http404
+
+from .models import Author, Book, BookInstance, Genre
+from .pagination import CursorPaginator
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class ApiError(Exception):
+    """
+    A bad request parameter, reported to the client with status 400.
+    """
+
+
+async def _book_genres(book_ids):
+    genres = defaultdict(list)
+    links = Book.genre.through.objects.filter(book_id__in=book_ids).order_by('genre_id')
+    async for book_id, genre_id in links.values_list('book_id', 'genre_id'):
+        genres[book_id].append(genre_id)
+    return genres
+
+
+class Resource:
+    """
+    A model exposed through the API. ``fields`` maps API field names to the
+    columns read with ``values()``; ``related`` maps API field names to
+    coroutine functions returning ``{pk: [values]}`` for a page of primary keys, so
+    many-to-many fields cost one query per page.
+    """
+    def __init__(self, model, fields, related=None):
+        self.model = model
+        self.fields = fields
+        self.related = related or {}
+        self.pk_name = model._meta.pk.name
+
+    def parse_fields(self, value):
+        """
+        Return the requested API field names; the primary key is always included.
+        """
+        if not value:
+            return [self.pk_name] + [name for name in list(self.fields) + list(self.related) if name != self.pk_name]
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields and name not in self.related]
+        if unknown:
+            raise ApiError('Unknown field(s): %s' % ', '.join(unknown))
+        return [self.pk_name] + [name for name in dict.fromkeys(names) if name != self.pk_name]
+
+    def parse_pk(self, value):
+        pk_field = self.model._meta.pk
+        try:
+            pk = pk_field.to_python(value)
+        except ValidationError:
+            raise ApiError('Invalid id: %s' % value)
+        # An integer the database column cannot hold would fail in the query
+        internal_type = pk_field.get_internal_type()
+        if internal_type in connection.ops.integer_field_ranges:
+            low, high = connection.ops.integer_field_range(internal_type)
+            if not low <= pk <= high:
+                raise ApiError('Invalid id: %s' % value)
+        return pk
+
+    def parse_ids(self, value):
+        ids = [self.parse_pk(pk.strip()) for pk in value.split(',') if pk.strip()]
+        if len(ids) > MAX_LIMIT:
+            raise ApiError('At most %d ids per request' % MAX_LIMIT)
+        return ids
+
+    def queryset(self, names):
+        columns = [self.fields[name] for name in names if name in self.fields]
+        return self.model.objects.values(*columns)
+
+    async def serialize(self, rows, names):
+        """
+        Turn ``values()`` rows into API dicts, filling in the related fields.
+        """
+        pks = [row[self.pk_name] for row in rows]
+        related = {name: await self.related[name](pks) for name in names if name in self.related}
+        return [
+            {
+                name: related[name].get(row[self.pk_name], []) if name in related else row[self.fields[name]]
+                for name in names
+            }
+            for row in rows
+        ]
+
+    async def alist(self, params):
+        """
+        Return ``(objects, next_cursor, previous_cursor)`` for the query parameters.
+        """
+        names = self.parse_fields(params.get('fields'))
+        try:
+            limit = min(max(int(params.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        except ValueError:
+            raise ApiError('Invalid limit')
+        queryset = self.queryset(names)
+        if params.get('ids'):
+            queryset = queryset.filter(pk__in=self.parse_ids(params['ids']))
+        try:
+            page = await CursorPaginator(queryset, (self.pk_name,), limit).apage(params.get('cursor'))
+        except Http404:
+            raise ApiError('Invalid cursor')
+        return await self.serialize(page.object_list, names), page.next_cursor, page.previous_cursor
+
+    async def aget(self, pk, params):
+        """
+        Return the object with primary key ``pk``, or None.
+        """
+        names = self.parse_fields(params.get('fields'))
+        rows = [row async for row in self.queryset(names).filter(pk=self.parse_pk(pk))]
+        return (await self.serialize(rows, names))[0] if rows else None
+
+
+RESOURCES = {
+    'books': Resource(Book, {
+        'id': 'id',
+        'title': 'title',
+        'summary': 'summary',
+        'isbn': 'isbn',
+        'author': 'author_id',
+        'copies_total': 'copies_total',
+        'copies_available': 'copies_available',
+        'copies_on_loan': 'copies_on_loan',
+        'updated_at': 'updated_at',
+    }, related={'genres': _book_genres}),
+    'authors': Resource(Author, {
+        'id': 'id',
+        'first_name': 'first_name',
+        'last_name': 'last_name',
+        'date_of_birth': 'date_of_birth',
+        'date_of_death': 'date_of_death',
+        'updated_at': 'updated_at',
+    }),
+    'genres': Resource(Genre, {
+        'id': 'id',
+        'name': 'name',
+    }),
+    # Borrowers are deliberately not exposed
+    'copies': Resource(BookInstance, {
+        'id': 'id',
+        'book': 'book_id',
+        'imprint': 'imprint',
+        'status': 'status',
+        'due_back': 'due_back',
+        'updated_at': 'updated_at',
+    }),
+}
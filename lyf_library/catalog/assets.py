@@ -0,0 +1,236 @@
+"""
+Production static asset pipeline.
+
+``CatalogStaticFilesStorage`` extends the manifest storage used by
+``collectstatic``:
+
+- the project's own CSS and JavaScript is minified before it is hashed
+  (third-party apps ship their own builds);
+- JPEG and PNG images get resized variants, and WebP copies when Pillow is
+  installed, which ``{% responsive_image %}`` lists in ``srcset``;
+- every hashed text asset is precompressed to ``.gz`` and, when the brotli
+  package is installed, ``.br``.
+
+``serve_static`` serves STATIC_ROOT with the precompressed files and a
+far-future immutable ``Cache-Control`` for content-hashed names, so a repeat
+page load makes no asset requests. A front-end server can serve STATIC_ROOT
+the same way instead.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Content-hashed names never change content
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Unhashed names may point at new content after the next deploy
+SHORT_CACHE = 'public, max-age=300'
+
+COMPRESSIBLE = ('.css', '.js', '.json', '.svg', '.txt', '.xml', '.html', '.map')
+RESPONSIVE = ('.jpg', '.jpeg', '.png')
+RESPONSIVE_WIDTHS = getattr(settings, 'CATALOG_RESPONSIVE_WIDTHS', (320, 640, 1280))
+
+STRINGS_AND_COMMENTS = re.compile(r'("(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|/\*.*?\*/)', re.S)
+ACCEPTS_BROTLI = re.compile(r'\bbr\b')
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+VARIANT = re.compile(r'^(?P<base>.+)-(?P<width>\d+)w\.(?P<ext>[a-z]+)$')
+
+
+def minify_css(css):
+    """
+    Drop comments (but ``/*!`` licence headers) and needless whitespace.
+    Strings are kept as they are.
+    """
+    # Alternate runs of code and kept text, with dropped comments merging the code around them
+    segments = ['']
+    for index, part in enumerate(STRINGS_AND_COMMENTS.split(css)):
+        if index % 2 == 0 or (part.startswith('/*') and not part.startswith('/*!')):
+            segments[-1] += part if index % 2 == 0 else ' '
+        else:
+            segments += [part + '\n' if part.startswith('/*!') else part, '']
+    for index in range(0, len(segments), 2):
+        code = re.sub(r'\s+', ' ', segments[index])
+        code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+        code = re.sub(r':\s+', ':', code)
+        segments[index] = code.replace(';}', '}')
+    return re.sub(r'\*/\n\s+', '*/\n', ''.join(segments)).strip() + '\n'
+
+
+def minify_js(js):
+    """
+    Drop indentation, blank lines and whole-line ``//`` comments. Lines are
+    kept, so automatic semicolon insertion is unaffected (multi-line template
+    literals would lose their indentation; the project has none).
+    """
+    lines = (line.strip() for line in js.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+
+def variant_name(name, width, ext):
+    return '%s-%dw%s' % (os.path.splitext(name)[0], width, ext)
+
+
+class MinifiedSource:
+    """
+    A finder's storage whose CSS and JavaScript is read minified.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    def open(self, path, mode='rb'):
+        with self.storage.open(path, mode) as f:
+            content = f.read()
+        minify = MINIFIERS.get(os.path.splitext(path)[1])
+        if minify is not None:
+            content = minify(content.decode('utf-8')).encode('utf-8')
+        return ContentFile(content, name=path)
+
+
+class CatalogStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage that also minifies, resizes and precompresses; see the
+    module docstring.
+    """
+    def should_minify(self, storage, path):
+        location = getattr(storage, 'location', None)
+        return (
+            os.path.splitext(path)[1] in MINIFIERS and '.min.' not in path
+            and location is not None and Path(location).resolve().is_relative_to(settings.BASE_DIR)
+        )
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        paths = {
+            prefixed_path: (MinifiedSource(storage) if self.should_minify(storage, path) else storage, path)
+            for prefixed_path, (storage, path) in paths.items()
+        }
+        paths.update(self.make_variants(paths))
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        for name in set(self.hashed_files.values()):
+            if os.path.splitext(name)[1] in COMPRESSIBLE:
+                self.precompress(name)
+
+    def make_variants(self, paths):
+        """
+        Save resized (and WebP) copies of the collected images next to them;
+        return them as extra paths to hash.
+        """
+        if Image is None:
+            return {}
+        variants = {}
+        for prefixed_path, (storage, path) in paths.items():
+            ext = os.path.splitext(path)[1].lower()
+            if ext not in RESPONSIVE or VARIANT.match(path):
+                continue
+            with storage.open(path) as f:
+                image = Image.open(BytesIO(f.read()))
+                image.load()
+            for width in sorted({w for w in RESPONSIVE_WIDTHS if w < image.width} | {image.width}):
+                resized = image if width == image.width else image.resize(
+                    (width, round(image.height * width / image.width)), Image.LANCZOS,
+                )
+                for variant_ext, image_format, save_options in (
+                    (ext, 'PNG' if ext == '.png' else 'JPEG', {'optimize': True}),
+                    ('.webp', 'WEBP', {'quality': 80, 'method': 6}),
+                ):
+                    buffer = BytesIO()
+                    (resized if image_format == 'PNG' else resized.convert('RGB')).save(buffer, image_format, **save_options)
+                    name = variant_name(prefixed_path, width, variant_ext)
+                    if self.exists(name):
+                        self.delete(name)
+                    self._save(name, ContentFile(buffer.getvalue()))
+                    variants[name] = (self, name)
+        return variants
+
+    def precompress(self, name):
+        with self.open(name) as f:
+            content = f.read()
+        compressors = [('.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+        if brotli is not None:
+            compressors.append(('.br', lambda data: brotli.compress(data, quality=11)))
+        for suffix, compress in compressors:
+            compressed = compress(content)
+            if len(compressed) < len(content):
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(compressed))
+
+    def is_hashed(self, name):
+        if not hasattr(self, '_hashed_names'):
+            self._hashed_names = set(self.hashed_files.values())
+        return name in self._hashed_names
+
+    def image_variants(self, name):
+        """
+        Return ``{ext: [(width, name), ...]}`` of the collected variants of an image.
+        """
+        base = os.path.splitext(name)[0]
+        variants = {}
+        for variant in self.hashed_files:
+            match = VARIANT.match(variant)
+            if match and match['base'] == base:
+                variants.setdefault('.' + match['ext'], []).append((int(match['width']), variant))
+        return {ext: sorted(names) for ext, names in variants.items()}
+
+
+def serve_static(request, path):
+    """
+    View function serving a collected file from STATIC_ROOT, precompressed
+    when the client accepts it, cached for a year when its name is hashed.
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+    mtime = os.stat(fullpath).st_mtime
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), mtime):
+        response = HttpResponseNotModified()
+    else:
+        accept = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        served, encoding = fullpath, None
+        for suffix, accepted, name in (('.br', ACCEPTS_BROTLI, 'br'), ('.gz', ACCEPTS_GZIP, 'gzip')):
+            if accepted.search(accept) and os.path.isfile(fullpath + suffix):
+                served, encoding = fullpath + suffix, name
+                break
+        content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+        response = FileResponse(open(served, 'rb'), content_type=content_type, filename=os.path.basename(fullpath))
+        response['Last-Modified'] = http_date(mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    is_hashed = getattr(staticfiles_storage, 'is_hashed', None)
+    response['Cache-Control'] = IMMUTABLE if is_hashed and is_hashed(path) else SHORT_CACHE
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
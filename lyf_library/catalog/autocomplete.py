@@ -0,0 +1,119 @@
+"""
+Prefix autocomplete for authors, books and genres.
+
+Authors and books are matched on their indexed ``search_key`` (a normalized
+"last_name first_name" or title, see ``normalize_search_key``), so a lookup is
+an index range scan however large the table. Results are cached per prefix
+under the ``authors``/``books``/``genres`` cache tags, which the signal
+handlers bump when the rows change, so hot prefixes skip the database.
+
+The widgets below render only the selected choices and fetch the others from
+the ``autocomplete`` view as the user types, so form pages no longer load
+every author and genre.
+"""
+import hashlib
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+from django.urls import reverse
+
+from . import caching
+from .models import Author, Book, Genre, normalize_search_key
+
+MAX_RESULTS = 20
+
+
+def prefix_q(prefix, field='search_key'):
+    """
+    Q object matching rows whose ``field`` starts with ``prefix``.
+    """
+    if connection.vendor == 'sqlite':
+        # SQLite only uses an index for LIKE on NOCASE columns. The key is
+        # already lower case, so a range over its binary order is equivalent.
+        return Q(**{'%s__gte' % field: prefix, '%s__lt' % field: prefix + '\U0010ffff'})
+    # PostgreSQL: LIKE 'x%' is served by the varchar_pattern_ops indexes of
+    # migration 0012 (the plain index follows the collation, which may not be C)
+    return Q(**{'%s__startswith' % field: prefix})
+
+
+def _authors(prefix, limit):
+    authors = Author.objects.filter(prefix_q(prefix)).order_by('search_key', 'pk')
+    return [
+        (pk, '%s, %s' % (last_name, first_name))
+        for pk, last_name, first_name in authors.values_list('pk', 'last_name', 'first_name')[:limit]
+    ]
+
+
+def _books(prefix, limit):
+    books = Book.objects.filter(prefix_q(prefix)).order_by('search_key', 'pk')
+    return list(books.values_list('pk', 'title')[:limit])
+
+
+def _genres(prefix, limit):
+    # Genres are few; their names are matched directly
+    return list(Genre.objects.filter(name__istartswith=prefix).order_by('name', 'pk').values_list('pk', 'name')[:limit])
+
+
+SOURCES = {
+    'authors': _authors,
+    'books': _books,
+    'genres': _genres,
+}
+
+
+def complete(kind, query, limit=MAX_RESULTS):
+    """
+    Return up to ``limit`` ``(pk, label)`` pairs of ``kind`` starting with ``query``.
+    """
+    prefix = normalize_search_key(query) if kind != 'genres' else query.strip()
+    key = 'autocomplete:%s:%s:%d' % (kind, hashlib.md5(prefix.encode()).hexdigest(), limit)
+    return caching.get_or_set_tagged(key, [kind], lambda: SOURCES[kind](prefix, limit))
+
+
+class AutocompleteMixin:
+    """
+    Render only the selected options of a model choice field; the script in
+    ``js/autocomplete.js`` adds the others from the autocomplete view.
+    """
+    def __init__(self, kind, attrs=None):
+        super().__init__(attrs)
+        self.kind = kind
+
+    class Media:
+        js = ['js/autocomplete.js']
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs['data-autocomplete-url'] = reverse('autocomplete', args=[self.kind])
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        # Submitted values are re-rendered before validation: drop the ones
+        # that are not primary keys at all (the field reports the error)
+        pk_field = self.choices.queryset.model._meta.pk
+        selected = set()
+        for v in value:
+            if v in ('', None):
+                continue
+            try:
+                selected.add(pk_field.to_python(v))
+            except ValidationError:
+                pass
+        options = []
+        if not self.is_required and not self.allow_multiple_selected:
+            options.append(self.create_option(name, '', '---------', not selected, 0))
+        if selected:
+            field = self.choices.field
+            for obj in self.choices.queryset.filter(pk__in=selected):
+                options.append(self.create_option(name, obj.pk, field.label_from_instance(obj), True, len(options)))
+        return [(None, options, 0)]
+
+
+class AutocompleteSelect(AutocompleteMixin, forms.Select):
+    pass
+
+
+class AutocompleteSelectMultiple(AutocompleteMixin, forms.SelectMultiple):
+    pass
@@ -0,0 +1,92 @@
+"""
+Per-book copy counts stored on Book (``copies_total``, ``copies_available``,
+``copies_on_loan``).
+
+The signal handlers adjust them with ``F()`` updates as copies are created,
+deleted or change status or book; ``recount_books`` recomputes them in bulk
+after writes that bypass the signals, and to repair drift.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Book, BookInstance
+
+COUNTED_STATUSES = {
+    'a': 'copies_available',
+    'o': 'copies_on_loan',
+}
+
+
+def copy_deltas(book_id, status, sign):
+    """
+    Return {book_id: {field: delta}} for adding (sign=1) or removing (sign=-1)
+    one copy with ``status`` from a book.
+    """
+    if book_id is None:
+        return {}
+    deltas = {'copies_total': sign}
+    if status in COUNTED_STATUSES:
+        deltas[COUNTED_STATUSES[status]] = sign
+    return {book_id: deltas}
+
+
+def apply_deltas(*changes):
+    """
+    Apply the combined result of several copy_deltas() calls, one UPDATE per book.
+    """
+    combined = {}
+    for change in changes:
+        for book_id, deltas in change.items():
+            for field, delta in deltas.items():
+                combined.setdefault(book_id, {}).setdefault(field, 0)
+                combined[book_id][field] += delta
+    for book_id, deltas in combined.items():
+        updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if updates:
+            Book.objects.filter(pk=book_id).update(updated_at=timezone.now(), **updates)
+
+
+def _count(**filters):
+    copies = (
+        BookInstance.objects.filter(book=OuterRef('pk'), **filters)
+        .order_by().values('book').annotate(count=Count('pk')).values('count')
+    )
+    return Coalesce(Subquery(copies, output_field=IntegerField()), 0)
+
+
+def actual_counts():
+    """
+    Expressions computing each stored count from the BookInstance rows.
+    """
+    return {
+        'copies_total': _count(),
+        'copies_available': _count(status='a'),
+        'copies_on_loan': _count(status='o'),
+    }
+
+
+def recount_books(book_ids=None, batch_size=5000):
+    """
+    Recompute the copy counts of ``book_ids`` (or every book, in pk batches)
+    and store those that drifted. Returns the number of books corrected.
+    """
+    queryset = Book.objects.all()
+    if book_ids is not None:
+        queryset = queryset.filter(pk__in=list(book_ids))
+
+    fixed = 0
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return fixed
+        last_pk = batch[-1]
+        drifted = Book.objects.filter(pk__in=batch).alias(
+            **{'actual_%s' % field: expression for field, expression in actual_counts().items()}
+        ).filter(
+            ~Q(copies_total=F('actual_copies_total'))
+            | ~Q(copies_available=F('actual_copies_available'))
+            | ~Q(copies_on_loan=F('actual_copies_on_loan'))
+        )
+        fixed += Book.objects.filter(pk__in=drifted.values('pk')).update(updated_at=timezone.now(), **actual_counts())
@@ -0,0 +1,518 @@
+"""
+Reproducible catalog benchmarks.
+
+``seed()`` fills the database with a synthetic catalog (authors, genres,
+books, copies and loans) using the bulk importer, deterministically for a
+given random seed. ``scenarios()`` lists one request per catalog URL plus the
+admin changelists and the renewal POST; ``run_client()`` times them in
+process with the Django test client and counts their queries, and
+``run_server()`` puts concurrent load on them through a local WSGI server.
+``run_contention()`` times catalog reads from several threads while another
+thread keeps renewing loans, to compare database tuning profiles, and
+``run_holds()`` measures hold allocation throughput under parallel returns.
+Results are plain dicts, written out as JSON by the ``benchmark_catalog``
+command so runs can be compared between commits. The POST scenarios,
+``run_contention()`` and ``run_holds()`` change loans and holds; the command
+only runs them against a database it has just seeded or with
+``--allow-writes``.
+"""
+import contextlib
+import datetime
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import availability, circulation, counters, importing, reservations
+from .models import Author, Book, BookInstance, Genre, Hold
+
+SIZES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+WORDS = (
+    'war peace river night garden city winter summer secret house ship moon star empire storm mountain '
+    'island letter shadow king queen stone fire silver golden road journey forest ocean memory dream '
+    'machine history science poetry children stranger family song light darkness time world heart'
+).split()
+
+GENRES = ['Fiction', 'Science Fiction', 'Fantasy', 'History', 'Poetry', 'Biography', 'Science', 'Children']
+
+BORROWERS = 200
+LIBRARIAN = 'benchmark-librarian'
+
+
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for i in range(count))
+
+
+def seed(num_books, copies_per_book=3, loan_ratio=0.3, batch_size=5000, random_seed=0):
+    """
+    Add ``num_books`` synthetic books (one author per ten books) with
+    ``copies_per_book`` copies each, ``loan_ratio`` of them on loan (some
+    overdue). Returns the number of rows created per model.
+    """
+    rng = random.Random(random_seed)
+    num_authors = max(1, num_books // 10)
+    importer = importing.CatalogImporter(batch_size=batch_size)
+    importer.import_genres({'name': name} for name in GENRES)
+    importer.import_authors(
+        {'first_name': 'Author%d' % i, 'last_name': _words(rng, 1).title()} for i in range(num_authors)
+    )
+    author_names = list(Author.objects.values_list('first_name', 'last_name')[:num_authors])
+    importer.import_books(
+        {
+            'title': _words(rng, 3).title(),
+            'summary': _words(rng, 30),
+            'isbn': '%013d' % rng.randrange(10 ** 13),
+            'author_first_name': author_names[i % len(author_names)][0],
+            'author_last_name': author_names[i % len(author_names)][1],
+            'genres': rng.sample(GENRES, 2),
+        }
+        for i in range(num_books)
+    )
+
+    User.objects.bulk_create(
+        [User(username='benchmark-reader-%d' % i) for i in range(BORROWERS)], ignore_conflicts=True,
+    )
+    borrower_ids = list(User.objects.filter(username__startswith='benchmark-reader-').values_list('pk', flat=True))
+    today = datetime.date.today()
+    copies = 0
+    book_ids = Book.objects.order_by('-pk').values_list('pk', flat=True)[:num_books].iterator(chunk_size=batch_size)
+    for batch in importing.batched(book_ids, batch_size // copies_per_book or 1):
+        instances = []
+        for book_id in batch:
+            for i in range(copies_per_book):
+                if rng.random() < loan_ratio:
+                    instances.append(BookInstance(
+                        book_id=book_id, imprint=_words(rng, 2).title(), status='o',
+                        borrower_id=rng.choice(borrower_ids), due_back=today + datetime.timedelta(days=rng.randint(-14, 21)),
+                    ))
+                else:
+                    instances.append(BookInstance(
+                        book_id=book_id, imprint=_words(rng, 2).title(), status=rng.choice('aaaamr'),
+                    ))
+        BookInstance.objects.bulk_create(instances, batch_size=batch_size)
+        availability.recount_books(batch)
+        copies += len(instances)
+    counters.invalidate_counters()
+    return {'authors': num_authors, 'books': num_books, 'copies': copies, 'borrowers': len(borrower_ids)}
+
+
+def dataset_size():
+    return {
+        'authors': Author.objects.count(),
+        'genres': Genre.objects.count(),
+        'books': Book.objects.count(),
+        'copies': BookInstance.objects.count(),
+        'loans': BookInstance.objects.on_loan().count(),
+    }
+
+
+def get_librarian():
+    """
+    The superuser the staff scenarios run as (created on first use).
+    """
+    user = User.objects.filter(username=LIBRARIAN).first()
+    if user is None:
+        user = User.objects.create_superuser(LIBRARIAN, password=None)
+    return user
+
+
+def scenarios(writes=True):
+    """
+    Return the requests to measure as dicts with ``name``, ``method``,
+    ``path``, ``staff`` (run as the librarian), optional POST ``data`` and
+    ``repeat`` (False for requests that change data or are very large).
+    Without ``writes`` the POST scenarios, which change loans and holds, are
+    left out.
+    """
+    book = Book.objects.filter(copies_total__gt=0).order_by('pk').first() or Book.objects.order_by('pk').first()
+    author = Author.objects.order_by('pk').first()
+    loan = BookInstance.objects.on_loan().order_by('pk').first()
+    loans = [str(pk) for pk in BookInstance.objects.on_loan().order_by('-pk').values_list('pk', flat=True)[:50]]
+    renewal_date = (datetime.date.today() + datetime.timedelta(weeks=2)).isoformat()
+    word = book.title.split()[0] if book else 'war'
+
+    def get(name, path, staff=False, repeat=True):
+        return {'name': name, 'method': 'GET', 'path': path, 'staff': staff, 'data': None, 'repeat': repeat}
+
+    def post(name, path, data, repeat=True):
+        return {'name': name, 'method': 'POST', 'path': path, 'staff': True, 'data': data, 'repeat': repeat}
+
+    result = [
+        get('index', reverse('index')),
+        get('books', reverse('books')),
+        get('books-available', reverse('books') + '?available=1'),
+        get('books-cursor', reverse('books') + '?cursor='),
+        get('authors', reverse('authors')),
+        get('search', reverse('search') + '?q=%s' % word),
+        get('export-csv', reverse('export-csv'), staff=True, repeat=False),
+        get('export-jsonl', reverse('export-jsonl'), staff=True, repeat=False),
+        get('api-list', reverse('api-list', args=['books'])),
+        get('api-list-fields', reverse('api-list', args=['books']) + '?fields=title,isbn&limit=100'),
+        get('autocomplete-authors', reverse('autocomplete', args=['authors']) + '?q=%s' % (author.last_name[:2] if author else 'a')),
+        get('autocomplete-books', reverse('autocomplete', args=['books']) + '?q=%s' % word[:3]),
+        get('metrics', reverse('metrics'), staff=True),
+        get('my-borrowed', reverse('my-borrowed'), staff=True),
+        get('my-history', reverse('my-history'), staff=True),
+        get('all-borrowed', reverse('all-borrowed'), staff=True),
+        get('all-borrowed-overdue', reverse('all-borrowed') + '?overdue=1', staff=True),
+        get('circulation-dashboard', reverse('circulation-dashboard'), staff=True),
+        get('author_create', reverse('author_create'), staff=True),
+        get('book_create', reverse('book_create'), staff=True),
+    ]
+    if book:
+        result += [
+            get('book-detail', reverse('book-detail', args=[book.pk])),
+            get('api-detail', reverse('api-detail', args=['books', book.pk])),
+            get('book-history', reverse('book-history', args=[book.pk]), staff=True),
+            get('book_update', reverse('book_update', args=[book.pk]), staff=True),
+            get('book_delete', reverse('book_delete', args=[book.pk]), staff=True),
+        ]
+    if book and writes:
+        # The librarian's hold on another book, for cancel-hold to withdraw
+        other = Book.objects.exclude(pk=book.pk).order_by('pk').first() or book
+        hold = Hold.objects.active().filter(book=other, user__username=LIBRARIAN).first()
+        if hold is None:
+            hold = reservations.place_hold(get_librarian(), other)
+        result += [
+            post('place-hold', reverse('place-hold', args=[book.pk]), {}, repeat=False),
+            post('cancel-hold', reverse('cancel-hold', args=[hold.pk]), {}, repeat=False),
+        ]
+    if author:
+        result += [
+            get('author-detail', reverse('author-detail', args=[author.pk])),
+            get('author_update', reverse('author_update', args=[author.pk]), staff=True),
+            get('author_delete', reverse('author_delete', args=[author.pk]), staff=True),
+        ]
+    if loan:
+        result.append(get('renew-book-librarian', reverse('renew-book-librarian', args=[loan.pk]), staff=True))
+    if loan and writes:
+        result += [
+            post('renew-book-librarian-post', reverse('renew-book-librarian', args=[loan.pk]), {'renewal_date': renewal_date}),
+            post('bulk-renew', reverse('bulk-renew'), {'ids': ','.join(loans), 'renewal_date': renewal_date}),
+            # Return the loans, then lend them out again, once each
+            post('bulk-return', reverse('bulk-return'), {'ids': ','.join(loans)}, repeat=False),
+            post('bulk-checkout', reverse('bulk-checkout'), {
+                'ids': ','.join(loans), 'borrower': LIBRARIAN, 'due_back': renewal_date,
+            }, repeat=False),
+        ]
+    for model in ('author', 'book', 'bookinstance', 'genre'):
+        result.append(get('admin-%s' % model, reverse('admin:catalog_%s_changelist' % model), staff=True))
+    return result
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+def _summary(latencies):
+    return {
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+    }
+
+
+def run_client(iterations=20, host='localhost', only=None, writes=True):
+    """
+    Time every scenario with the test client: the first (cold cache) request
+    and then ``iterations`` warm ones. Returns one result dict per scenario.
+    Without ``writes`` the POST scenarios are skipped and the run (the
+    librarian, its session) is rolled back at the end.
+    """
+    with transaction.atomic() if not writes else contextlib.nullcontext():
+        results = _run_client(iterations, host, only, writes)
+        if not writes:
+            transaction.set_rollback(True)
+    return results
+
+
+def _run_client(iterations, host, only, writes):
+    anonymous = Client(HTTP_HOST=host)
+    staff = Client(HTTP_HOST=host)
+    staff.force_login(get_librarian())
+    results = []
+    for scenario in scenarios(writes):
+        if only and scenario['name'] not in only:
+            continue
+        client = staff if scenario['staff'] else anonymous
+        latencies = []
+        query_counts = []
+        statuses = set()
+        for i in range(1 + iterations if scenario['repeat'] else 1):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                if scenario['method'] == 'POST':
+                    response = client.post(scenario['path'], scenario['data'])
+                else:
+                    response = client.get(scenario['path'])
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                latencies.append(time.perf_counter() - start)
+            query_counts.append(len(queries))
+            statuses.add(response.status_code)
+        warm = latencies[1:] or latencies
+        results.append({
+            'name': scenario['name'], 'method': scenario['method'], 'path': scenario['path'],
+            'status': sorted(statuses), 'requests': len(latencies),
+            'cold_ms': round(latencies[0] * 1000, 2), 'cold_queries': query_counts[0],
+            'queries': query_counts[-1], **_summary(warm),
+        })
+    return results
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def run_server(requests=200, concurrency=10, only=None, writes=True):
+    """
+    Serve the project on a local WSGI server and send ``requests`` concurrent
+    GETs per scenario; returns throughput and latency per scenario. Without
+    ``writes`` the staff pages are skipped: the server threads could not see
+    a librarian created in a transaction that is rolled back.
+    """
+    server = make_server('localhost', 0, get_wsgi_application(), ThreadingWSGIServer, QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = 'http://localhost:%d' % server.server_port
+
+    session_cookie = None
+    if writes:
+        staff = Client(HTTP_HOST='localhost')
+        staff.force_login(get_librarian())
+        session_cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME, staff.cookies[settings.SESSION_COOKIE_NAME].value)
+
+    def fetch(url, staff):
+        request = urllib.request.Request(url, headers={'Cookie': session_cookie} if staff else {})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return time.perf_counter() - start, status
+
+    results = []
+    try:
+        for scenario in scenarios(writes):
+            if scenario['method'] != 'GET' or not scenario['repeat'] or (only and scenario['name'] not in only):
+                continue
+            if scenario['staff'] and not writes:
+                continue
+            url = base + scenario['path']
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as pool:
+                samples = list(pool.map(lambda i: fetch(url, scenario['staff']), range(requests)))
+            elapsed = time.perf_counter() - start
+            results.append({
+                'name': scenario['name'], 'path': scenario['path'], 'requests': requests,
+                'concurrency': concurrency, 'status': sorted({status for latency, status in samples}),
+                'rps': round(requests / elapsed, 1), **_summary([latency for latency, status in samples]),
+            })
+    finally:
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def database_profile():
+    """
+    Describe the database tuning in effect, for labelling results.
+    """
+    info = {
+        'vendor': connection.vendor,
+        'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+        'options': {key: value for key, value in connection.settings_dict['OPTIONS'].items() if key != 'password'},
+    }
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size'):
+                cursor.execute('PRAGMA %s' % pragma)
+                # mmap_size returns no row for in-memory databases
+                row = cursor.fetchone()
+                info[pragma] = row[0] if row else None
+    return info
+
+
+def run_contention(duration=5.0, readers=4, batch_size=50):
+    """
+    Run catalog reads in ``readers`` threads for ``duration`` seconds while
+    one more thread renews batches of ``batch_size`` loans; return the read
+    throughput and latency, the renewals done and the lock errors seen.
+    """
+    loans = list(BookInstance.objects.on_loan().order_by('pk').values_list('pk', flat=True))
+    today = datetime.date.today()
+    stop = threading.Event()
+    read_latencies = [[] for i in range(readers)]
+    write_latencies = []
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+
+    def read(latencies):
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    list(BookInstance.objects.on_loan().with_overdue().select_related('book').order_by('due_back')[:50])
+                    Book.objects.filter(copies_available__gt=0).count()
+                except OperationalError:
+                    with lock:
+                        errors['read'] += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    def write():
+        try:
+            offset = 0
+            while loans and not stop.is_set():
+                batch = loans[offset:offset + batch_size] or loans[:batch_size]
+                offset = offset + batch_size if offset + batch_size < len(loans) else 0
+                due_back = today + datetime.timedelta(days=7 + len(write_latencies) % 14)
+                start = time.perf_counter()
+                try:
+                    circulation.renew([(pk, due_back) for pk in batch])
+                except OperationalError:
+                    errors['write'] += 1
+                    continue
+                write_latencies.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=read, args=[latencies]) for latencies in read_latencies]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    reads = [latency for latencies in read_latencies for latency in latencies]
+    result = {
+        'duration_s': duration, 'readers': readers, 'batch_size': batch_size, 'profile': database_profile(),
+        'reads': len(reads), 'reads_per_s': round(len(reads) / duration, 1),
+        'read_errors': errors['read'], 'renewal_batches': len(write_latencies), 'write_errors': errors['write'],
+    }
+    if reads:
+        result['read'] = _summary(reads)
+    if write_latencies:
+        result['write'] = _summary(write_latencies)
+    return result
+
+
+def run_holds(holds=10_000, workers=4, batch_size=100):
+    """
+    Queue up to ``holds`` holds on the books of the copies on loan (spread
+    over the benchmark readers), then return every loan in batches of
+    ``batch_size`` from ``workers`` threads, each return allocating copies to
+    the queues. Report the throughput, the lock errors seen and whether every
+    ready hold ended up with its own copy.
+    """
+    loans = list(BookInstance.objects.on_loan().order_by('pk').values_list('pk', 'book_id'))
+    book_ids = sorted({book_id for pk, book_id in loans if book_id is not None})
+    User.objects.bulk_create(
+        [User(username='benchmark-reader-%d' % i) for i in range(BORROWERS)], ignore_conflicts=True,
+    )
+    user_ids = list(User.objects.filter(username__startswith='benchmark-reader-').order_by('pk').values_list('pk', flat=True))
+    holds = min(holds, len(book_ids) * len(user_ids))
+    Hold.objects.bulk_create(
+        [Hold(book_id=book_ids[i % len(book_ids)], user_id=user_ids[i // len(book_ids)]) for i in range(holds)],
+        batch_size=1000, ignore_conflicts=True,
+    )
+    ready_before = Hold.objects.ready().count()
+
+    batches = iter(list(importing.batched([pk for pk, book_id in loans], batch_size)))
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def work():
+        try:
+            while True:
+                with lock:
+                    batch = next(batches, None)
+                if batch is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    circulation.return_copies(batch)
+                except OperationalError:
+                    with lock:
+                        errors.append(len(batch))
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=work) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ready = Hold.objects.ready()
+    allocated = ready.count() - ready_before
+    consistent = (
+        ready.values('copy').distinct().count() == ready.count()
+        and not ready.exclude(copy__status='r').exists()
+        and not ready.exclude(copy__borrower=F('user')).exists()
+    )
+    result = {
+        'holds': holds, 'workers': workers, 'batch_size': batch_size, 'profile': database_profile(),
+        'returns': len(loans) - sum(errors), 'return_errors': sum(errors), 'allocated': allocated,
+        'elapsed_s': round(elapsed, 3), 'returns_per_s': round((len(loans) - sum(errors)) / elapsed, 1) if elapsed else None,
+        'allocations_per_s': round(allocated / elapsed, 1) if elapsed else None, 'consistent': consistent,
+    }
+    if latencies:
+        result['batch'] = _summary(latencies)
+    return result
+
+
+def compare(baseline, current, threshold=1.2):
+    """
+    Return a line per scenario whose warm p50 latency grew by more than
+    ``threshold`` times, or whose query count grew, against a baseline run.
+    """
+    regressions = []
+    before = {result['name']: result for result in baseline.get('client', [])}
+    for result in current.get('client', []):
+        old = before.get(result['name'])
+        if old is None:
+            continue
+        if result['queries'] > old['queries']:
+            regressions.append('%s: %d queries, was %d' % (result['name'], result['queries'], old['queries']))
+        if old['p50_ms'] and result['p50_ms'] > old['p50_ms'] * threshold:
+            regressions.append('%s: p50 %.1fms, was %.1fms' % (result['name'], result['p50_ms'], old['p50_ms']))
+    return regressions
@@ -0,0 +1,167 @@
+"""
+Page and template-fragment caching for the public catalog pages.
+
+Cached entries depend on *tags* such as ``'books'`` or ``'book:12'``. Each tag
+has a version number in the cache and every entry key includes the versions of
+its tags, so bumping a tag (done by ``catalog.signals`` when the underlying
+rows change) makes exactly the dependent entries unreachable. Whole-page
+caching only applies to anonymous GET requests.
+
+Bumps are only seen by processes sharing the cache. With a shared cache
+(memcached, Redis, the database cache) invalidation is exact, and entries are
+kept for CATALOG_PAGE_CACHE_TIMEOUT (a day by default) just to bound memory.
+With a per-process LocMemCache a bump only reaches the process that handled
+the write, so the others would serve stale pages and 304s until their entries
+expire; there the timeout defaults to a minute, bounding that staleness.
+"""
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.translation import get_language
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_PAGE_CACHE', 'default')]
+
+
+# Seconds entries are kept: with a shared cache only to bound memory, with a
+# process-local one to bound how stale other processes' pages can get
+CACHE_TIMEOUT = getattr(
+    settings, 'CATALOG_PAGE_CACHE_TIMEOUT', 60 if isinstance(get_cache(), LocMemCache) else 24 * 60 * 60,
+)
+
+
+def _version_key(tag):
+    return 'catalog:tag:%s' % tag
+
+
+def tag_versions(tags):
+    """
+    Return a string identifying the current versions of ``tags``.
+    """
+    cache = get_cache()
+    keys = [_version_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Start from a unique value so an evicted tag never revives old entries.
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+async def atag_versions(tags):
+    """
+    Async version of tag_versions().
+    """
+    cache = get_cache()
+    keys = [_version_key(tag) for tag in tags]
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, time.time_ns(), None)
+            versions[key] = await cache.aget(key)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+def invalidate(*tags):
+    """
+    Bump the versions of ``tags`` now and again once the current transaction
+    commits, so a page re-rendered from not yet committed data is dropped too.
+    """
+    def bump():
+        get_cache().set_many({_version_key(tag): time.time_ns() for tag in tags}, None)
+
+    if tags:
+        bump()
+        transaction.on_commit(bump)
+
+
+def get_or_set_tagged(key, tags, compute):
+    """
+    Return ``compute()`` cached under ``key`` until one of ``tags`` is bumped.
+    """
+    cache = get_cache()
+    key = 'catalog:value:%s:%s' % (key, tag_versions(tags))
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, CACHE_TIMEOUT)
+    return value
+
+
+async def aget_or_set_tagged(key, tags, acompute):
+    """
+    Async version of get_or_set_tagged(), awaiting ``acompute()`` on a miss.
+    """
+    cache = get_cache()
+    key = 'catalog:value:%s:%s' % (key, await atag_versions(tags))
+    value = await cache.aget(key)
+    if value is None:
+        value = await acompute()
+        await cache.aset(key, value, CACHE_TIMEOUT)
+    return value
+
+
+def _page_key(request, versions):
+    url = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return 'catalog:page:%s:%s:%s' % (url, get_language(), versions)
+
+
+def page_cache_key(request, tags):
+    return _page_key(request, tag_versions(tags))
+
+
+async def aload_user(request):
+    """
+    Load ``request.user`` from async code. This resolves the lazy object
+    itself (in a thread) rather than calling ``request.auser()``, so the
+    sidebar rendered afterwards reuses the user instead of fetching it again.
+    """
+    await sync_to_async(getattr)(request.user, 'pk')
+    return request.user
+
+
+class CachedPageMixin:
+    """
+    Serve anonymous GET requests of an async view from the page cache. Views
+    list the tags their output depends on in ``get_cache_tags()``; the
+    versions of those tags are also put in the context as ``cache_version``
+    for fragment caching. Responses must be rendered (see
+    ``catalog.views.arender``) before they are returned.
+    """
+    cache_version = ''
+
+    def get_cache_tags(self):
+        return []
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cache_version'] = self.cache_version
+        context['cache_timeout'] = CACHE_TIMEOUT
+        return context
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return await super().dispatch(request, *args, **kwargs)
+
+        self.cache_version = await atag_versions(self.get_cache_tags())
+        user = await aload_user(request)
+        if user.is_authenticated:
+            return await super().dispatch(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = _page_key(request, self.cache_version)
+        response = await cache.aget(key)
+        if response is not None:
+            return response
+
+        response = await super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming and not response.cookies:
+            await cache.aset(key, response, CACHE_TIMEOUT)
+        return response
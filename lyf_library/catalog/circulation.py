@@ -0,0 +1,188 @@
+"""
+Bulk circulation: check out, return or renew many copies at once.
+
+Each call handles one batch in one transaction. The copies are locked with
+``select_for_update``, checked in memory and written back with one UPDATE of
+the changed columns (see ``save_copies``). Neither sends signals, so the
+index page counters, per-book copy counts and cached pages are brought up
+to date here for the whole batch. Every function returns one outcome dict per
+requested copy, in request order: ``{'id': ..., 'ok': bool, 'error': str}``.
+
+Each change is appended to the loan history (see catalog.history). Returned
+copies go to the books' waiting holds, and checking out a reserved
+copy to its holder fulfils the hold (see catalog.reservations).
+"""
+import datetime
+import uuid
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import availability, counters, history
+from .forms import renewal_date_error
+from .models import BookInstance, Hold, LoanEvent
+from .signals import invalidate_copy_pages
+
+# Default loan period for checkouts, as proposed by the renewal form.
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+# Most copies handled per request by the bulk circulation view.
+MAX_BATCH = 1000
+
+UPDATE_FIELDS = ['status', 'due_back', 'borrower', 'updated_at']
+
+
+def _outcome(copy_id, error=None):
+    return {'id': str(copy_id), 'ok': error is None, 'error': str(error) if error else ''}
+
+
+def _parse_id(copy_id):
+    try:
+        return uuid.UUID(str(copy_id).strip())
+    except ValueError:
+        return None
+
+
+def _process(items, allowed_statuses, status_error, change, kind):
+    """
+    Apply ``change(copy, value)`` to each ``(copy_id, value)`` in ``items``
+    whose copy exists and has one of ``allowed_statuses``, and record a
+    ``kind`` loan event for each. ``change`` returns an error message to skip
+    the copy.
+    """
+    items = list(items)
+    ids = {_parse_id(copy_id) for copy_id, value in items} - {None}
+    outcomes = []
+    with transaction.atomic():
+        copies = BookInstance.objects.select_for_update().only(
+            'id', 'book_id', 'status', 'due_back', 'borrower_id',
+        ).in_bulk(ids)
+        old_statuses = {pk: copy.status for pk, copy in copies.items()}
+        old_borrowers = {pk: copy.borrower_id for pk, copy in copies.items()}
+        now = timezone.now()
+        changed = {}
+        for copy_id, value in items:
+            pk = _parse_id(copy_id)
+            copy = copies.get(pk)
+            if pk is None:
+                error = 'Invalid copy id'
+            elif copy is None:
+                error = 'No such copy'
+            elif pk in changed:
+                error = 'Duplicate copy id'
+            elif copy.status not in allowed_statuses:
+                error = status_error
+            else:
+                error = change(copy, value)
+            if error is None:
+                copy.updated_at = now
+                changed[pk] = copy
+            outcomes.append(_outcome(copy_id, error))
+
+        save_copies(changed.values())
+        sync_copies(changed.values(), old_statuses)
+        if kind == LoanEvent.RETURN:
+            history.record(kind, changed.values(), old_borrowers)
+        else:
+            history.record(kind, changed.values())
+    return outcomes
+
+
+def save_copies(copies, fields=UPDATE_FIELDS):
+    """
+    Write ``fields`` of ``copies``: the values they all share with one plain
+    UPDATE, only the others with ``bulk_update``, whose CASE per row is
+    costly to build.
+    """
+    copies = list(copies)
+    if not copies:
+        return
+    shared, varying = {}, []
+    for name in fields:
+        attname = BookInstance._meta.get_field(name).attname
+        values = {getattr(copy, attname) for copy in copies}
+        if len(values) == 1:
+            shared[attname] = values.pop()
+        else:
+            varying.append(name)
+    if shared:
+        BookInstance.objects.filter(pk__in=[copy.pk for copy in copies]).update(**shared)
+    if varying:
+        BookInstance.objects.bulk_update(copies, varying, batch_size=1000)
+
+
+def sync_copies(copies, old_statuses):
+    """
+    Do for a batch of updated copies what the BookInstance signal handlers do
+    for a single save.
+    """
+    book_ids = {copy.book_id for copy in copies} - {None}
+    moved = {copy.book_id for copy in copies if copy.status != old_statuses[copy.pk]} - {None}
+    available = sum(int(copy.status == 'a') - int(old_statuses[copy.pk] == 'a') for copy in copies)
+    counters.adjust_counter('num_instances_available', available)
+    if moved:
+        availability.recount_books(moved)
+    invalidate_copy_pages(book_ids, bool(moved))
+
+
+def checkout(copy_ids, borrower, due_back=None):
+    """
+    Lend available copies, or copies reserved for ``borrower``, to
+    ``borrower`` until ``due_back`` (by default one loan period from today).
+    """
+    today = datetime.date.today()
+    due_back = due_back or today + LOAN_PERIOD
+    error = renewal_date_error(due_back, today)
+    picked_up = []
+
+    def change(copy, value):
+        if error:
+            return error
+        if copy.status == 'r':
+            if copy.borrower_id != borrower.pk:
+                return 'Copy is reserved for another borrower'
+            picked_up.append(copy.pk)
+        copy.status, copy.borrower, copy.due_back = 'o', borrower, due_back
+
+    with transaction.atomic():
+        outcomes = _process(
+            ((copy_id, None) for copy_id in copy_ids), ('a', 'r'), 'Copy is not available', change, LoanEvent.CHECKOUT,
+        )
+        if picked_up:
+            Hold.objects.ready().filter(copy__in=picked_up).update(status='f')
+    return outcomes
+
+
+def return_copies(copy_ids):
+    """
+    Mark copies on loan as returned and available again, then set them aside
+    for the next holds on their books.
+    """
+    # reservations builds on this module
+    from .reservations import allocate
+
+    book_ids = set()
+
+    def change(copy, value):
+        copy.status, copy.borrower, copy.due_back = 'a', None, None
+        book_ids.add(copy.book_id)
+
+    outcomes = _process(((copy_id, None) for copy_id in copy_ids), ('o',), 'Copy is not on loan', change, LoanEvent.RETURN)
+    allocate(book_ids - {None})
+    return outcomes
+
+
+def renew(renewals):
+    """
+    Extend loans; ``renewals`` holds ``(copy_id, renewal_date)`` pairs. Dates
+    follow the RenewBookForm rules.
+    """
+    today = datetime.date.today()
+
+    def change(copy, renewal_date):
+        error = renewal_date_error(renewal_date, today)
+        if error:
+            return error
+        copy.due_back = renewal_date
+
+    return _process(renewals, ('o',), 'Copy is not on loan', change, LoanEvent.RENEWAL)
@@ -0,0 +1,63 @@
+"""
+Conditional GET (ETag / Last-Modified) for the catalog pages.
+
+Each (async) view reports when the rows it renders last changed, computed with one
+aggregate query over the indexed ``updated_at`` columns (and cached under the
+page's cache tags). Requests whose ``If-None-Match`` / ``If-Modified-Since``
+still match get a 304 before any template is rendered.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
+
+from . import caching
+
+
+def latest(*timestamps):
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET/HEAD requests to an async view with 304 Not Modified when the
+    page is unchanged. Views implement ``aget_modification_state()`` returning
+    ``(last_modified, extra)`` where ``extra`` is anything else the page
+    depends on (such as row counts, which catch deletions). Return
+    ``(None, None)`` to skip the check.
+    """
+    async def aget_modification_state(self):
+        return None, None
+
+    def get_etag(self, last_modified, extra, user):
+        # The sidebar differs per user and the text per language
+        key = repr((self.request.get_full_path(), get_language(), user.pk or '', last_modified, extra))
+        return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return await super().dispatch(request, *args, **kwargs)
+
+        if hasattr(self, 'get_cache_tags'):
+            # Page-cached views change exactly when their tags are bumped, so
+            # the state can be cached under the same tags.
+            key = 'modified:%s:%s' % (type(self).__name__, ':'.join('%s=%s' % item for item in sorted(kwargs.items())))
+            last_modified, extra = await caching.aget_or_set_tagged(key, self.get_cache_tags(), self.aget_modification_state)
+        else:
+            last_modified, extra = await self.aget_modification_state()
+        if last_modified is None:
+            return await super().dispatch(request, *args, **kwargs)
+
+        etag = self.get_etag(last_modified, extra, await caching.aload_user(request))
+        timestamp = int(last_modified.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = await super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response.headers.setdefault('ETag', etag)
+        response.headers.setdefault('Last-Modified', http_date(timestamp))
+        patch_vary_headers(response, ('Cookie',))
+        return response
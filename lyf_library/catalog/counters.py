@@ -0,0 +1,104 @@
+"""
+Cached inventory counters shown on the index page.
+
+Each counter lives under its own cache key so that the signal handlers in
+``catalog.signals`` can adjust it with an atomic ``cache.incr``. A miss on any
+key rebuilds all of them with a single query.
+
+The keys expire after CATALOG_COUNTERS_TIMEOUT seconds. With a per-process
+cache (the default LocMemCache) an increment only reaches the process that
+handled the write, so the others are off until their keys expire and the
+one-query rebuild corrects them; a shared cache (memcached, Redis, the
+database cache) keeps every process exact in between.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import Author, Book, BookInstance
+
+COUNTER_KEYS = {
+    'num_books': 'catalog:counters:num_books',
+    'num_instances': 'catalog:counters:num_instances',
+    'num_instances_available': 'catalog:counters:num_instances_available',
+    'num_authors': 'catalog:counters:num_authors',
+}
+
+# Seconds before the counters are recounted, bounding drift between processes
+COUNTERS_TIMEOUT = getattr(settings, 'CATALOG_COUNTERS_TIMEOUT', 60)
+
+
+def compute_counters():
+    """
+    Count books, copies, available copies and authors in one query.
+    """
+    quote = connection.ops.quote_name
+    book_table = quote(Book._meta.db_table)
+    instance_table = quote(BookInstance._meta.db_table)
+    author_table = quote(Author._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT (SELECT COUNT(*) FROM %s), (SELECT COUNT(*) FROM %s), '
+            '(SELECT COUNT(*) FROM %s WHERE status = %%s), (SELECT COUNT(*) FROM %s)'
+            % (book_table, instance_table, instance_table, author_table),
+            ['a'],
+        )
+        row = cursor.fetchone()
+    return dict(zip(COUNTER_KEYS, row))
+
+
+def rebuild_counters():
+    """
+    Recount everything and store the result in the cache for COUNTERS_TIMEOUT.
+    """
+    counters = compute_counters()
+    cache.set_many({COUNTER_KEYS[name]: value for name, value in counters.items()}, timeout=COUNTERS_TIMEOUT)
+    return counters
+
+
+def get_counters():
+    """
+    Return the counters with one cache read, rebuilding them on a miss.
+    """
+    cached = cache.get_many(COUNTER_KEYS.values())
+    if len(cached) != len(COUNTER_KEYS):
+        return rebuild_counters()
+    return {name: cached[key] for name, key in COUNTER_KEYS.items()}
+
+
+async def aget_counters():
+    """
+    Async version of get_counters().
+    """
+    cached = await cache.aget_many(COUNTER_KEYS.values())
+    if len(cached) != len(COUNTER_KEYS):
+        # Still the one combined query: the async ORM would run separate
+        # counts one after another on the same connection anyway.
+        return await sync_to_async(rebuild_counters)()
+    return {name: cached[key] for name, key in COUNTER_KEYS.items()}
+
+
+def invalidate_counters():
+    """
+    Drop the cached counters so the next read rebuilds them. Used after bulk
+    writes that bypass the model signals.
+    """
+    cache.delete_many(COUNTER_KEYS.values())
+
+
+def adjust_counter(name, delta):
+    """
+    Add ``delta`` to a counter once the current transaction commits.
+    """
+    if not delta:
+        return
+
+    def apply():
+        try:
+            cache.incr(COUNTER_KEYS[name], delta)
+        except ValueError:
+            # The key was evicted; drop the others too so they are rebuilt together.
+            invalidate_counters()
+
+    transaction.on_commit(apply)
@@ -4,19 +4,63 @@ from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 import datetime #for checking renewal date range.
 
+from .autocomplete import AutocompleteSelect, AutocompleteSelectMultiple
+from .models import Book
+
+# Furthest a loan may be renewed (or checked out) ahead of today.
+MAX_RENEWAL = datetime.timedelta(weeks=4)
+
+
+def renewal_date_error(data, today=None):
+    """
+    Return why ``data`` is not an acceptable renewal date, or None. Pass
+    ``today`` when checking many dates so it is only computed once.
+    """
+    today = today or datetime.date.today()
+
+    #Check date is not in past.
+    if data < today:
+        return _('Invalid date - renewal in past')
+
+    #Check date is in range librarian allowed to change (+4 weeks).
+    if data > today + MAX_RENEWAL:
+        return _('Invalid date - renewal more than 4 weeks ahead')
+    return None
+
+
 class RenewBookForm(forms.Form):
     renewal_date = forms.DateField(help_text="Enter a date between now and 4 weeks (default 3).")
 
     def clean_renewal_date(self):
         data = self.cleaned_data['renewal_date']
 
-        #Check date is not in past.
-        if data < datetime.date.today():
-            raise ValidationError(_('Invalid date - renewal in past'))
-
-        #Check date is in range librarian allowed to change (+4 weeks).
-        if data > datetime.date.today() + datetime.timedelta(weeks=4):
-            raise ValidationError(_('Invalid date - renewal more than 4 weeks ahead'))
+        error = renewal_date_error(data)
+        if error:
+            raise ValidationError(error)
 
         # Remember to always return the cleaned data.
         return data
+
+
+class BulkCirculationForm(forms.Form):
+    """
+    Parameters of a bulk checkout, return or renewal. The dates are checked
+    per copy by catalog.circulation, so that each copy reports its own outcome.
+    """
+    borrower = forms.CharField(required=False)
+    due_back = forms.DateField(required=False)
+    renewal_date = forms.DateField(required=False)
+
+
+class BookForm(forms.ModelForm):
+    """
+    Book create/update form. The author and genre selects only render the
+    chosen values and search the rest through the autocomplete view.
+    """
+    class Meta:
+        model = Book
+        fields = '__all__'
+        widgets = {
+            'author': AutocompleteSelect('authors'),
+            'genre': AutocompleteSelectMultiple('genres'),
+        }
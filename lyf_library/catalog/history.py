@@ -0,0 +1,100 @@
+"""
+Loan history: the append-only LoanEvent log.
+
+The bulk circulation functions and the renewal view append one event per
+checkout, renewal and return (``record``); rows are never updated. Columns
+are kept small: a small integer kind, a date rather than a timestamp, and
+unconstrained foreign keys so the history outlives deleted copies, books and
+users. Ids grow with time, so a user's, a book's or a copy's history, newest
+first, is a range of one ``(..., -id)`` index and costs the same at 100M rows
+as at 100.
+
+The ``day`` index splits the table into months. ``archive_month`` moves a
+month out to ``loan-events-YYYY-MM.csv.gz`` (run by ``manage.py
+archive_loan_events`` for months past CATALOG_LOAN_HISTORY_MONTHS), and
+``read_archive`` reads such a file back.
+"""
+import csv
+import datetime
+import gzip
+import os
+import uuid
+
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from .models import LoanEvent
+
+FIELDS = ['id', 'kind', 'day', 'copy_id', 'book_id', 'borrower_id', 'due_back']
+
+PARSERS = {'day': parse_date, 'due_back': parse_date, 'copy_id': uuid.UUID}
+
+
+def record(kind, copies, borrower_ids=None):
+    """
+    Append a ``kind`` event for each of ``copies``, for its borrower or, when
+    given, for ``borrower_ids[copy.pk]`` (the borrower a return ended).
+    """
+    borrower_ids = borrower_ids or {}
+    today = datetime.date.today()
+    LoanEvent.objects.bulk_create([
+        LoanEvent(
+            kind=kind, day=today, copy_id=copy.pk, book_id=copy.book_id,
+            borrower_id=borrower_ids.get(copy.pk, copy.borrower_id), due_back=copy.due_back,
+        )
+        for copy in copies
+    ], batch_size=1000)
+
+
+def month_start(day, months=0):
+    """
+    The first day of the month ``months`` after the month of ``day``.
+    """
+    index = day.year * 12 + day.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def archive_name(month):
+    return 'loan-events-%04d-%02d.csv.gz' % (month.year, month.month)
+
+
+def archive_month(month, directory, batch_size=10000):
+    """
+    Move the events of the month of ``month`` to a gzipped CSV file in
+    ``directory``. The file is complete before anything is deleted, and the
+    deletes share one transaction, so an interrupted run can be repeated.
+    Return the file path and the number of events moved.
+    """
+    start = month_start(month)
+    events = LoanEvent.objects.filter(day__gte=start, day__lt=month_start(start, 1))
+    path = os.path.join(directory, archive_name(start))
+    os.makedirs(directory, exist_ok=True)
+    ranges = []
+    count = 0
+    with gzip.open(path + '.tmp', 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        rows = events.order_by('id').values_list(*FIELDS).iterator(chunk_size=batch_size)
+        for row in rows:
+            if count % batch_size == 0:
+                ranges.append([row[0], row[0]])
+            ranges[-1][1] = row[0]
+            writer.writerow(['' if value is None else value for value in row])
+            count += 1
+    os.replace(path + '.tmp', path)
+    with transaction.atomic():
+        for first, last in ranges:
+            events.filter(id__gte=first, id__lte=last).delete()
+    return path, count
+
+
+def read_archive(path):
+    """
+    Yield the events of an archive file as dicts of LoanEvent field values.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            yield {
+                name: PARSERS.get(name, int)(value) if value else None
+                for name, value in row.items()
+            }
@@ -0,0 +1,235 @@
+"""
+Streaming bulk import of authors, genres, books and copies.
+
+Input files are CSV (with a header row) or JSON lines (``.jsonl``), optionally
+gzipped. Rows are read one at a time and written with ``bulk_create`` in
+batches, one transaction per batch, so memory use does not grow with the file.
+
+Row fields:
+
+* authors: ``first_name``, ``last_name``, ``date_of_birth``, ``date_of_death``
+* genres: ``name``
+* books: ``title``, ``summary``, ``isbn``, ``author_first_name``,
+  ``author_last_name``, ``genres`` (a list, or ``;``-separated in CSV)
+* copies: ``isbn``, ``imprint``, ``status``, ``due_back``, optional ``id``
+
+Authors and genres are matched by name through in-memory maps and created when
+missing; copies are matched to books by ISBN one batch at a time. Rows that
+cannot be imported are skipped, and the reasons counted in ``skip_reasons``.
+"""
+import collections
+import csv
+import gzip
+import itertools
+import json
+import uuid
+
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from . import availability, caching, counters, search
+from .models import Author, Book, BookInstance, Genre
+from .signals import invalidate_copy_pages
+
+LOAN_STATUSES = {code for code, label in BookInstance.LOAN_STATUS}
+
+
+def read_rows(path):
+    """
+    Yield the rows of a CSV or JSON lines file as dicts, one at a time.
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if name.endswith(('.jsonl', '.ndjson')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _text(row, field):
+    return (row.get(field) or '').strip()
+
+
+def _date(row, field):
+    """
+    Parse an optional ISO date, raising ValueError when it is malformed or
+    impossible (such as 2024-02-30).
+    """
+    value = _text(row, field)
+    if not value:
+        return None
+    date = parse_date(value)
+    if date is None:
+        raise ValueError('%r is not a date' % value)
+    return date
+
+
+class CatalogImporter:
+    """
+    Import catalog rows in batches of ``batch_size``. Each ``import_*`` method
+    takes an iterable of row dicts and returns ``(imported, skipped)``; the
+    reasons rows were skipped for are counted in ``skip_reasons``.
+    """
+    def __init__(self, batch_size=1000, update_search_index=True):
+        self.batch_size = batch_size
+        self.update_search_index = update_search_index
+        self.author_ids = None
+        self.genre_ids = None
+        self.skip_reasons = collections.Counter()
+
+    def _load_lookups(self):
+        if self.author_ids is None:
+            self.author_ids = {
+                (first_name, last_name): pk
+                for pk, first_name, last_name in Author.objects.values_list('pk', 'first_name', 'last_name').iterator()
+            }
+            self.genre_ids = dict(Genre.objects.values_list('name', 'pk').iterator())
+
+    def _create_authors(self, authors):
+        # bulk_create skips save(), which keeps the search key
+        for author in authors:
+            author.search_key = author.make_search_key()
+        Author.objects.bulk_create(authors, batch_size=self.batch_size)
+        for author in authors:
+            self.author_ids[(author.first_name, author.last_name)] = author.pk
+
+    def _resolve_genres(self, names):
+        new = [Genre(name=name) for name in dict.fromkeys(names) if name not in self.genre_ids]
+        Genre.objects.bulk_create(new, batch_size=self.batch_size)
+        for genre in new:
+            self.genre_ids[genre.name] = genre.pk
+
+    def _run(self, rows, import_batch):
+        imported = skipped = 0
+        self.skip_reasons = collections.Counter()
+        self._load_lookups()
+        for batch in batched(rows, self.batch_size):
+            with transaction.atomic():
+                done = import_batch(batch)
+            imported += done
+            skipped += len(batch) - done
+        # bulk_create bypasses the signals that keep the index page counters
+        # and the cached pages current (per-book copy counts are recounted
+        # batch by batch instead)
+        counters.invalidate_counters()
+        caching.invalidate('authors', 'books', 'genres')
+        return imported, skipped
+
+    def import_authors(self, rows):
+        def import_batch(batch):
+            authors = {}
+            for row in batch:
+                key = (_text(row, 'first_name'), _text(row, 'last_name'))
+                if not key[1]:
+                    self.skip_reasons['no last_name'] += 1
+                    continue
+                if key in self.author_ids or key in authors:
+                    self.skip_reasons['already exists'] += 1
+                    continue
+                try:
+                    dates = {field: _date(row, field) for field in ('date_of_birth', 'date_of_death')}
+                except ValueError:
+                    self.skip_reasons['invalid date'] += 1
+                    continue
+                authors[key] = Author(first_name=key[0], last_name=key[1], **dates)
+            self._create_authors(list(authors.values()))
+            return len(authors)
+        return self._run(rows, import_batch)
+
+    def import_genres(self, rows):
+        def import_batch(batch):
+            names = [_text(row, 'name') for row in batch]
+            new = [name for name in dict.fromkeys(names) if name and name not in self.genre_ids]
+            self._resolve_genres(new)
+            return len(new)
+        return self._run(rows, import_batch)
+
+    def import_books(self, rows):
+        def import_batch(batch):
+            books = []
+            book_genres = []
+            new_authors = {}
+            for row in batch:
+                title = _text(row, 'title')
+                if not title:
+                    self.skip_reasons['no title'] += 1
+                    continue
+                author_key = (_text(row, 'author_first_name'), _text(row, 'author_last_name'))
+                if author_key[1] and author_key not in self.author_ids:
+                    new_authors[author_key] = Author(first_name=author_key[0], last_name=author_key[1])
+                genres = row.get('genres') or []
+                if isinstance(genres, str):
+                    genres = genres.split(';')
+                books.append((Book(title=title, summary=_text(row, 'summary'), isbn=_text(row, 'isbn')), author_key))
+                book_genres.append([name.strip() for name in genres if name.strip()])
+
+            self._create_authors(list(new_authors.values()))
+            for book, author_key in books:
+                book.author_id = self.author_ids.get(author_key)
+                book.search_key = book.make_search_key()
+            Book.objects.bulk_create([book for book, author_key in books], batch_size=self.batch_size)
+
+            # Genre links go straight into the through table
+            self._resolve_genres([name for names in book_genres for name in names])
+            Through = Book.genre.through
+            links = [
+                Through(book_id=book.pk, genre_id=self.genre_ids[name])
+                for (book, author_key), names in zip(books, book_genres)
+                for name in dict.fromkeys(names)
+            ]
+            Through.objects.bulk_create(links, batch_size=self.batch_size)
+
+            if self.update_search_index:
+                search.index_books([book.pk for book, author_key in books])
+            return len(books)
+        return self._run(rows, import_batch)
+
+    def import_copies(self, rows):
+        def import_batch(batch):
+            isbns = {_text(row, 'isbn') for row in batch}
+            # Books are looked up per batch rather than held in memory; with
+            # duplicate ISBNs the first book wins.
+            book_ids = {}
+            for pk, isbn in Book.objects.filter(isbn__in=isbns).order_by('-pk').values_list('pk', 'isbn'):
+                book_ids[isbn] = pk
+            copies = []
+            for row in batch:
+                book_id = book_ids.get(_text(row, 'isbn'))
+                if book_id is None:
+                    self.skip_reasons['unknown isbn'] += 1
+                    continue
+                status = _text(row, 'status') or 'a'
+                if status not in LOAN_STATUSES:
+                    self.skip_reasons['invalid status'] += 1
+                    continue
+                copy_id = _text(row, 'id')
+                try:
+                    copy_id = uuid.UUID(copy_id) if copy_id else uuid.uuid4()
+                except ValueError:
+                    self.skip_reasons['invalid id'] += 1
+                    continue
+                try:
+                    due_back = _date(row, 'due_back')
+                except ValueError:
+                    self.skip_reasons['invalid due_back'] += 1
+                    continue
+                copies.append(BookInstance(
+                    id=copy_id, book_id=book_id, imprint=_text(row, 'imprint'), status=status, due_back=due_back,
+                ))
+            BookInstance.objects.bulk_create(copies, batch_size=self.batch_size)
+            availability.recount_books({copy.book_id for copy in copies})
+            invalidate_copy_pages({copy.book_id for copy in copies}, True)
+            return len(copies)
+        return self._run(rows, import_batch)
@@ -0,0 +1,240 @@
+"""
+Per-request timing and query instrumentation.
+
+``InstrumentationMiddleware`` measures each request's wall time, the number
+and duration of its database queries (through an execute wrapper installed on
+every connection), the time spent rendering templates (through the
+``InstrumentedDjangoTemplates`` backend) and the response size. Each response
+gets a ``Server-Timing`` header, and samples are kept per view in a bounded
+in-process buffer, summarised as percentiles by ``metrics_summary()`` for the
+staff-only metrics page.
+
+With ``'profile': True`` in the backend's OPTIONS, every ``{% block %}`` is
+timed too (see ``catalog.templatetags.catalog_profiling``) and
+``template_profiler`` accumulates the time per page template and block;
+``manage.py profile_templates`` reports it.
+
+The measurements live in a context variable, so they follow a request into
+``sync_to_async`` threads, and cost a few clock reads per query when enabled.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+# Samples kept per view (the oldest are dropped first).
+MAX_SAMPLES = getattr(settings, 'CATALOG_METRICS_SAMPLES', 1000)
+
+METRICS = ['wall_ms', 'db_ms', 'queries', 'template_ms', 'size']
+
+current_metrics = contextvars.ContextVar('catalog_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting and timing the queries of the current request.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def install_query_wrapper(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TemplateProfiler:
+    """
+    Thread-safe totals of render time per (page template, block); the block
+    None is the whole page. Block times include their nested blocks.
+    """
+    def __init__(self):
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def add(self, template, block, seconds):
+        with self.lock:
+            timing = self.timings.setdefault((template, block), [0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+
+    def clear(self):
+        with self.lock:
+            self.timings.clear()
+
+    def report(self):
+        """
+        Return one dict per (template, block), slowest templates first and
+        each template's blocks by total time, with their share of the page.
+        """
+        with self.lock:
+            timings = {key: tuple(value) for key, value in self.timings.items()}
+        pages = {template: total for (template, block), (calls, total) in timings.items() if block is None}
+        rows = [
+            {
+                'template': template, 'block': block, 'calls': calls,
+                'total_ms': round(total * 1000, 2), 'mean_ms': round(total * 1000 / calls, 3),
+                'share': round(total / pages[template], 3) if pages.get(template) else None,
+            }
+            for (template, block), (calls, total) in timings.items()
+        ]
+        rows.sort(key=lambda row: (-pages.get(row['template'], 0), row['block'] is not None, -row['total_ms']))
+        return rows
+
+
+template_profiler = TemplateProfiler()
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = current_metrics.get()
+        if metrics is None and not self.backend.profile:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            elapsed = time.perf_counter() - start
+            if metrics is not None:
+                metrics.template_time += elapsed
+            if self.backend.profile:
+                template_profiler.add(self.origin.template_name, None, elapsed)
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing each top-level template render and,
+    with the ``profile`` option, each block.
+    """
+    def __init__(self, params):
+        params = params.copy()
+        options = params['OPTIONS'] = params.get('OPTIONS', {}).copy()
+        self.profile = options.pop('profile', False)
+        if self.profile:
+            # Later builtins win, so this {% block %} replaces Django's
+            options['builtins'] = [*options.get('builtins', []), 'catalog.templatetags.catalog_profiling']
+        super().__init__(params)
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return InstrumentedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class MetricsRegistry:
+    """
+    Thread-safe per-view buffers of the last MAX_SAMPLES request samples.
+    """
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, view, sample):
+        with self.lock:
+            if view not in self.samples:
+                self.samples[view] = deque(maxlen=self.max_samples)
+            self.samples[view].append(sample)
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """
+        Return {view: {'count': n, metric: {'p50': ..., ...}}} over the kept samples.
+        """
+        with self.lock:
+            samples = {view: list(view_samples) for view, view_samples in self.samples.items()}
+        summary = {}
+        for view, view_samples in sorted(samples.items()):
+            summary[view] = {'count': len(view_samples)}
+            for index, metric in enumerate(METRICS):
+                values = sorted(sample[index] for sample in view_samples if sample[index] is not None)
+                summary[view][metric] = {
+                    'p%d' % p: values[min(len(values) - 1, len(values) * p // 100)] for p in percentiles
+                } if values else {}
+        return summary
+
+
+registry = MetricsRegistry()
+
+
+def metrics_summary():
+    return registry.summary()
+
+
+class InstrumentationMiddleware:
+    """
+    Measure every request; see the module docstring. Put it first in
+    MIDDLEWARE so the timings cover the other middleware too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(install_query_wrapper)
+        for connection in connections.all(initialized_only=True):
+            install_query_wrapper(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        wall_ms = (time.perf_counter() - metrics.start) * 1000
+        db_ms = metrics.db_time * 1000
+        template_ms = metrics.template_time * 1000
+        size = None if response.streaming else len(response.content)
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        registry.add(view, (wall_ms, db_ms, metrics.queries, template_ms, size))
+        response['Server-Timing'] = 'total;dur=%.1f, db;dur=%.1f;desc="%d queries", tpl;dur=%.1f' % (
+            wall_ms, db_ms, metrics.queries, template_ms,
+        )
+        return response
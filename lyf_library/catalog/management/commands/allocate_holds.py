@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog import reservations
+
+
+class Command(BaseCommand):
+    help = (
+        'Expire holds not collected in time and set aside the available copies of every book with waiting holds, '
+        'in batched transactions. Returns allocate as they happen; run this periodically to expire holds and to '
+        'catch up after imports or direct database changes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=reservations.ALLOCATION_BATCH, help='Books (or holds) per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        expired = reservations.expire_holds(batch_size=options['batch_size'])
+        allocated = reservations.allocate(batch_size=options['batch_size'])
+        self.stdout.write('%d holds expired, %d holds ready (%.1fs)' % (expired, allocated, time.monotonic() - start))
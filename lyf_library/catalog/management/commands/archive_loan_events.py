@@ -0,0 +1,36 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import history, rollups
+from catalog.models import LoanEvent
+
+
+class Command(BaseCommand):
+    help = (
+        'Move loan events older than CATALOG_LOAN_HISTORY_MONTHS (or --keep-months) to gzipped CSV files, '
+        'one per month, and delete them from the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-months', type=int, default=settings.CATALOG_LOAN_HISTORY_MONTHS,
+            help='Months of history to keep in the database, the current one included.',
+        )
+        parser.add_argument('--directory', default=settings.LOAN_ARCHIVE_DIR, help='Where to write the files.')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Events per DELETE.')
+
+    def handle(self, *args, **options):
+        if options['keep_months'] < 1:
+            raise CommandError('--keep-months must be at least 1 (the current month is still being written).')
+        cutoff = history.month_start(datetime.date.today(), 1 - options['keep_months'])
+        older = LoanEvent.objects.filter(day__lt=cutoff).order_by('day').values_list('day', flat=True)
+        if older.filter(id__gt=rollups.watermark()).exists():
+            raise CommandError('Some of these events are not in the rollups yet; run refresh_rollups first.')
+        # Archived months are gone, so the oldest event left starts the next month to archive
+        oldest = older.first()
+        while oldest is not None:
+            path, count = history.archive_month(oldest, options['directory'], options['batch_size'])
+            self.stdout.write('%s: %d events moved to %s' % (oldest.strftime('%Y-%m'), count, path))
+            oldest = older.first()
@@ -0,0 +1,102 @@
+import json
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from catalog import benchmarks
+from catalog.models import Book
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic catalog (optional) and benchmark every catalog URL and the admin changelists. '
+        'The circulation and hold POSTs, --contention and --holds change loans, so they only run after --seed '
+        'or with --allow-writes; otherwise the run is read-only and rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', choices=sorted(benchmarks.SIZES), help='Seed this many books first.')
+        parser.add_argument('--force-seed', action='store_true', help='Seed even if the catalog is not empty.')
+        parser.add_argument('--iterations', type=int, default=20, help='Warm requests per scenario (test client).')
+        parser.add_argument('--server', action='store_true', help='Also load-test through a local WSGI server.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario (server).')
+        parser.add_argument('--concurrency', type=int, default=10, help='Concurrent requests (server).')
+        parser.add_argument(
+            '--contention', type=float, metavar='SECONDS',
+            help='Also time concurrent reads while loans are renewed, for this long.',
+        )
+        parser.add_argument('--readers', type=int, default=4, help='Reader threads (contention).')
+        parser.add_argument(
+            '--holds', type=int, metavar='N',
+            help='Also queue N holds and time their allocation while every loan is returned in parallel.',
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Returning threads (holds).')
+        parser.add_argument(
+            '--allow-writes', action='store_true',
+            help='Run the scenarios that change loans and holds (and create the benchmark librarian) '
+                 'without --seed. Only on a scratch database.',
+        )
+        parser.add_argument('--only', nargs='+', help='Only run the scenarios with these names.')
+        parser.add_argument('--host', default='localhost', help='Host header (must be in ALLOWED_HOSTS).')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+        parser.add_argument('--compare', help='Baseline JSON results; fail on regressions.')
+        parser.add_argument('--threshold', type=float, default=1.2, help='Allowed p50 slowdown factor.')
+
+    def handle(self, *args, **options):
+        writes = bool(options['seed']) or options['allow_writes']
+        if not writes and (options['contention'] or options['holds']):
+            raise CommandError('--contention and --holds change loans; use them with --seed or --allow-writes.')
+        if not writes:
+            self.stderr.write(
+                'Read-only run: the POST scenarios are skipped, the staff pages run in a rolled-back transaction '
+                '(and are skipped with --server). Use --seed or --allow-writes on a scratch database for all of them.'
+            )
+        if options['seed']:
+            if Book.objects.exists() and not options['force_seed']:
+                raise CommandError('The catalog is not empty; use --force-seed to add the dataset anyway.')
+            start = time.monotonic()
+            created = benchmarks.seed(benchmarks.SIZES[options['seed']])
+            self.stderr.write('Seeded %s in %.1fs' % (created, time.monotonic() - start))
+
+        results = {
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'database': connection.vendor,
+            'dataset': benchmarks.dataset_size(),
+            'client': benchmarks.run_client(options['iterations'], options['host'], options['only'], writes),
+        }
+        if options['server']:
+            results['server'] = benchmarks.run_server(options['requests'], options['concurrency'], options['only'], writes)
+
+        if options['contention']:
+            results['contention'] = benchmarks.run_contention(options['contention'], options['readers'])
+
+        if options['holds']:
+            results['holds'] = benchmarks.run_holds(options['holds'], options['workers'])
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                regressions = benchmarks.compare(json.load(f), results, options['threshold'])
+            for regression in regressions:
+                self.stderr.write('REGRESSION %s' % regression)
+            if regressions:
+                raise CommandError('%d regressions against %s' % (len(regressions), options['compare']))
@@ -0,0 +1,119 @@
+import asyncio
+import io
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+
+DEFAULT_PATHS = ['/catalog/', '/catalog/api/books/?limit=20', '/catalog/search/?q=the']
+
+
+def wsgi_get(application, host, url):
+    """
+    Send one GET through the WSGI handler; return the status code.
+    """
+    url = urlsplit(url)
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': host,
+        'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False, 'wsgi.version': (1, 0),
+    }
+    status = []
+    response = application(environ, lambda code, headers, exc_info=None: status.append(code))
+    for chunk in response:
+        pass
+    response.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_get(application, host, url):
+    """
+    Send one GET through the ASGI handler; return the status code.
+    """
+    url = urlsplit(url)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': url.path, 'raw_path': url.path.encode(), 'query_string': url.query.encode(), 'root_path': '',
+        'headers': [(b'host', host.encode())], 'client': ('127.0.0.1', 0), 'server': (host, 80),
+    }
+    sent = False
+    status = []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # The client never disconnects; Django cancels this once it has responded
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    return status[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the throughput of the sync WSGI and async ASGI handlers under concurrent GETs, '
+        'in process (no server or network involved).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Paths to request (default: %s).' % ' '.join(DEFAULT_PATHS))
+        parser.add_argument('--requests', type=int, default=500, help='Requests per path and handler.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once.')
+        parser.add_argument('--host', default='localhost', help='Host header (must be in ALLOWED_HOSTS).')
+
+    def report(self, name, path, latencies, statuses, elapsed):
+        latencies.sort()
+        errors = sum(status >= 400 for status in statuses)
+        self.stdout.write('%-5s %-40s %7.0f req/s  p50 %6.1fms  p95 %6.1fms  errors %d' % (
+            name, path, len(latencies) / elapsed, statistics.median(latencies) * 1000,
+            latencies[int(len(latencies) * 0.95) - 1] * 1000, errors,
+        ))
+
+    def run_wsgi(self, path, options):
+        application = get_wsgi_application()
+
+        def timed(_):
+            start = time.perf_counter()
+            status = wsgi_get(application, options['host'], path)
+            return time.perf_counter() - start, status
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            results = list(pool.map(timed, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+        self.report('wsgi', path, [latency for latency, status in results], [status for latency, status in results], elapsed)
+
+    def run_asgi(self, path, options):
+        application = get_asgi_application()
+
+        async def run():
+            semaphore = asyncio.Semaphore(options['concurrency'])
+
+            async def timed():
+                async with semaphore:
+                    start = time.perf_counter()
+                    status = await asgi_get(application, options['host'], path)
+                    return time.perf_counter() - start, status
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(timed() for i in range(options['requests'])))
+            return results, time.perf_counter() - start
+
+        results, elapsed = asyncio.run(run())
+        self.report('asgi', path, [latency for latency, status in results], [status for latency, status in results], elapsed)
+
+    def handle(self, *args, **options):
+        for path in options['paths'] or DEFAULT_PATHS:
+            self.run_wsgi(path, options)
+            self.run_asgi(path, options)
@@ -0,0 +1,63 @@
+import re
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from catalog import circulation
+from catalog.importing import batched
+
+
+def parse_day(value):
+    date = parse_date(value)
+    if date is None:
+        raise ValueError(value)
+    return date
+
+
+class Command(BaseCommand):
+    help = 'Check out, return or renew many copies, one transaction per batch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['checkout', 'return', 'renew'])
+        parser.add_argument('ids', nargs='*', help='Copy UUIDs.')
+        parser.add_argument('--file', help='File of copy UUIDs, separated by commas or whitespace.')
+        parser.add_argument('--borrower', help='Username to lend the copies to (checkout).')
+        parser.add_argument('--due-back', type=parse_day, help='Due date for checkouts (default: in 3 weeks).')
+        parser.add_argument('--renewal-date', type=parse_day, help='New due date (renew).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Copies per transaction.')
+
+    def copy_ids(self, options):
+        yield from options['ids']
+        if options['file']:
+            with open(options['file'], encoding='utf-8') as f:
+                for line in f:
+                    yield from (copy_id for copy_id in re.split(r'[\s,]+', line) if copy_id)
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'checkout':
+            borrower = User.objects.filter(username=options['borrower'] or '').first()
+            if borrower is None:
+                raise CommandError('checkout needs the --borrower username of an existing user.')
+            process = lambda batch: circulation.checkout(batch, borrower, options['due_back'])
+        elif action == 'return':
+            process = circulation.return_copies
+        else:
+            if options['renewal_date'] is None:
+                raise CommandError('renew needs a --renewal-date.')
+            process = lambda batch: circulation.renew([(copy_id, options['renewal_date']) for copy_id in batch])
+
+        start = time.monotonic()
+        succeeded = failed = 0
+        for batch in batched(self.copy_ids(options), options['batch_size']):
+            for outcome in process(batch):
+                if outcome['ok']:
+                    succeeded += 1
+                else:
+                    failed += 1
+                    self.stderr.write('%s: %s' % (outcome['id'], outcome['error']))
+        self.stdout.write('%s: %d succeeded, %d failed in %.1fs' % (
+            action, succeeded, failed, time.monotonic() - start,
+        ))
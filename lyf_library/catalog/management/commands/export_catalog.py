@@ -0,0 +1,37 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.exporting import FORMATS, export_lines, gzip_stream
+
+
+class Command(BaseCommand):
+    help = 'Stream the whole catalog (books with author, genres and copy counts) as CSV or JSON lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Output file, or '-' for standard output.")
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Books fetched per database round trip.')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        lines = export_lines(options['format'], chunk_size=options['chunk_size'])
+        chunks = gzip_stream(lines) if options['gzip'] else (line.encode('utf-8') for line in lines)
+
+        if options['output'] == '-':
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+            return
+
+        size = 0
+        with open(options['output'], 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        self.stdout.write(self.style.SUCCESS(
+            'Wrote %d bytes to %s in %.1fs.' % (size, options['output'], time.monotonic() - start)
+        ))
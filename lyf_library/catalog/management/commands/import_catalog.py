@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.importing import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Bulk import authors, genres, books and copies from CSV or JSON lines files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authors', help='Authors file (first_name, last_name, date_of_birth, date_of_death).')
+        parser.add_argument('--genres', help='Genres file (name).')
+        parser.add_argument('--books', help='Books file (title, summary, isbn, author_first_name, author_last_name, genres).')
+        parser.add_argument('--copies', help='Copies file (isbn, imprint, status, due_back, id).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per bulk insert and transaction.')
+        parser.add_argument(
+            '--skip-search-index', action='store_true',
+            help='Do not index imported books; run rebuild_search_index afterwards instead.',
+        )
+
+    def handle(self, *args, **options):
+        importer = CatalogImporter(
+            batch_size=options['batch_size'], update_search_index=not options['skip_search_index'],
+        )
+        # Authors and genres first so books can link to them
+        for kind in ('authors', 'genres', 'books', 'copies'):
+            path = options[kind]
+            if not path:
+                continue
+            start = time.monotonic()
+            imported, skipped = getattr(importer, 'import_%s' % kind)(read_rows(path))
+            elapsed = time.monotonic() - start
+            self.stdout.write('%s: %d imported, %d skipped in %.1fs (%d rows/s)' % (
+                kind, imported, skipped, elapsed, (imported + skipped) / elapsed if elapsed else 0,
+            ))
+            for reason, count in sorted(importer.skip_reasons.items()):
+                self.stdout.write('  %d skipped: %s' % (count, reason))
@@ -0,0 +1,64 @@
+import csv
+import itertools
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from catalog.models import BookInstance
+
+
+def parse_day(value):
+    date = parse_date(value)
+    if date is None:
+        raise ValueError(value)
+    return date
+
+
+class Command(BaseCommand):
+    help = 'Stream the overdue loans grouped by borrower, oldest due date first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', type=parse_day, help='Report as of this date (default: today).')
+        parser.add_argument('--format', choices=['text', 'csv'], default='text')
+        parser.add_argument('--count-only', action='store_true', help='Only print the number of overdue loans.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Loans fetched per round trip.')
+
+    def handle(self, *args, **options):
+        overdue = BookInstance.objects.overdue(options['as_of'])
+        if options['count_only']:
+            self.stdout.write(str(overdue.count()))
+            return
+
+        # Sorted by the database, so the loans stream in borrower groups
+        # without being loaded into memory all at once
+        loans = (
+            overdue.select_related('book', 'borrower')
+            .only('id', 'due_back', 'book__title', 'borrower__username')
+            .order_by('borrower_id', 'due_back', 'id')
+            .iterator(chunk_size=options['chunk_size'])
+        )
+        groups = itertools.groupby(loans, key=lambda loan: loan.borrower_id)
+        if options['format'] == 'csv':
+            self.write_csv(groups)
+        else:
+            self.write_text(groups)
+
+    def write_csv(self, groups):
+        writer = csv.writer(self.stdout)
+        writer.writerow(['borrower', 'copy', 'title', 'due_back'])
+        for borrower_id, loans in groups:
+            for loan in loans:
+                username = loan.borrower.username if loan.borrower else ''
+                writer.writerow([username, loan.pk, loan.book.title if loan.book else '', loan.due_back])
+
+    def write_text(self, groups):
+        total = borrowers = 0
+        for borrower_id, loans in groups:
+            loans = list(loans)
+            borrower = loans[0].borrower
+            self.stdout.write('%s (%d overdue)' % (borrower.username if borrower else '(no borrower)', len(loans)))
+            for loan in loans:
+                self.stdout.write('  %s  %s  %s' % (loan.due_back, loan.pk, loan.book.title if loan.book else ''))
+            total += len(loans)
+            borrowers += 1
+        self.stdout.write('%d overdue loans, %d borrowers' % (total, borrowers))
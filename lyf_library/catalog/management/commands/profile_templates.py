@@ -0,0 +1,67 @@
+import copy
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+
+from catalog import benchmarks
+from catalog.instrumentation import template_profiler
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the catalog pages with block profiling and report the render time of each page template and '
+        'of each {% block %} in it. Creates the benchmark librarian for the staff pages.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Requests per page.')
+        parser.add_argument('--only', nargs='+', help='Only request the benchmark scenarios with these names.')
+        parser.add_argument('--host', default='localhost', help='Host header (must be in ALLOWED_HOSTS).')
+        parser.add_argument(
+            '--page-cache', action='store_true',
+            help='Keep the page cache on (by default every request renders its template).',
+        )
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        templates = copy.deepcopy(settings.TEMPLATES)
+        for template in templates:
+            if template['BACKEND'] == 'catalog.instrumentation.InstrumentedDjangoTemplates':
+                template.setdefault('OPTIONS', {})['profile'] = True
+        overrides = {'TEMPLATES': templates}
+        if not options['page_cache']:
+            overrides['CACHES'] = {
+                **settings.CACHES, 'profiling': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+            }
+            overrides['CATALOG_PAGE_CACHE'] = 'profiling'
+
+        # Only GETs are profiled; the librarian and its session are rolled back
+        with override_settings(**overrides), transaction.atomic():
+            anonymous = Client(HTTP_HOST=options['host'])
+            staff = Client(HTTP_HOST=options['host'])
+            staff.force_login(benchmarks.get_librarian())
+            template_profiler.clear()
+            for scenario in benchmarks.scenarios(writes=False):
+                if scenario['method'] != 'GET' or not scenario['repeat']:
+                    continue
+                if options['only'] and scenario['name'] not in options['only']:
+                    continue
+                client = staff if scenario['staff'] else anonymous
+                for i in range(options['iterations']):
+                    client.get(scenario['path'])
+            report = template_profiler.report()
+            transaction.set_rollback(True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write('%-50s %-20s %7s %10s %9s %6s' % ('template', 'block', 'calls', 'total ms', 'mean ms', 'share'))
+        for row in report:
+            self.stdout.write('%-50s %-20s %7d %10.2f %9.3f %6s' % (
+                row['template'] if row['block'] is None else '', row['block'] or '(page)', row['calls'],
+                row['total_ms'], row['mean_ms'], '' if row['share'] is None else '%.0f%%' % (row['share'] * 100),
+            ))
@@ -0,0 +1,45 @@
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the index page counters in the configured cache with the database and store fresh ones. '
+        'This reaches the web processes only when the cache is shared (not LocMemCache); '
+        'otherwise each process recounts when its keys expire (CATALOG_COUNTERS_TIMEOUT).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only', action='store_true',
+            help='Only compare the cached counters with the database; fail if they differ.',
+        )
+
+    def handle(self, *args, **options):
+        if isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+            self.stdout.write(self.style.WARNING(
+                'The cache is local to this process: the web processes are not checked or updated.'
+            ))
+        actual = counters.compute_counters()
+        cached = cache.get_many(counters.COUNTER_KEYS.values())
+
+        drift = False
+        for name, key in counters.COUNTER_KEYS.items():
+            if key not in cached:
+                self.stdout.write('%s: not cached (actual %d)' % (name, actual[name]))
+            elif cached[key] != actual[name]:
+                drift = True
+                self.stdout.write(self.style.WARNING('%s: cached %d, actual %d' % (name, cached[key], actual[name])))
+            else:
+                self.stdout.write('%s: %d' % (name, actual[name]))
+
+        if options['verify_only']:
+            if drift:
+                raise CommandError('Cached counters differ from the database.')
+            return
+
+        counters.rebuild_counters()
+        self.stdout.write(self.style.SUCCESS('Counters rebuilt.'))
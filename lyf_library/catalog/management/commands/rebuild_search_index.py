@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text catalog search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Books indexed per batch.')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        with transaction.atomic():
+            total = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed %d books with %s in %.1fs.' % (total, type(search.get_backend()).__name__, time.monotonic() - start)
+        ))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.availability import recount_books
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored per-book copy counts and fix any that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Books checked per UPDATE.')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        fixed = recount_books(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Corrected the copy counts of %d books in %.1fs.' % (fixed, time.monotonic() - start)
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog import rollups
+
+
+class Command(BaseCommand):
+    help = 'Add the loan events appended since the last run to the circulation rollups, one transaction per batch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=rollups.REFRESH_BATCH, help='Events per transaction.')
+        parser.add_argument(
+            '--rebuild', action='store_true', help='Drop the rollups and count every event in the database again.',
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        refresh = rollups.rebuild if options['rebuild'] else rollups.refresh
+        read = refresh(options['batch_size'])
+        self.stdout.write('%d events counted, watermark at %d (%.1fs)' % (
+            read, rollups.watermark(), time.monotonic() - start,
+        ))
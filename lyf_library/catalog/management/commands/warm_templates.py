@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.templating import warm_templates
+
+
+class Command(BaseCommand):
+    help = (
+        'Compile every project template through the configured loaders, as the WSGI/ASGI entry points do at '
+        'startup with CATALOG_WARM_TEMPLATES; fails on template syntax errors.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Include the templates of third-party apps too.')
+        parser.add_argument('--using', help='Template engine alias (default: every Django template engine).')
+
+    def handle(self, *args, **options):
+        compiled, errors, elapsed = warm_templates(options['using'], options['all'])
+        if options['verbosity'] > 1:
+            for name in compiled:
+                self.stdout.write(name)
+        for name, error in errors:
+            self.stderr.write('%s: %s' % (name, error))
+        self.stdout.write('Compiled %d templates in %.1fms' % (len(compiled), elapsed * 1000))
+        if errors:
+            raise CommandError('%d templates failed to compile.' % len(errors))
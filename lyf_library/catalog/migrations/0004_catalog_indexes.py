@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-18 10:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0003_alter_bookinstance_options'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['last_name', 'first_name'], name='catalog_author_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title'], name='catalog_book_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['isbn'], name='catalog_book_isbn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['status', 'due_back'], name='catalog_bi_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['borrower', 'status', 'due_back'], name='catalog_bi_borrower_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(condition=models.Q(('status', 'o')), fields=['due_back'], name='catalog_bi_on_loan_due_idx'),
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.2 on 2026-10-18 10:35
+
+import re
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import OperationalError, migrations, models
+
+# Copies of catalog.search's weights and tokenizer as of this migration
+FIELD_WEIGHTS = {
+    'title': 10,
+    'summary': 1,
+    'author': 5,
+    'genre': 3,
+    'isbn': 10,
+}
+TERM_LENGTH = 64
+
+
+def create_fts_table(apps, schema_editor):
+    # The FTS5 index is only used on SQLite builds that include the extension;
+    # other databases fall back to the BookSearchTerm table.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE catalog_book_fts USING fts5("
+            "title, summary, author, genre, isbn, tokenize='unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        pass
+
+
+def fill_index(apps, schema_editor):
+    # Index the books that already exist; later changes go through the signals
+    Book = apps.get_model('catalog', 'Book')
+    BookSearchTerm = apps.get_model('catalog', 'BookSearchTerm')
+    connection = schema_editor.connection
+    fts = connection.vendor == 'sqlite' and 'catalog_book_fts' in connection.introspection.table_names()
+    books = Book.objects.select_related('author').prefetch_related('genre').order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(books.filter(pk__gt=last_pk)[:1000])
+        if not batch:
+            return
+        last_pk = batch[-1].pk
+        documents = [
+            (book.pk, {
+                'title': book.title,
+                'summary': book.summary,
+                'author': '%s %s' % (book.author.first_name, book.author.last_name) if book.author else '',
+                'genre': ' '.join(genre.name for genre in book.genre.all()),
+                'isbn': book.isbn,
+            })
+            for book in batch
+        ]
+        if fts:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    'INSERT INTO catalog_book_fts (rowid, %s) VALUES (%s)' % (
+                        ', '.join(FIELD_WEIGHTS), ', '.join(['%s'] * (len(FIELD_WEIGHTS) + 1))),
+                    [[pk] + [document[field] for field in FIELD_WEIGHTS] for pk, document in documents],
+                )
+            continue
+        terms = []
+        for pk, document in documents:
+            weights = Counter()
+            for field, text in document.items():
+                for term in re.findall(r'\w+', (text or '').lower()):
+                    weights[term[:TERM_LENGTH]] += FIELD_WEIGHTS[field]
+            terms.extend(BookSearchTerm(term=term, book_id=pk, weight=weight) for term, weight in weights.items())
+        BookSearchTerm.objects.bulk_create(terms, batch_size=1000)
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS catalog_book_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'book'], name='catalog_searchterm_term_idx')],
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-18 10:39
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_copies(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+
+    def count(**filters):
+        copies = (
+            BookInstance.objects.filter(book=OuterRef('pk'), **filters)
+            .order_by().values('book').annotate(count=Count('pk')).values('count')
+        )
+        return Coalesce(Subquery(copies, output_field=IntegerField()), 0)
+
+    Book.objects.update(
+        copies_total=count(), copies_available=count(status='a'), copies_on_loan=count(status='o'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_book_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_on_loan',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['copies_available'], name='catalog_book_available_idx'),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-18 10:59
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+def normalize(text):
+    # Copy of catalog.models.normalize_search_key as of this migration
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return ' '.join(re.findall(r'\w+', text))[:255]
+
+
+def fill_search_keys(apps, schema_editor):
+    Author = apps.get_model('catalog', 'Author')
+    Book = apps.get_model('catalog', 'Book')
+    for model, make_key in [
+        (Author, lambda author: normalize('%s %s' % (author.last_name, author.first_name))),
+        (Book, lambda book: normalize(book.title)),
+    ]:
+        batch = []
+        for obj in model.objects.order_by('pk').iterator(chunk_size=2000):
+            obj.search_key = make_key(obj)
+            batch.append(obj)
+            if len(batch) == 2000:
+                model.objects.bulk_update(batch, ['search_key'])
+                batch = []
+        model.objects.bulk_update(batch, ['search_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='search_key',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='search_key',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(fields=['search_key'], name='catalog_author_search_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['search_key'], name='catalog_book_search_key_idx'),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 11:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_search_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.SmallIntegerField(default=0, help_text='Higher priorities are served first')),
+                ('status', models.CharField(choices=[('w', 'Waiting'), ('r', 'Ready for pickup'), ('f', 'Fulfilled'), ('c', 'Cancelled'), ('x', 'Expired')], default='w', max_length=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('ready_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='catalog.book')),
+                ('copy', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='catalog.bookinstance')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'w')), fields=['book', '-priority', 'id'], name='catalog_hold_queue_idx'), models.Index(condition=models.Q(('status', 'r')), fields=['expires_at'], name='catalog_hold_expiry_idx'), models.Index(fields=['user', 'status'], name='catalog_hold_user_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['w', 'r'])), fields=('book', 'user'), name='catalog_hold_one_active')],
+            },
+        ),
+    ]
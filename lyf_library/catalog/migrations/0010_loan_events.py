@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 11:28
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_holds'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Checkout'), (2, 'Renewal'), (3, 'Return')])),
+                ('day', models.DateField(default=datetime.date.today)),
+                ('due_back', models.DateField(blank=True, null=True)),
+                ('book', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='catalog.book')),
+                ('borrower', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('copy', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='catalog.bookinstance')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['borrower', '-id'], name='catalog_loanevent_user_idx'), models.Index(fields=['book', '-id'], name='catalog_loanevent_book_idx'), models.Index(fields=['copy', '-id'], name='catalog_loanevent_copy_idx'), models.Index(fields=['day'], name='catalog_loanevent_day_idx')],
+            },
+        ),
+    ]
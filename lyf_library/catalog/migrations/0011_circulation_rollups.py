@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-18 11:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_loan_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CirculationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('l', 'Library'), ('b', 'Book'), ('g', 'Genre'), ('a', 'Author')], max_length=1)),
+                ('period', models.CharField(choices=[('d', 'Day'), ('m', 'Month')], max_length=1)),
+                ('start', models.DateField()),
+                ('key', models.PositiveIntegerField()),
+                ('label', models.CharField(blank=True, max_length=200)),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('loan_days', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dimension', 'period', 'start', '-checkouts'], name='catalog_rollup_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('dimension', 'period', 'start', 'key'), name='catalog_rollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# PostgreSQL only uses a plain btree index for LIKE 'prefix%' under the C
+# collation; varchar_pattern_ops indexes serve the autocomplete prefix
+# lookups under any collation. SQLite uses a range over the plain index.
+PATTERN_INDEXES = [
+    ('catalog_author_search_key_like', 'catalog_author'),
+    ('catalog_book_search_key_like', 'catalog_book'),
+]
+
+
+def create_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    quote = schema_editor.quote_name
+    for name, table in PATTERN_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS %s ON %s (%s varchar_pattern_ops)' % (quote(name), quote(table), quote('search_key'))
+        )
+
+
+def drop_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in PATTERN_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % schema_editor.quote_name(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_circulation_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_pattern_indexes, drop_pattern_indexes),
+    ]
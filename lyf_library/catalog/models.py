@@ -1,11 +1,69 @@
 from django.db import models
 import datetime
+import re
+import unicodedata
 
 # 创建模型
 # 1. class
 # 2. 定义域
 # 3. 定义函数
 # Create your models here.
+class LoadedValuesMixin:
+    """
+    Keeps the field values last read from or written to the database in
+    ``loaded_values``, so signal handlers can tell what a save changed.
+    """
+    loaded_values = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_values = {
+            name: value for name, value in zip(field_names, values) if value is not models.DEFERRED
+        }
+        return instance
+
+    def remember_loaded_values(self):
+        """
+        Treat the current field values as the stored ones (called after a save).
+        Deferred fields are left out rather than fetched one query each.
+        """
+        deferred = self.get_deferred_fields()
+        self.loaded_values = {
+            **self.loaded_values,
+            **{
+                field.attname: getattr(self, field.attname)
+                for field in self._meta.concrete_fields if field.attname not in deferred
+            },
+        }
+
+
+SEARCH_KEY_LENGTH = 255
+
+def normalize_search_key(text):
+    """
+    Lower-case ``text`` and strip accents and punctuation, for prefix matching.
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).casefold()
+    return ' '.join(re.findall(r'\w+', text))[:SEARCH_KEY_LENGTH]
+
+
+class SearchKeyMixin:
+    """
+    Keeps ``search_key`` (see catalog.autocomplete) in step with the fields it
+    is built from on every save. Code that bypasses save() sets it itself.
+    """
+    def make_search_key(self):
+        raise NotImplementedError
+
+    def save(self, *args, **kwargs):
+        self.search_key = self.make_search_key()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'search_key'}
+        super().save(*args, **kwargs)
+
+
 class Genre(models.Model):
     """
     Model representing a book genre (e.g. Science Fiction, Non Fiction).
@@ -20,7 +78,9 @@ class Genre(models.Model):
 
 from django.urls import reverse #Used to generate URLs by reversing the URL patterns
 
-class Book(models.Model):
+COPY_COUNT_FIELDS = ('copies_total', 'copies_available', 'copies_on_loan')
+
+class Book(LoadedValuesMixin, SearchKeyMixin, models.Model):
     """
     Model representing a book (but not a specific copy of a book).
     """
@@ -34,6 +94,24 @@ class Book(models.Model):
     # ManyToManyField used because genre can contain many books. Books can cover many genres.
     # Genre class has already been defined so we can specify the object above.
 
+    # Copy counts kept up to date from BookInstance changes (see catalog.availability)
+    copies_total = models.PositiveIntegerField(default=0, editable=False)
+    copies_available = models.PositiveIntegerField(default=0, editable=False)
+    copies_on_loan = models.PositiveIntegerField(default=0, editable=False)
+    # Also touched when the book's copies, genres or author change (see catalog.signals)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Normalized title for autocomplete prefix searches
+    search_key = models.CharField(max_length=SEARCH_KEY_LENGTH, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['title'], name='catalog_book_title_idx'),
+            models.Index(fields=['isbn'], name='catalog_book_isbn_idx'),
+            models.Index(fields=['copies_available'], name='catalog_book_available_idx'),
+            models.Index(fields=['updated_at'], name='catalog_book_updated_idx'),
+            models.Index(fields=['search_key'], name='catalog_book_search_key_idx'),
+        ]
+
     def __str__(self):
         """
         String for representing the Model object.
@@ -47,6 +125,15 @@ class Book(models.Model):
         """
         return reverse('book-detail', args=[str(self.id)])
 
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # The copy counts are only written with F() updates: saving a book
+        # loaded before a copy changed must not put the old counts back.
+        values = [value for value in values if value[0].name not in COPY_COUNT_FIELDS]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+
+    def make_search_key(self):
+        return normalize_search_key(self.title)
+
     def display_genre(self):
         """
         Creates a string for the Genre. This is required to display genre in Admin.
@@ -56,7 +143,30 @@ class Book(models.Model):
 
 import uuid # Required for unique book instances
 
-class BookInstance(models.Model):
+class BookInstanceQuerySet(models.QuerySet):
+    """
+    Loan status filters computed in the database, on the indexed ``status`` and
+    ``due_back`` columns. ``today`` defaults to the current date.
+    """
+    def on_loan(self):
+        return self.filter(status__exact='o')
+
+    def overdue(self, today=None):
+        """
+        Copies on loan past their due date.
+        """
+        return self.on_loan().filter(due_back__lt=today or datetime.date.today())
+
+    def with_overdue(self, today=None):
+        """
+        Annotate each copy with ``overdue``, the SQL version of ``is_overdue``.
+        """
+        return self.annotate(overdue=models.ExpressionWrapper(
+            models.Q(due_back__lt=today or datetime.date.today()), output_field=models.BooleanField(),
+        ))
+
+
+class BookInstance(LoadedValuesMixin, models.Model):
     """
         Model representing a specific copy of a book (i.e. that can be borrowed from the library).
     """
@@ -75,10 +185,21 @@ class BookInstance(models.Model):
 
     status = models.CharField(max_length=1, choices=LOAN_STATUS, blank=True, default='m', help_text='Book availability')
     borrower = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookInstanceQuerySet.as_manager()
 
     class Meta:
         ordering = ["due_back"]
         permissions = (("can_mark_returned", "Set book as returned"),)
+        indexes = [
+            # Admin list_filter and the status/due_back listings
+            models.Index(fields=['status', 'due_back'], name='catalog_bi_status_due_idx'),
+            # LoanedBooksByUserListView: borrower + status, ordered by due_back
+            models.Index(fields=['borrower', 'status', 'due_back'], name='catalog_bi_borrower_due_idx'),
+            # BorrowedBooksListView only ever looks at copies on loan
+            models.Index(fields=['due_back'], condition=models.Q(status='o'), name='catalog_bi_on_loan_due_idx'),
+        ]
 
 
     def __str__(self):
@@ -89,11 +210,194 @@ class BookInstance(models.Model):
 
     @property
     def is_overdue(self):
+        # Computed by the query when loaded through with_overdue()
+        if 'overdue' in self.__dict__:
+            return self.overdue
         if self.due_back and datetime.date.today() > self.due_back:
             return True
         return False
 
-class Author(models.Model):
+class HoldQuerySet(models.QuerySet):
+    def waiting(self):
+        return self.filter(status='w')
+
+    def ready(self):
+        return self.filter(status='r')
+
+    def active(self):
+        return self.filter(status__in=['w', 'r'])
+
+    def queue(self):
+        """
+        Waiting holds in the order they are served: highest priority first,
+        then first come, first served.
+        """
+        return self.waiting().order_by('-priority', 'id')
+
+
+class Hold(models.Model):
+    """
+    A user's place in the queue for a copy of a book (see catalog.reservations).
+    """
+    HOLD_STATUS = (
+        ('w', 'Waiting'),
+        ('r', 'Ready for pickup'),
+        ('f', 'Fulfilled'),
+        ('c', 'Cancelled'),
+        ('x', 'Expired'),
+    )
+
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='holds')
+    priority = models.SmallIntegerField(default=0, help_text='Higher priorities are served first')
+    status = models.CharField(max_length=1, choices=HOLD_STATUS, default='w')
+    # The copy set aside for the user once the hold is ready
+    copy = models.ForeignKey('BookInstance', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    objects = HoldQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The head of a book's queue is an index seek, however long the queue
+            models.Index(fields=['book', '-priority', 'id'], condition=models.Q(status='w'), name='catalog_hold_queue_idx'),
+            # Uncollected holds, by pickup deadline
+            models.Index(fields=['expires_at'], condition=models.Q(status='r'), name='catalog_hold_expiry_idx'),
+            models.Index(fields=['user', 'status'], name='catalog_hold_user_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['book', 'user'], condition=models.Q(status__in=['w', 'r']), name='catalog_hold_one_active',
+            ),
+        ]
+
+    def __str__(self):
+        return '%s: %s (%s)' % (self.user_id, self.book_id, self.get_status_display())
+
+
+class LoanEventQuerySet(models.QuerySet):
+    """
+    Histories newest first, each read from its own index (see catalog.history).
+    """
+    def for_borrower(self, user):
+        return self.filter(borrower=user).order_by('-id')
+
+    def for_book(self, book):
+        return self.filter(book=book).order_by('-id')
+
+    def for_copy(self, copy):
+        return self.filter(copy=copy).order_by('-id')
+
+
+class LoanEvent(models.Model):
+    """
+    A checkout, renewal or return. Appended by catalog.circulation and the
+    renewal view, never changed (see catalog.history).
+    """
+    CHECKOUT, RENEWAL, RETURN = 1, 2, 3
+    KINDS = (
+        (CHECKOUT, 'Checkout'),
+        (RENEWAL, 'Renewal'),
+        (RETURN, 'Return'),
+    )
+
+    kind = models.PositiveSmallIntegerField(choices=KINDS)
+    day = models.DateField(default=datetime.date.today)
+    # No constraints: the history outlives deleted copies, books and users
+    copy = models.ForeignKey(
+        'BookInstance', on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, null=True, related_name='+',
+    )
+    book = models.ForeignKey(
+        'Book', on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, null=True, related_name='+',
+    )
+    borrower = models.ForeignKey(
+        'auth.User', on_delete=models.DO_NOTHING, db_constraint=False, db_index=False, null=True, related_name='+',
+    )
+    # The new due date of a checkout or renewal
+    due_back = models.DateField(null=True, blank=True)
+
+    objects = LoanEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Ids grow with time, so each history is one index range, newest first
+            models.Index(fields=['borrower', '-id'], name='catalog_loanevent_user_idx'),
+            models.Index(fields=['book', '-id'], name='catalog_loanevent_book_idx'),
+            models.Index(fields=['copy', '-id'], name='catalog_loanevent_copy_idx'),
+            # A month (an archive file) is a range of days
+            models.Index(fields=['day'], name='catalog_loanevent_day_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s %s' % (self.day, self.get_kind_display(), self.copy_id)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Loan events are append-only')
+        super().save(*args, **kwargs)
+
+
+class CirculationRollup(models.Model):
+    """
+    Loan counts for one book, genre, author (or the whole library) over one
+    day or month, maintained from the loan history by catalog.rollups.
+    """
+    PERIODS = (
+        ('d', 'Day'),
+        ('m', 'Month'),
+    )
+    DIMENSIONS = (
+        ('l', 'Library'),
+        ('b', 'Book'),
+        ('g', 'Genre'),
+        ('a', 'Author'),
+    )
+
+    dimension = models.CharField(max_length=1, choices=DIMENSIONS)
+    period = models.CharField(max_length=1, choices=PERIODS)
+    # The day, or the first day of the month
+    start = models.DateField()
+    # Book, genre or author id (0 for the library)
+    key = models.PositiveIntegerField()
+    # Title or name when last counted, so reports need no joins
+    label = models.CharField(max_length=200, blank=True)
+    checkouts = models.PositiveIntegerField(default=0)
+    # Loans ended in the period whose checkout is known, and their total length
+    returns = models.PositiveIntegerField(default=0)
+    loan_days = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'period', 'start', 'key'], name='catalog_rollup_unique'),
+        ]
+        indexes = [
+            # Top-N of a period
+            models.Index(fields=['dimension', 'period', 'start', '-checkouts'], name='catalog_rollup_top_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s %s %s' % (self.get_dimension_display(), self.label or self.key, self.period, self.start)
+
+    @property
+    def average_loan_days(self):
+        return self.loan_days / self.returns if self.returns else None
+
+
+class RollupWatermark(models.Model):
+    """
+    The last loan event a rollup refresh has counted.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s: %s' % (self.name, self.last_event_id)
+
+
+class Author(SearchKeyMixin, models.Model):
     """
     Model representing an author.
     """
@@ -101,6 +405,17 @@ class Author(models.Model):
     last_name = models.CharField(max_length=100)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField('Died', null=True, blank=True)
+    # Also touched when one of the author's books changes (see catalog.signals)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Normalized "last_name first_name" for autocomplete prefix searches
+    search_key = models.CharField(max_length=SEARCH_KEY_LENGTH, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_name', 'first_name'], name='catalog_author_name_idx'),
+            models.Index(fields=['updated_at'], name='catalog_author_updated_idx'),
+            models.Index(fields=['search_key'], name='catalog_author_search_key_idx'),
+        ]
 
     def get_absolute_url(self):
         """
@@ -108,6 +423,9 @@ class Author(models.Model):
         """
         return reverse('author-detail', args=[str(self.id)])
 
+    def make_search_key(self):
+        return normalize_search_key('%s %s' % (self.last_name, self.first_name))
+
 
     def __str__(self):
         """
@@ -115,3 +433,22 @@ class Author(models.Model):
         """
         return '%s, %s' % (self.last_name, self.first_name)
 
+
+
+class BookSearchTerm(models.Model):
+    """
+    Inverted index entry used by catalog search when SQLite FTS5 is not available.
+    """
+    TERM_LENGTH = 64
+
+    term = models.CharField(max_length=TERM_LENGTH)
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='+')
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'book'], name='catalog_searchterm_term_idx'),
+        ]
+
+    def __str__(self):
+        return '%s (%s)' % (self.term, self.book_id)
@@ -0,0 +1,261 @@
+"""
+Keyset (cursor) pagination for the catalog list views.
+
+Instead of ``OFFSET`` and a ``COUNT(*)`` per page, each page continues from the
+ordering key of the last row shown, so deep pages cost the same as the first.
+The key is carried between requests in an opaque, signed ``cursor`` token.
+"""
+from django.conf import settings
+from django.core import signing
+from django.core.paginator import InvalidPage, Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.http import Http404
+from django.utils.functional import cached_property
+from django.utils.translation import gettext as _
+
+CURSOR_SALT = 'catalog.pagination.cursor'
+
+
+def encode_cursor(values, direction):
+    """
+    Turn an ordering key and a direction ('n'ext or 'p'revious) into a token.
+    """
+    return signing.dumps([[None if value is None else str(value) for value in values], direction], salt=CURSOR_SALT)
+
+
+def decode_cursor(token):
+    """
+    Reverse encode_cursor(), raising Http404 for tampered or malformed tokens.
+    """
+    try:
+        values, direction = signing.loads(token, salt=CURSOR_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise Http404('Invalid cursor')
+    if direction not in ('n', 'p'):
+        raise Http404('Invalid cursor')
+    return values, direction
+
+
+class CursorPage:
+    """
+    One page of results from a CursorPaginator.
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginate ``queryset`` by the (unique) combination of ``ordering`` fields,
+    e.g. ``('due_back', 'id')`` or ``('-id',)`` (a leading ``-`` sorts that
+    field descending). The last field must be unique.
+    """
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(name.lstrip('-') for name in ordering)
+        self.descending = tuple(name.startswith('-') for name in ordering)
+        self.per_page = int(per_page)
+        self.nullable = {
+            name: queryset.model._meta.get_field(name).null for name in self.ordering
+        }
+
+    def _order_by(self, reverse):
+        expressions = []
+        for name, descending in zip(self.ordering, self.descending):
+            # NULL sorts as the smallest value: first ascending, last descending.
+            if descending != reverse:
+                expressions.append(F(name).desc(nulls_last=True))
+            else:
+                expressions.append(F(name).asc(nulls_first=True))
+        return expressions
+
+    def _after(self, values, reverse):
+        """
+        Build the filter selecting rows strictly after ``values`` in the
+        (possibly reversed) ordering.
+        """
+        condition = Q(pk__in=[])
+        equal = Q()
+        for name, descending, value in zip(self.ordering, self.descending, values):
+            downwards = descending != reverse
+            if value is None:
+                # Going up every non-NULL value follows NULL; going down nothing does.
+                beyond = Q(pk__in=[]) if downwards else Q(**{'%s__isnull' % name: False})
+                same = Q(**{'%s__isnull' % name: True})
+            else:
+                beyond = Q(**{'%s__%s' % (name, 'lt' if downwards else 'gt'): value})
+                if downwards and self.nullable[name]:
+                    beyond |= Q(**{'%s__isnull' % name: True})
+                same = Q(**{name: value})
+            condition |= equal & beyond
+            equal &= same
+        return condition
+
+    def _key(self, obj):
+        # Rows may be model instances or values() dicts
+        if isinstance(obj, dict):
+            return [obj[name] for name in self.ordering]
+        return [getattr(obj, name) for name in self.ordering]
+
+    def _queryset(self, cursor):
+        """
+        Return the query for the page after ``cursor`` (one row longer than a
+        page, to tell whether there are more), the cursor values and direction.
+        """
+        values, direction = decode_cursor(cursor) if cursor else (None, 'n')
+        reverse = direction == 'p'
+        queryset = self.queryset.order_by(*self._order_by(reverse))
+        if values is not None:
+            if len(values) != len(self.ordering):
+                raise Http404('Invalid cursor')
+            queryset = queryset.filter(self._after(values, reverse))
+        return queryset[:self.per_page + 1], values, reverse
+
+    def _page(self, rows, values, reverse):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        if not rows:
+            return CursorPage(rows)
+        has_next = has_more if not reverse else True
+        has_previous = has_more if reverse else values is not None
+        return CursorPage(
+            rows,
+            next_cursor=encode_cursor(self._key(rows[-1]), 'n') if has_next else None,
+            previous_cursor=encode_cursor(self._key(rows[0]), 'p') if has_previous else None,
+        )
+
+    def page(self, cursor=None):
+        """
+        Return the page starting after ``cursor`` (or the first page).
+        """
+        queryset, values, reverse = self._queryset(cursor)
+        return self._page(list(queryset), values, reverse)
+
+    async def apage(self, cursor=None):
+        """
+        Async version of page().
+        """
+        queryset, values, reverse = self._queryset(cursor)
+        return self._page([row async for row in queryset], values, reverse)
+
+
+class CursorPaginationMixin:
+    """
+    Opt-in keyset pagination for a ListView. The view sets ``cursor_ordering``;
+    cursor pages are served when the request carries a ``cursor`` parameter or
+    when ``CATALOG_CURSOR_PAGINATION`` is enabled, offset pages otherwise.
+    Async views fetch the page with ``apaginate_queryset()`` before building
+    the context.
+    """
+    cursor_ordering = None
+    cursor_query_param = 'cursor'
+    paginated = None
+
+    def uses_cursor_pagination(self):
+        return self.cursor_ordering is not None and (
+            self.cursor_query_param in self.request.GET
+            or getattr(settings, 'CATALOG_CURSOR_PAGINATION', False)
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.paginated is not None:
+            return self.paginated
+        if not self.uses_cursor_pagination():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, self.cursor_ordering, page_size)
+        page = paginator.page(self.request.GET.get(self.cursor_query_param))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    async def apaginate_queryset(self, queryset, page_size):
+        """
+        Async version of paginate_queryset(). The result is also kept in
+        ``paginated`` for get_context_data().
+        """
+        if self.uses_cursor_pagination():
+            paginator = CursorPaginator(queryset, self.cursor_ordering, page_size)
+            page = await paginator.apage(self.request.GET.get(self.cursor_query_param))
+        else:
+            paginator = self.get_paginator(
+                queryset, page_size, orphans=self.get_paginate_orphans(),
+                allow_empty_first_page=self.get_allow_empty(),
+            )
+            # Paginator.count is a cached property: count with the async ORM up front
+            paginator.count = await queryset.acount()
+            page = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or 1
+            try:
+                page_number = paginator.num_pages if page == 'last' else int(page)
+                page = paginator.page(page_number)
+            except (ValueError, InvalidPage):
+                raise Http404(_('Invalid page (%(page_number)s)') % {'page_number': page})
+            page.object_list = [row async for row in page.object_list]
+        self.paginated = (paginator, page, page.object_list, page.has_other_pages())
+        return self.paginated
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['is_cursor_paginated'] = isinstance(context.get('page_obj'), CursorPage)
+        return context
+
+
+def estimate_count(model, using='default'):
+    """
+    Return a cheap estimate of the number of rows in ``model``'s table, or
+    None when the database offers none.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        elif connection.vendor == 'sqlite':
+            # The largest rowid is found in the table's b-tree without a scan;
+            # it over-counts by the number of deleted rows.
+            cursor.execute('SELECT MAX(rowid) FROM %s' % connection.ops.quote_name(table))
+        else:
+            return None
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses estimate_count() instead of ``COUNT(*)`` for
+    unfiltered querysets of large tables. Filtered querysets, and tables
+    under ``estimate_threshold`` rows, are counted exactly.
+    """
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super().count
@@ -0,0 +1,171 @@
+"""
+Reservations: holds queued on books, served as copies come back.
+
+A hold waits in its book's queue, which is served highest priority first,
+then first come, first served. ``allocate()`` gives each available copy of a
+book to the head of its queue: the copy is set aside (status Reserved, the
+holder as ``borrower`` and the pickup deadline as ``due_back``) and the hold
+becomes ready. Checking the copy out to the holder fulfils the hold (see
+``circulation.checkout``); a hold not collected within PICKUP_PERIOD expires
+and its copy goes to the next in line (``expire_holds``).
+
+Returns allocate the copies they free: ``circulation.return_copies`` for
+batches, ``copy_saved`` below for single saves. Allocation never scans a
+whole queue: the books with someone waiting and the head of each book's queue
+are read through the partial index on waiting holds, with a LIMIT of the
+copies on the shelf. Work is split into transactions of ``batch_size`` books,
+so a burst of returns does not hold the write lock for its whole length.
+Copies and holds are locked with ``select_for_update(skip_locked=True)``:
+concurrent allocators on PostgreSQL take disjoint rows instead of waiting on
+each other. SQLite has no row locks; its single writer lock serializes them.
+"""
+import datetime
+from itertools import groupby
+from operator import attrgetter
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .circulation import save_copies, sync_copies
+from .importing import batched
+from .models import BookInstance, Hold
+
+# How long a copy is kept for its holder to collect
+PICKUP_PERIOD = datetime.timedelta(days=7)
+
+# Books per allocation transaction
+ALLOCATION_BATCH = 500
+
+COPY_FIELDS = ['id', 'book_id', 'status', 'due_back', 'borrower_id']
+
+
+class HoldError(Exception):
+    pass
+
+
+def place_hold(user, book, priority=0):
+    """
+    Queue ``user`` for a copy of ``book``. The hold is ready at once when a
+    copy is on the shelf.
+    """
+    try:
+        with transaction.atomic():
+            hold = Hold.objects.create(book=book, user=user, priority=priority)
+    except IntegrityError:
+        raise HoldError('You already have a hold on this book')
+    if allocate([book.pk]):
+        hold.refresh_from_db()
+    return hold
+
+
+def cancel_hold(hold):
+    """
+    Withdraw a waiting or ready hold; a copy set aside for it goes to the next
+    in line.
+    """
+    with transaction.atomic():
+        hold = Hold.objects.select_for_update().get(pk=hold.pk)
+        if hold.status not in ('w', 'r'):
+            raise HoldError('This hold is no longer active')
+        released = _close([hold], 'c')
+    if released:
+        allocate([hold.book_id])
+    return hold
+
+
+def _close(holds, status):
+    """
+    Give ``holds`` their final ``status`` and put the copies set aside for
+    them back on the shelf; return those copies.
+    """
+    holders = {hold.copy_id: hold.user_id for hold in holds if hold.status == 'r' and hold.copy_id}
+    for hold in holds:
+        hold.status = status
+    Hold.objects.filter(pk__in=[hold.pk for hold in holds]).update(status=status)
+    copies = BookInstance.objects.select_for_update().only(*COPY_FIELDS).in_bulk(holders)
+    # Skip copies staff have dealt with since
+    released = [copy for pk, copy in copies.items() if copy.status == 'r' and copy.borrower_id == holders[pk]]
+    now = timezone.now()
+    for copy in released:
+        copy.status, copy.borrower, copy.due_back, copy.updated_at = 'a', None, None, now
+    if released:
+        save_copies(released)
+        sync_copies(released, {copy.pk: 'r' for copy in released})
+    return released
+
+
+def allocate(book_ids=None, batch_size=ALLOCATION_BATCH):
+    """
+    Set aside the available copies of ``book_ids`` (by default, of every book
+    with a waiting hold) for the heads of their queues, ``batch_size`` books
+    per transaction. Return the number of holds made ready.
+    """
+    if book_ids is None:
+        book_ids = Hold.objects.waiting().order_by('book_id').values_list('book_id', flat=True).distinct()
+    allocated = 0
+    for batch in batched(sorted(book_ids), batch_size):
+        with transaction.atomic():
+            allocated += _allocate_batch(batch)
+    return allocated
+
+
+def _allocate_batch(book_ids):
+    waiting = set(Hold.objects.waiting().filter(book_id__in=book_ids).order_by().values_list('book_id', flat=True).distinct())
+    if not waiting:
+        return 0
+    copies = (
+        BookInstance.objects.select_for_update(skip_locked=True)
+        .filter(book_id__in=waiting, status='a').only(*COPY_FIELDS).order_by('book_id', 'id')
+    )
+    now = timezone.now()
+    expires_at = now + PICKUP_PERIOD
+    ready_copies, ready_holds = [], []
+    for book_id, book_copies in groupby(copies, key=attrgetter('book_id')):
+        book_copies = list(book_copies)
+        holds = Hold.objects.queue().select_for_update(skip_locked=True).filter(book_id=book_id).only(
+            'id', 'book_id', 'user_id', 'status',
+        )[:len(book_copies)]
+        for copy, hold in zip(book_copies, holds):
+            copy.status, copy.borrower_id, copy.due_back, copy.updated_at = 'r', hold.user_id, expires_at.date(), now
+            hold.status, hold.copy, hold.ready_at, hold.expires_at = 'r', copy, now, expires_at
+            ready_copies.append(copy)
+            ready_holds.append(hold)
+    if ready_holds:
+        save_copies(ready_copies)
+        Hold.objects.filter(pk__in=[hold.pk for hold in ready_holds]).update(
+            status='r', ready_at=now, expires_at=expires_at,
+        )
+        # The copy is the only value that differs per hold
+        Hold.objects.bulk_update(ready_holds, ['copy'])
+        sync_copies(ready_copies, {copy.pk: 'a' for copy in ready_copies})
+    return len(ready_holds)
+
+
+def expire_holds(now=None, batch_size=ALLOCATION_BATCH):
+    """
+    Expire the ready holds not collected by their deadline, ``batch_size`` per
+    transaction, and pass their copies on. Return the number expired.
+    """
+    now = now or timezone.now()
+    expired = 0
+    while True:
+        with transaction.atomic():
+            holds = list(
+                Hold.objects.ready().select_for_update(skip_locked=True).filter(expires_at__lt=now)
+                .only('id', 'book_id', 'user_id', 'status', 'copy_id').order_by('expires_at')[:batch_size]
+            )
+            _close(holds, 'x')
+        if not holds:
+            return expired
+        expired += len(holds)
+        allocate({hold.book_id for hold in holds}, batch_size)
+
+
+@receiver(post_save, sender=BookInstance)
+def copy_saved(sender, instance, **kwargs):
+    # A copy put on the shelf one save at a time (the admin, a form)
+    if instance.status == 'a' and instance.book_id is not None:
+        book_id = instance.book_id
+        transaction.on_commit(lambda: allocate([book_id]))
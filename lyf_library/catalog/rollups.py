@@ -0,0 +1,221 @@
+"""
+Circulation analytics from precomputed rollups.
+
+``refresh()`` reads the loan events appended since its watermark (see
+catalog.history) in id order, ``batch_size`` at a time, and adds them to the
+CirculationRollup rows: checkouts, and for returns the length of the loan
+(back to the copy's previous checkout, found through the copy history
+index). The library and each book are counted per day and per month, each
+genre and author per month, with books mapped to their current author and
+genres. A batch and the watermark move in one transaction, so every event is
+counted once however refreshes are interrupted or overlap. A refresh stops
+at ``horizon()``, the last id below which no event can still commit, so an
+event never lands behind the watermark.
+
+The circulation dashboard reads only these rows: a month's most borrowed
+books or an author's average loan length is one index range however long the
+history is. ``manage.py refresh_rollups`` runs the refresh (from cron);
+``--rebuild`` recounts the events still in the database. Archive loan events
+only once they are counted (``archive_loan_events`` checks).
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Max, OuterRef, Subquery, When
+
+from . import history
+from .importing import batched
+from .models import Author, Book, CirculationRollup, Genre, LoanEvent, RollupWatermark
+
+WATERMARK = 'circulation'
+
+# Events per refresh transaction
+REFRESH_BATCH = 5000
+
+# The periods counted for each dimension
+ROLLUPS = {
+    'l': ('d', 'm'),
+    'b': ('d', 'm'),
+    'g': ('m',),
+    'a': ('m',),
+}
+
+COUNTS = ['checkouts', 'returns', 'loan_days']
+
+
+def period_start(day, period):
+    return day if period == 'd' else history.month_start(day)
+
+
+def watermark():
+    """
+    The id of the last loan event counted.
+    """
+    return RollupWatermark.objects.filter(name=WATERMARK).values_list('last_event_id', flat=True).first() or 0
+
+
+def horizon():
+    """
+    The highest loan event id such that every event with a lower id is
+    committed (or rolled back). On SQLite, whose single writer commits ids in
+    order, that is the largest id. On PostgreSQL a transaction can commit an
+    id after a larger one: a SHARE lock on the table waits for the
+    transactions inserting events to finish (and holds new inserts back only
+    that long), after which every id allocated so far is settled.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('LOCK TABLE %s IN SHARE MODE' % connection.ops.quote_name(LoanEvent._meta.db_table))
+        return LoanEvent.objects.aggregate(Max('id'))['id__max'] or 0
+
+
+def _events(after, until, batch_size):
+    started = LoanEvent.objects.filter(
+        copy=OuterRef('copy'), kind=LoanEvent.CHECKOUT, id__lt=OuterRef('id'),
+    ).order_by('-id').values('day')[:1]
+    return list(
+        LoanEvent.objects.filter(id__gt=after, id__lte=until).order_by('id')
+        # Renewals change no count, but move the watermark too
+        .annotate(started=Case(When(kind=LoanEvent.RETURN, then=Subquery(started))))
+        .values('id', 'kind', 'day', 'book_id', 'started')[:batch_size]
+    )
+
+
+def _labels(book_ids):
+    """
+    Return ``{book_id: (title, author_id)}``, ``{book_id: [genre_id, ...]}``
+    and ``{(dimension, key): label}`` for the books and their authors and genres.
+    """
+    books = {
+        pk: (title, author_id)
+        for pk, title, author_id in Book.objects.filter(pk__in=book_ids).values_list('pk', 'title', 'author_id')
+    }
+    genres = defaultdict(list)
+    for book_id, genre_id in Book.genre.through.objects.filter(book_id__in=book_ids).values_list('book_id', 'genre_id'):
+        genres[book_id].append(genre_id)
+    labels = {('l', 0): 'Library'}
+    labels.update((('b', pk), title) for pk, (title, author_id) in books.items())
+    author_ids = {author_id for title, author_id in books.values()} - {None}
+    for pk, last_name, first_name in Author.objects.filter(pk__in=author_ids).values_list('pk', 'last_name', 'first_name'):
+        labels[('a', pk)] = '%s, %s' % (last_name, first_name)
+    genre_ids = {genre_id for ids in genres.values() for genre_id in ids}
+    labels.update((('g', pk), name) for pk, name in Genre.objects.filter(pk__in=genre_ids).values_list('pk', 'name'))
+    return books, genres, labels
+
+
+def _deltas(events):
+    """
+    Return ``{(dimension, period, start, key): [checkouts, returns, loan_days]}``
+    for ``events`` and the labels of their keys.
+    """
+    books, genres, labels = _labels({event['book_id'] for event in events} - {None})
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for event in events:
+        if event['kind'] == LoanEvent.CHECKOUT:
+            delta = (1, 0, 0)
+        elif event['kind'] == LoanEvent.RETURN and event['started'] is not None:
+            delta = (0, 1, (event['day'] - event['started']).days)
+        else:
+            continue
+        keys = [('l', 0)]
+        book_id = event['book_id']
+        if book_id is not None:
+            keys.append(('b', book_id))
+            if book_id in books and books[book_id][1] is not None:
+                keys.append(('a', books[book_id][1]))
+            keys += [('g', genre_id) for genre_id in genres[book_id]]
+        for dimension, key in keys:
+            for period in ROLLUPS[dimension]:
+                counts = deltas[(dimension, period, period_start(event['day'], period), key)]
+                for index, value in enumerate(delta):
+                    counts[index] += value
+    return deltas, labels
+
+
+def _apply(deltas, labels, batch_size=500):
+    """
+    Add ``deltas`` to the rollup rows, creating the missing ones. Each batch is
+    one ``INSERT ... ON CONFLICT DO UPDATE`` adding to the stored counts
+    (SQLite and PostgreSQL share the syntax), so no row is read first.
+    """
+    quote = connection.ops.quote_name
+    table = quote(CirculationRollup._meta.db_table)
+    columns = ['dimension', 'period', 'start', 'key', 'label'] + COUNTS
+    sql = 'INSERT INTO %s (%s) VALUES %%s ON CONFLICT (%s) DO UPDATE SET %s' % (
+        table, ', '.join(map(quote, columns)), ', '.join(map(quote, columns[:4])), ', '.join(
+            # A book deleted since keeps the label it had
+            ["label = CASE WHEN excluded.label = '' THEN %s.label ELSE excluded.label END" % table]
+            + ['%s = %s.%s + excluded.%s' % (quote(name), table, quote(name), quote(name)) for name in COUNTS]
+        ),
+    )
+    with connection.cursor() as cursor:
+        for batch in batched(deltas.items(), batch_size):
+            params = []
+            for (dimension, period, start, key), counts in batch:
+                params += [dimension, period, connection.ops.adapt_datefield_value(start), key,
+                           labels.get((dimension, key), '')[:200]] + counts
+            cursor.execute(sql % ', '.join(['(%s)' % ', '.join(['%s'] * len(columns))] * len(batch)), params)
+
+
+def refresh(batch_size=REFRESH_BATCH):
+    """
+    Count the loan events appended since the last refresh; return how many
+    were read.
+    """
+    until = horizon()
+    read = 0
+    while True:
+        with transaction.atomic():
+            mark = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)[0]
+            events = _events(mark.last_event_id, until, batch_size)
+            if not events:
+                return read
+            _apply(*_deltas(events))
+            mark.last_event_id = events[-1]['id']
+            mark.save()
+        read += len(events)
+
+
+def rebuild(batch_size=REFRESH_BATCH):
+    """
+    Drop the rollups and count every loan event still in the database again.
+    """
+    with transaction.atomic():
+        CirculationRollup.objects.all().delete()
+        RollupWatermark.objects.filter(name=WATERMARK).delete()
+    return refresh(batch_size)
+
+
+def dashboard(month, top=10, months=12):
+    """
+    The circulation dashboard for the month of ``month``: its most borrowed
+    books, authors by average loan length (longest first), daily totals and the loans per
+    genre over the ``months`` months up to it. Reads the rollups only.
+    """
+    month = history.month_start(month)
+    rollups = CirculationRollup.objects.filter(period='m', start=month)
+    first = history.month_start(month, 1 - months)
+    month_list = [history.month_start(first, i) for i in range(months)]
+    genre_rows = CirculationRollup.objects.filter(dimension='g', period='m', start__gte=first, start__lte=month)
+    genres = {}
+    for row in genre_rows.order_by('label', 'key'):
+        label, counts = genres.setdefault(row.key, (row.label, [0] * months))
+        counts[month_list.index(row.start)] = row.checkouts
+    return {
+        'month': month,
+        'previous_month': history.month_start(month, -1),
+        'next_month': history.month_start(month, 1),
+        'total': rollups.filter(dimension='l', key=0).first(),
+        'most_borrowed': list(rollups.filter(dimension='b').order_by('-checkouts', 'key')[:top]),
+        'authors': list(
+            rollups.filter(dimension='a', returns__gt=0)
+            .order_by(ExpressionWrapper(F('loan_days') * 1.0 / F('returns'), FloatField()).desc(), '-returns', 'key')[:top]
+        ),
+        'daily': list(CirculationRollup.objects.filter(
+            dimension='l', period='d', start__gte=month, start__lt=history.month_start(month, 1),
+        ).order_by('start')),
+        'months': month_list,
+        'genres': list(genres.values()),
+        'refreshed': RollupWatermark.objects.filter(name=WATERMARK).first(),
+    }
@@ -0,0 +1,180 @@
+"""
+Full-text catalog search.
+
+Books are indexed on title, summary, author name, genre names and ISBN. On
+SQLite with FTS5 the index is the ``catalog_book_fts`` virtual table (created
+by migration 0005) ranked with bm25; elsewhere it is the BookSearchTerm
+inverted index, ranked by summed field weights. Either way the index is kept
+up to date by the handlers in ``catalog.signals``.
+"""
+import re
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Count, Sum
+
+from .models import Book, BookSearchTerm
+
+FTS_TABLE = 'catalog_book_fts'
+
+# Relative importance of a match in each indexed field.
+FIELD_WEIGHTS = {
+    'title': 10,
+    'summary': 1,
+    'author': 5,
+    'genre': 3,
+    'isbn': 10,
+}
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """
+    Split text into lower-case word tokens.
+    """
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def book_document(book):
+    """
+    Return the indexed text of a book, field by field. Expects ``author`` to be
+    selected and ``genre`` prefetched.
+    """
+    return {
+        'title': book.title,
+        'summary': book.summary,
+        'author': '%s %s' % (book.author.first_name, book.author.last_name) if book.author else '',
+        'genre': ' '.join(genre.name for genre in book.genre.all()),
+        'isbn': book.isbn,
+    }
+
+
+class FTS5Backend:
+    """
+    Search index kept in an SQLite FTS5 virtual table keyed by book id.
+    """
+    def remove(self, book_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [(pk,) for pk in book_ids])
+
+    def index(self, books):
+        self.remove([book.pk for book in books])
+        rows = []
+        for book in books:
+            document = book_document(book)
+            rows.append([book.pk] + [document[field] for field in FIELD_WEIGHTS])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO %s (rowid, %s) VALUES (%s)' % (
+                    FTS_TABLE, ', '.join(FIELD_WEIGHTS), ', '.join(['%s'] * (len(FIELD_WEIGHTS) + 1))),
+                rows,
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % FTS_TABLE)
+
+    def search(self, terms, offset, limit):
+        match = ' '.join('"%s"' % term for term in terms)
+        # bm25() is lower for better matches and takes one weight per column
+        weights = ', '.join('%.1f' % weight for weight in FIELD_WEIGHTS.values())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM %s WHERE %s MATCH %%s ORDER BY bm25(%s, %s), rowid LIMIT %%s OFFSET %%s'
+                % (FTS_TABLE, FTS_TABLE, FTS_TABLE, weights),
+                [match, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class TermIndexBackend:
+    """
+    Portable inverted index: one BookSearchTerm row per (term, book).
+    """
+    def remove(self, book_ids):
+        BookSearchTerm.objects.filter(book_id__in=book_ids).delete()
+
+    def index(self, books):
+        self.remove([book.pk for book in books])
+        terms = []
+        for book in books:
+            weights = Counter()
+            for field, text in book_document(book).items():
+                for term in tokenize(text):
+                    weights[term[:BookSearchTerm.TERM_LENGTH]] += FIELD_WEIGHTS[field]
+            terms.extend(BookSearchTerm(term=term, book_id=book.pk, weight=weight) for term, weight in weights.items())
+        BookSearchTerm.objects.bulk_create(terms, batch_size=1000)
+
+    def clear(self):
+        BookSearchTerm.objects.all().delete()
+
+    def search(self, terms, offset, limit):
+        terms = {term[:BookSearchTerm.TERM_LENGTH] for term in terms}
+        matches = (
+            BookSearchTerm.objects.filter(term__in=terms)
+            .values('book_id')
+            .annotate(score=Sum('weight'), matched=Count('term'))
+            .filter(matched=len(terms))
+            .order_by('-score', 'book_id')
+        )
+        return [match['book_id'] for match in matches[offset:offset + limit]]
+
+
+_fts5_available = {}
+
+
+def get_backend():
+    """
+    Return the FTS5 backend when its table exists on this database, the
+    portable term index otherwise.
+    """
+    if connection.alias not in _fts5_available:
+        _fts5_available[connection.alias] = (
+            connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+        )
+    return FTS5Backend() if _fts5_available[connection.alias] else TermIndexBackend()
+
+
+def index_books(book_ids, backend=None):
+    """
+    (Re)index the given books; ids that no longer exist are dropped from the index.
+    """
+    backend = backend or get_backend()
+    book_ids = list(book_ids)
+    books = list(Book.objects.filter(pk__in=book_ids).select_related('author').prefetch_related('genre'))
+    backend.remove(set(book_ids) - {book.pk for book in books})
+    if books:
+        backend.index(books)
+
+
+def remove_books(book_ids, backend=None):
+    (backend or get_backend()).remove(list(book_ids))
+
+
+def rebuild_index(batch_size=1000, backend=None):
+    """
+    Rebuild the whole index in batches of ``batch_size`` books. Returns the
+    number of books indexed.
+    """
+    backend = backend or get_backend()
+    backend.clear()
+    total = 0
+    last_pk = 0
+    while True:
+        batch = list(Book.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return total
+        index_books(batch, backend)
+        total += len(batch)
+        last_pk = batch[-1]
+
+
+def search_books(query, offset=0, limit=10, backend=None):
+    """
+    Return the ids of books matching every word of ``query``, best match first.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    return (backend or get_backend()).search(terms, offset, limit)
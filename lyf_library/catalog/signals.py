@@ -0,0 +1,159 @@
+"""
+Signal handlers keeping derived catalog data in step with model changes.
+"""
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import availability, caching, counters, search
+from .models import Author, Book, BookInstance, Genre
+
+
+def book_tags(book_ids):
+    return ['book:%s' % pk for pk in book_ids if pk is not None]
+
+
+def author_tags(author_ids):
+    return ['author:%s' % pk for pk in author_ids if pk is not None]
+
+
+def touch(model, pks):
+    """
+    Bump ``updated_at`` on rows whose pages show a related object that changed.
+    """
+    pks = [pk for pk in pks if pk is not None]
+    if pks:
+        model.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust_counter('num_books', 1)
+    search.index_books([instance.pk])
+    old_author_id = instance.loaded_values.get('author_id')
+    if old_author_id != instance.author_id:
+        # The book left the old author's page
+        touch(Author, [old_author_id])
+    caching.invalidate('books', *book_tags([instance.pk]), *author_tags({instance.author_id, old_author_id}))
+    instance.remember_loaded_values()
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    counters.adjust_counter('num_books', -1)
+    search.remove_books([instance.pk])
+    touch(Author, [instance.author_id])
+    caching.invalidate('books', *book_tags([instance.pk]), *author_tags([instance.author_id]))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # genre.book_set.clear(): remember the books before the links go
+        instance._book_ids = list(instance.book_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if action == 'post_clear':
+            book_ids = instance._book_ids if reverse else [instance.pk]
+        else:
+            book_ids = pk_set if reverse else [instance.pk]
+        search.index_books(book_ids)
+        touch(Book, book_ids)
+        caching.invalidate(*book_tags(book_ids))
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust_counter('num_authors', 1)
+        caching.invalidate('authors', *author_tags([instance.pk]))
+    else:
+        book_ids = list(instance.book_set.values_list('pk', flat=True))
+        search.index_books(book_ids)
+        touch(Book, book_ids)
+        # The author's name also shows on the book list and their books' pages
+        caching.invalidate('authors', 'books', *author_tags([instance.pk]), *book_tags(book_ids))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+def remember_books(sender, instance, **kwargs):
+    # Deleting an author or genre unlinks its books without sending signals for them.
+    instance._book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    counters.adjust_counter('num_authors', -1)
+    search.index_books(instance._book_ids)
+    touch(Book, instance._book_ids)
+    caching.invalidate('authors', 'books', *author_tags([instance.pk]), *book_tags(instance._book_ids))
+
+
+@receiver(post_save, sender=Genre)
+def genre_saved(sender, instance, created, **kwargs):
+    if created:
+        caching.invalidate('genres')
+    else:
+        book_ids = list(instance.book_set.values_list('pk', flat=True))
+        search.index_books(book_ids)
+        touch(Book, book_ids)
+        caching.invalidate('genres', *book_tags(book_ids))
+
+
+@receiver(post_delete, sender=Genre)
+def genre_deleted(sender, instance, **kwargs):
+    search.index_books(instance._book_ids)
+    touch(Book, instance._book_ids)
+    caching.invalidate('genres', *book_tags(instance._book_ids))
+
+
+def invalidate_copy_pages(book_ids, counts_changed):
+    """
+    Evict the pages showing copies of ``book_ids``: the book pages always, and
+    when the copy counts changed, the book list and the authors' pages too.
+    """
+    book_ids = {pk for pk in book_ids if pk is not None}
+    tags = book_tags(book_ids)
+    if counts_changed and book_ids:
+        author_ids = Book.objects.filter(pk__in=book_ids).values_list('author_id', flat=True)
+        tags += ['books'] + author_tags(set(author_ids))
+    caching.invalidate(*tags)
+
+
+@receiver(post_save, sender=BookInstance)
+def bookinstance_saved(sender, instance, created, **kwargs):
+    loaded = instance.loaded_values
+    if created:
+        counters.adjust_counter('num_instances', 1)
+        counters.adjust_counter('num_instances_available', int(instance.status == 'a'))
+        availability.apply_deltas(availability.copy_deltas(instance.book_id, instance.status, 1))
+        invalidate_copy_pages([instance.book_id], True)
+    elif 'status' in loaded and 'book_id' in loaded:
+        was_available = loaded['status'] == 'a'
+        counters.adjust_counter('num_instances_available', int(instance.status == 'a') - int(was_available))
+        counts_changed = (loaded['book_id'], loaded['status']) != (instance.book_id, instance.status)
+        if counts_changed:
+            availability.apply_deltas(
+                availability.copy_deltas(loaded['book_id'], loaded['status'], -1),
+                availability.copy_deltas(instance.book_id, instance.status, 1),
+            )
+        invalidate_copy_pages([loaded['book_id'], instance.book_id], counts_changed)
+    else:
+        # We don't know what the row looked like before, so recount.
+        transaction.on_commit(counters.invalidate_counters)
+        if instance.book_id is not None:
+            availability.recount_books([instance.book_id])
+        invalidate_copy_pages([instance.book_id], True)
+    instance.remember_loaded_values()
+
+
+@receiver(post_delete, sender=BookInstance)
+def bookinstance_deleted(sender, instance, **kwargs):
+    status = instance.loaded_values.get('status', instance.status)
+    book_id = instance.loaded_values.get('book_id', instance.book_id)
+    counters.adjust_counter('num_instances', -1)
+    counters.adjust_counter('num_instances_available', -int(status == 'a'))
+    availability.apply_deltas(availability.copy_deltas(book_id, status, -1))
+    invalidate_copy_pages([book_id], True)
@@ -0,0 +1,63 @@
+// Autocomplete for <select data-autocomplete-url="...">: the server renders
+// only the selected options, this adds a search box that fetches the others.
+(function () {
+  'use strict';
+
+  var DELAY = 250;
+
+  function setup(select) {
+    var input = document.createElement('input');
+    var timer = null;
+    var pending = null;
+    input.type = 'search';
+    input.placeholder = 'Type to search...';
+    input.autocomplete = 'off';
+    select.parentNode.insertBefore(input, select);
+
+    function update(results) {
+      var keep = {};
+      Array.prototype.forEach.call(select.options, function (option) {
+        if (option.selected || option.value === '') {
+          keep[option.value] = true;
+        } else {
+          option.remove();
+        }
+      });
+      results.forEach(function (result) {
+        var value = String(result.id);
+        if (!keep[value]) {
+          select.add(new Option(result.text, value));
+        }
+      });
+    }
+
+    function search() {
+      var query = input.value.trim();
+      if (pending) {
+        pending.abort();
+      }
+      if (!query) {
+        update([]);
+        return;
+      }
+      pending = new AbortController();
+      fetch(select.dataset.autocompleteUrl + '?q=' + encodeURIComponent(query), {
+        headers: {Accept: 'application/json'},
+        signal: pending.signal
+      }).then(function (response) {
+        return response.ok ? response.json() : {results: []};
+      }).then(function (data) {
+        update(data.results);
+      }).catch(function () {});
+    }
+
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(search, DELAY);
+    });
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('select[data-autocomplete-url]').forEach(setup);
+  });
+})();
@@ -0,0 +1,38 @@
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+IMAGE_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+
+
+def _srcset(variants):
+    return ', '.join('%s %dw' % (static(name), width) for width, name in variants)
+
+
+@register.simple_tag
+def responsive_image(path, alt='', sizes='100vw'):
+    """
+    An <img> of a static image; with the variants made by collectstatic
+    (see catalog.assets), a <picture> offering WebP and resized copies.
+    """
+    image_variants = getattr(staticfiles_storage, 'image_variants', None)
+    variants = image_variants(path) if image_variants else {}
+    img_variants = next((names for ext, names in variants.items() if ext != '.webp'), None)
+    if not img_variants:
+        return format_html('<img src="{}" alt="{}" />', static(path), alt)
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}" />',
+        ((IMAGE_TYPES.get(ext, ''), _srcset(names), sizes) for ext, names in variants.items() if ext == '.webp'),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}" /></picture>',
+        sources, static(path), _srcset(img_variants), sizes, alt,
+    )
@@ -0,0 +1,27 @@
+"""
+A timed ``{% block %}``, installed as a builtin by the instrumentation
+template backend when its ``profile`` option is set; not meant to be loaded.
+"""
+import time
+
+from django import template
+from django.template.loader_tags import BlockNode, do_block
+
+from catalog.instrumentation import template_profiler
+
+register = template.Library()
+
+
+class ProfiledBlockNode(BlockNode):
+    def render(self, context):
+        start = time.perf_counter()
+        try:
+            return super().render(context)
+        finally:
+            template_profiler.add(context.template.origin.template_name, self.name, time.perf_counter() - start)
+
+
+@register.tag('block')
+def do_profiled_block(parser, token):
+    node = do_block(parser, token)
+    return ProfiledBlockNode(node.name, node.nodelist, node.parent)
@@ -0,0 +1,83 @@
+"""
+Template warm-up.
+
+With the cached loader a template is read and compiled on its first use in
+each process; ``warm_templates()`` compiles them all up front instead, so the
+first requests after a deploy do not pay for it and syntax errors surface at
+startup. The WSGI and ASGI entry points call ``warm_templates_on_startup()``
+when CATALOG_WARM_TEMPLATES is set, and ``manage.py warm_templates`` runs it
+as a deploy check.
+"""
+import logging
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.template import TemplateSyntaxError, engines
+
+logger = logging.getLogger(__name__)
+
+
+def loader_dirs(loaders):
+    """
+    The directories searched by ``loaders`` (cached loaders included), in order.
+    """
+    for loader in loaders:
+        if hasattr(loader, 'loaders'):
+            yield from loader_dirs(loader.loaders)
+        elif hasattr(loader, 'get_dirs'):
+            yield from loader.get_dirs()
+
+
+def template_names(engine, include_third_party=False):
+    """
+    Every template name under the engine's loader directories, the project's
+    own (under BASE_DIR) unless ``include_third_party``. A name found in two
+    directories is listed once, as the loaders would resolve it.
+    """
+    names = {}
+    for directory in loader_dirs(engine.template_loaders):
+        directory = Path(directory).resolve()
+        if not directory.is_dir() or not (include_third_party or directory.is_relative_to(settings.BASE_DIR)):
+            continue
+        for root, dirs, files in os.walk(directory):
+            for file in files:
+                name = Path(root, file).relative_to(directory).as_posix()
+                names.setdefault(name, directory)
+    return sorted(names)
+
+
+def warm_templates(using=None, include_third_party=False):
+    """
+    Load and compile every template of the ``using`` engine (by default, of
+    each Django template engine); return the names compiled, a list of
+    (name, error) for the ones that failed and the time taken.
+    """
+    backends = [engines[using]] if using else [backend for backend in engines.all() if hasattr(backend, 'engine')]
+    start = time.perf_counter()
+    compiled = []
+    errors = []
+    for backend in backends:
+        for name in template_names(backend.engine, include_third_party):
+            try:
+                backend.get_template(name)
+            except TemplateSyntaxError as e:
+                errors.append((name, e))
+            else:
+                compiled.append(name)
+    return compiled, errors, time.perf_counter() - start
+
+
+def warm_templates_on_startup():
+    """
+    Warm the templates for a WSGI/ASGI process. Each template that fails to
+    compile is logged at ERROR level and the process refuses to start.
+    """
+    compiled, errors, elapsed = warm_templates()
+    for name, error in errors:
+        logger.error('Template %s failed to compile: %s', name, error)
+    if errors:
+        raise ImproperlyConfigured('%d templates failed to compile.' % len(errors))
+    logger.info('Compiled %d templates in %.1fms', len(compiled), elapsed * 1000)
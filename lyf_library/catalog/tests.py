@@ -1,5 +1,5 @@
-from django.test import TestCase
-from catalog.models import Author, Book, Genre, BookInstance
+from django.test import TestCase, TransactionTestCase
+from catalog.models import Author, Book, Genre, BookInstance, CirculationRollup, Hold, LoanEvent, normalize_search_key
 from django.urls import reverse
 import datetime
 from django.contrib.auth.models import User
@@ -7,6 +7,38 @@ from django.test import Client
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from catalog.forms import RenewBookForm
+from catalog.counters import COUNTER_KEYS, aget_counters, compute_counters, get_counters
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import ImproperlyConfigured
+from io import StringIO
+import asyncio
+import csv
+import gzip
+import html
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from unittest import mock, skipUnless
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.test import RequestFactory, override_settings
+from django.template import Context, Template
+from django.http import Http404
+from django.conf import settings
+from catalog import assets, autocomplete, availability, benchmarks, caching, circulation, counters, exporting, history, instrumentation, reservations, rollups, search, templating, views
+from catalog import urls as catalog_urls
+from django.urls import resolve
+from django.utils import timezone, translation
+from catalog.pagination import CursorPaginator, EstimatedCountPaginator, estimate_count
+from catalog.admin import BooksInstanceInline
+from django.db.models import Count, F
+from urllib.parse import quote
+from lyf_library.database import database_settings
 
 # Create your tests here.
 
@@ -335,6 +367,10 @@ class RenewBookInstancesViewTest(TestCase):
 
 
 class GeneralViewTests(TestCase):
+    def setUp(self):
+        # Pages are cached across tests otherwise
+        cache.clear()
+
     def test_index_view(self):
         response = self.client.get(reverse('index'))
         self.assertEqual(response.status_code, 200)
@@ -349,3 +385,1883 @@ class GeneralViewTests(TestCase):
         response = self.client.get(reverse('authors'))
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'catalog/author_list.html')
+
+
+class CatalogCountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Big', last_name='Bob')
+        cls.book = Book.objects.create(title='Test Book', author=author, summary='Summary', isbn='1234567890123')
+        BookInstance.objects.create(book=cls.book, imprint='Imprint 1', status='a')
+        BookInstance.objects.create(book=cls.book, imprint='Imprint 2', status='o')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rebuild_on_miss_uses_one_query(self):
+        with self.assertNumQueries(1):
+            counters = get_counters()
+        self.assertEqual(counters, {'num_books': 1, 'num_instances': 2, 'num_instances_available': 1, 'num_authors': 1})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_counters(), counters)
+
+    def test_signals_update_counters_incrementally(self):
+        get_counters()
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = BookInstance.objects.create(book=self.book, imprint='Imprint 3', status='a')
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = BookInstance.objects.get(pk=copy.pk)
+            copy.status = 'o'
+            copy.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(first_name='New', last_name='Author')
+        with self.assertNumQueries(0):
+            counters = get_counters()
+        self.assertEqual(counters, {'num_books': 1, 'num_instances': 3, 'num_instances_available': 1, 'num_authors': 2})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.filter(status='a').get().delete()
+        self.assertEqual(get_counters()['num_instances_available'], 0)
+        self.assertEqual(get_counters(), compute_counters())
+
+    def test_counters_expire(self):
+        get_counters()
+        # An increment that only reached another process's cache
+        Author.objects.bulk_create([Author(first_name='Other', last_name='Process')])
+        self.assertEqual(get_counters()['num_authors'], 1)
+        later = time.time() + counters.COUNTERS_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later), self.assertNumQueries(1):
+            self.assertEqual(get_counters()['num_authors'], 2)
+
+    def test_rebuild_counters_command(self):
+        get_counters()
+        cache.set(COUNTER_KEYS['num_books'], 42)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', verify_only=True, stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_counters', stdout=out)
+        self.assertIn('local to this process', out.getvalue())
+        call_command('rebuild_counters', verify_only=True, stdout=StringIO())
+        self.assertEqual(get_counters()['num_books'], 1)
+
+
+class CatalogViewQueryCountTest(TestCase):
+    """
+    Every catalog page must run a fixed number of queries however many rows it shows.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='12345')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        genres = [Genre.objects.create(name='Genre %s' % num) for num in range(3)]
+        cls.author = Author.objects.create(first_name='Big', last_name='Bob')
+        for num in range(6):
+            author = cls.author if num % 2 else Author.objects.create(first_name='First %s' % num, last_name='Last %s' % num)
+            book = Book.objects.create(title='Book %s' % num, author=author, summary='Summary', isbn='1234567890123')
+            book.genre.set(genres)
+            for copy_num in range(3):
+                BookInstance.objects.create(
+                    book=book, imprint='Imprint', status='o', borrower=cls.librarian,
+                    due_back=datetime.date.today() + datetime.timedelta(days=copy_num),
+                )
+        cls.book = book
+        cls.bookinstance = BookInstance.objects.filter(book=book).first()
+
+    def setUp(self):
+        cache.clear()
+        get_counters()
+
+    # The public list and detail pages also run one aggregate query for their
+    # Last-Modified/ETag state.
+    def assertQueriesForGet(self, num, url):
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_index(self):
+        # Counters come from the cache and visits are counted in a cookie
+        self.assertQueriesForGet(0, reverse('index'))
+
+    def test_book_list(self):
+        self.assertQueriesForGet(3, reverse('books'))
+
+    def test_book_detail(self):
+        self.assertQueriesForGet(4, reverse('book-detail', args=[self.book.pk]))
+
+    def test_author_list(self):
+        self.assertQueriesForGet(3, reverse('authors'))
+
+    def test_author_detail(self):
+        self.assertQueriesForGet(3, reverse('author-detail', args=[self.author.pk]))
+
+    def test_my_borrowed(self):
+        self.client.force_login(self.librarian)
+        # The loans and the holds
+        self.assertQueriesForGet(7, reverse('my-borrowed'))
+
+    def test_all_borrowed(self):
+        self.client.force_login(self.librarian)
+        self.assertQueriesForGet(6, reverse('all-borrowed'))
+
+    def test_renew_book_librarian(self):
+        self.client.force_login(self.librarian)
+        self.assertQueriesForGet(5, reverse('renew-book-librarian', args=[self.bookinstance.pk]))
+
+    def test_author_and_book_forms(self):
+        self.assertQueriesForGet(0, reverse('author_create'))
+        self.assertQueriesForGet(1, reverse('author_update', args=[self.author.pk]))
+        self.assertQueriesForGet(1, reverse('author_delete', args=[self.author.pk]))
+        self.assertQueriesForGet(0, reverse('book_create'))
+        self.assertQueriesForGet(4, reverse('book_update', args=[self.book.pk]))
+        self.assertQueriesForGet(1, reverse('book_delete', args=[self.book.pk]))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite only')
+class CatalogQueryPlanTest(TestCase):
+    """
+    The hot catalog filters must be answered from an index, not a full table scan.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testuser', password='12345')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertNotRegex(plan, r'SCAN catalog_', plan)
+        self.assertNotIn('TEMP B-TREE', plan, plan)
+
+    def test_borrowed_books_list(self):
+        view = views.BorrowedBooksListView()
+        view.request = RequestFactory().get(reverse('all-borrowed'))
+        self.assertUsesIndex(view.get_queryset())
+        view.request = RequestFactory().get(reverse('all-borrowed') + '?overdue=1')
+        self.assertUsesIndex(view.get_queryset())
+
+    def test_overdue(self):
+        self.assertUsesIndex(BookInstance.objects.overdue())
+        plan = BookInstance.objects.overdue().order_by().values('borrower').annotate(n=Count('pk')).explain()
+        self.assertNotRegex(plan, r'SCAN catalog_', plan)
+
+    def test_loaned_books_by_user_list(self):
+        view = views.LoanedBooksByUserListView()
+        view.request = RequestFactory().get(reverse('my-borrowed'))
+        view.request.user = self.user
+        self.assertUsesIndex(view.get_queryset())
+
+    def test_admin_status_and_due_back_filters(self):
+        self.assertUsesIndex(BookInstance.objects.filter(status__exact='a', due_back__gte=datetime.date.today()))
+
+    def test_book_lookups(self):
+        self.assertUsesIndex(Book.objects.filter(title='Test Book'))
+        self.assertUsesIndex(Book.objects.filter(isbn='1234567890123'))
+
+    def test_author_lookup(self):
+        self.assertUsesIndex(Author.objects.filter(last_name='Bob', first_name='Big'))
+
+
+class CursorPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Big', last_name='Bob')
+        book = Book.objects.create(title='Test Book', author=author, summary='Summary', isbn='1234567890123')
+        for num in range(13):
+            # Repeated and missing due dates exercise the tie-breaker and NULL handling
+            due_back = None if num % 5 == 0 else datetime.date.today() + datetime.timedelta(days=num % 3)
+            BookInstance.objects.create(book=book, imprint='Imprint %s' % num, due_back=due_back, status='o')
+        for num in range(7):
+            Book.objects.create(title='Book %s' % (num % 3), author=author, summary='Summary', isbn='1234567890123')
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, paginator):
+        pages = []
+        page = paginator.page()
+        pages.append([obj.pk for obj in page])
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            pages.append([obj.pk for obj in page])
+        backwards = [[obj.pk for obj in page]]
+        while page.has_previous():
+            page = paginator.page(page.previous_cursor)
+            backwards.insert(0, [obj.pk for obj in page])
+        return pages, backwards
+
+    def test_walks_every_row_once_in_order(self):
+        queryset = BookInstance.objects.filter(status__exact='o')
+        pages, backwards = self.walk(CursorPaginator(queryset, ('due_back', 'id'), 4))
+        expected = list(queryset.order_by(F('due_back').asc(nulls_first=True), 'id').values_list('pk', flat=True))
+        self.assertEqual([pk for page in pages for pk in page], expected)
+        self.assertEqual([len(page) for page in pages], [4, 4, 4, 1])
+        self.assertEqual(backwards, pages)
+
+    def test_walks_descending(self):
+        queryset = BookInstance.objects.filter(status__exact='o')
+        pages, backwards = self.walk(CursorPaginator(queryset, ('-due_back', 'id'), 4))
+        expected = list(queryset.order_by(F('due_back').desc(nulls_last=True), 'id').values_list('pk', flat=True))
+        self.assertEqual([pk for page in pages for pk in page], expected)
+        self.assertEqual(backwards, pages)
+
+    def test_walks_books_by_title(self):
+        pages, backwards = self.walk(CursorPaginator(Book.objects.all(), ('title', 'id'), 3))
+        self.assertEqual([pk for page in pages for pk in page], list(Book.objects.order_by('title', 'id').values_list('pk', flat=True)))
+        self.assertEqual(backwards, pages)
+
+    def test_book_list_cursor_page_skips_count(self):
+        get_counters()
+        # The Last-Modified/ETag aggregate and the page itself; no COUNT(*)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('books') + '?cursor=')
+        self.assertTrue(response.context['is_cursor_paginated'])
+        self.assertEqual(len(response.context['book_list']), 5)
+        next_cursor = response.context['page_obj'].next_cursor
+        self.assertContains(response, '?cursor=%s' % quote(next_cursor))
+        response = self.client.get(reverse('books'), {'cursor': next_cursor})
+        self.assertEqual(len(response.context['book_list']), 3)
+        self.assertFalse(response.context['page_obj'].has_next())
+
+    def test_offset_pagination_is_still_the_default(self):
+        response = self.client.get(reverse('books') + '?page=2')
+        self.assertFalse(response.context['is_cursor_paginated'])
+        self.assertEqual(len(response.context['book_list']), 3)
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get(reverse('authors'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tolstoy = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.history = Genre.objects.create(name='History')
+        cls.war_and_peace = Book.objects.create(title='War and Peace', author=cls.tolstoy, summary='Napoleon invades Russia.', isbn='9780199232765')
+        cls.war_and_peace.genre.add(cls.history)
+        cls.other = Book.objects.create(title='Anna Karenina', author=cls.tolstoy, summary='Not a book about war.', isbn='9780143035008')
+
+    def backends(self):
+        backends = [search.TermIndexBackend()]
+        if isinstance(search.get_backend(), search.FTS5Backend):
+            backends.append(search.FTS5Backend())
+        return backends
+
+    def test_ranks_title_matches_first(self):
+        for backend in self.backends():
+            with self.subTest(backend=type(backend).__name__):
+                search.rebuild_index(backend=backend)
+                self.assertEqual(search.search_books('war', backend=backend), [self.war_and_peace.pk, self.other.pk])
+                self.assertEqual(search.search_books('war russia', backend=backend), [self.war_and_peace.pk])
+                self.assertEqual(search.search_books('9780143035008', backend=backend), [self.other.pk])
+                self.assertEqual(search.search_books('history tolstoy', backend=backend), [self.war_and_peace.pk])
+                self.assertEqual(search.search_books('war', limit=1, offset=1, backend=backend), [self.other.pk])
+                self.assertEqual(search.search_books('  ', backend=backend), [])
+
+    def test_search_view_pages_are_bounded(self):
+        response = self.client.get(reverse('search'), {'q': 'war', 'page': '99999999999999999999'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_number'], views.SEARCH_MAX_PAGE)
+        self.assertEqual(list(response.context['book_list']), [])
+
+    def test_index_follows_model_changes(self):
+        self.tolstoy.last_name = 'Tolstoi'
+        self.tolstoy.save()
+        self.assertEqual(len(search.search_books('tolstoi')), 2)
+        self.history.delete()
+        self.assertEqual(search.search_books('history'), [])
+        self.war_and_peace.genre.add(Genre.objects.create(name='Classics'))
+        self.assertEqual(search.search_books('classics'), [self.war_and_peace.pk])
+        self.other.delete()
+        self.assertEqual(search.search_books('war'), [self.war_and_peace.pk])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'War'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/search.html')
+        self.assertEqual(response.context['book_list'], [self.war_and_peace, self.other])
+        self.assertFalse(response.context['has_next'])
+
+    def test_rebuild_search_index_command(self):
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 2 books', out.getvalue())
+
+
+class ImportCatalogCommandTest(TestCase):
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        Author.objects.create(first_name='Leo', last_name='Tolstoy')
+
+    def test_imports_all_kinds_in_batches(self):
+        authors = self.write('authors.csv', 'first_name,last_name,date_of_birth\nLeo,Tolstoy,1828-09-09\nJane,Austen,1775-12-16\n')
+        genres = self.write('genres.csv', 'name\nHistory\nRomance\n')
+        books = self.write('books.jsonl', '\n'.join(json.dumps(row) for row in [
+            {'title': 'War and Peace', 'isbn': '9780199232765', 'author_first_name': 'Leo', 'author_last_name': 'Tolstoy', 'genres': ['History', 'Classics']},
+            {'title': 'Emma', 'isbn': '9780141439587', 'author_first_name': 'Jane', 'author_last_name': 'Austen', 'genres': ['Romance']},
+            {'title': 'Middlemarch', 'isbn': '9780141439549', 'author_first_name': 'George', 'author_last_name': 'Eliot'},
+            {'title': '', 'isbn': 'skipped'},
+        ]))
+        copies = self.write('copies.csv', 'isbn,imprint,status,due_back\n9780141439587,Penguin,o,2030-01-01\n9780141439587,Penguin,,\n0000000000000,Unknown,a,\n')
+
+        out = StringIO()
+        call_command(
+            'import_catalog', authors=authors, genres=genres, books=books, copies=copies,
+            batch_size=2, skip_search_index=True, stdout=out,
+        )
+        self.assertIn('books: 3 imported, 1 skipped', out.getvalue())
+        self.assertIn('copies: 2 imported, 1 skipped', out.getvalue())
+
+        self.assertEqual(Author.objects.count(), 3)
+        self.assertEqual(Author.objects.get(last_name='Austen').date_of_birth, datetime.date(1775, 12, 16))
+        self.assertEqual(sorted(Genre.objects.values_list('name', flat=True)), ['Classics', 'History', 'Romance'])
+        war_and_peace = Book.objects.get(title='War and Peace')
+        self.assertEqual(war_and_peace.author.last_name, 'Tolstoy')
+        self.assertEqual(war_and_peace.display_genre(), 'History, Classics')
+        emma = Book.objects.get(title='Emma')
+        self.assertEqual(sorted(emma.bookinstance_set.values_list('status', flat=True)), ['a', 'o'])
+        self.assertEqual(get_counters()['num_instances'], 2)
+        self.assertEqual(emma.search_key, 'emma')
+        self.assertEqual(Author.objects.get(last_name='Eliot').search_key, 'eliot george')
+
+    def test_reports_invalid_rows_as_skipped(self):
+        authors = self.write('authors.csv', 'first_name,last_name,date_of_birth\nJane,Austen,1775-02-30\nAnne,Bronte,someday\nGeorge,Eliot,\n')
+        books = self.write('books.csv', 'title,isbn\nEmma,9780141439587\n')
+        copies = self.write('copies.csv', '\n'.join([
+            'isbn,imprint,status,due_back,id',
+            '9780141439587,Penguin,o,2024-02-30,',
+            '9780141439587,Penguin,a,,not-a-uuid',
+            '9780141439587,Penguin,x,,',
+            '0000000000000,Unknown,a,,',
+            '9780141439587,Penguin,o,2030-01-01,',
+        ]))
+
+        out = StringIO()
+        call_command('import_catalog', authors=authors, books=books, copies=copies, skip_search_index=True, stdout=out)
+        self.assertIn('authors: 1 imported, 2 skipped', out.getvalue())
+        self.assertIn('  2 skipped: invalid date', out.getvalue())
+        self.assertIn('copies: 1 imported, 4 skipped', out.getvalue())
+        for reason in ('invalid due_back', 'invalid id', 'invalid status', 'unknown isbn'):
+            self.assertIn('  1 skipped: %s' % reason, out.getvalue())
+        self.assertEqual(list(Author.objects.filter(last_name__in=['Austen', 'Bronte', 'Eliot']).values_list('last_name', flat=True)), ['Eliot'])
+        self.assertEqual(BookInstance.objects.get().due_back, datetime.date(2030, 1, 1))
+
+    def test_indexes_imported_books_for_search(self):
+        books = self.write('books.csv', 'title,isbn,genres\nWar and Peace,9780199232765,History;Classics\n')
+        call_command('import_catalog', books=books, stdout=StringIO())
+        self.assertEqual(search.search_books('classics'), [Book.objects.get().pk])
+
+
+class ExportCatalogTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        book = Book.objects.create(title='War and Peace', author=author, summary='Napoleon, Russia.', isbn='9780199232765')
+        book.genre.add(Genre.objects.create(name='History'), Genre.objects.create(name='Classics'))
+        BookInstance.objects.create(book=book, imprint='Penguin', status='a')
+        BookInstance.objects.create(book=book, imprint='Penguin', status='o')
+        Book.objects.create(title='No Author', summary='', isbn='')
+        cls.librarian = User.objects.create_user(username='librarian', password='12345')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+    def setUp(self):
+        self.client.force_login(self.librarian)
+
+    def test_export_needs_permission(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('export-csv')).status_code, 403)
+        self.client.force_login(User.objects.create_user(username='reader', password='12345'))
+        self.assertEqual(self.client.get(reverse('export-jsonl')).status_code, 403)
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('export-csv'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['summary'], 'Napoleon, Russia.')
+        self.assertEqual(rows[0]['genres'], 'History;Classics')
+        self.assertEqual((rows[0]['copies_total'], rows[0]['copies_available'], rows[0]['copies_on_loan']), ('2', '1', '1'))
+        self.assertEqual(rows[1]['author_last_name'], '')
+
+    def test_gzipped_jsonl_export(self):
+        response = self.client.get(reverse('export-jsonl'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        rows = [json.loads(line) for line in gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()]
+        self.assertEqual(rows[0]['genres'], ['History', 'Classics'])
+        self.assertEqual(rows[1]['title'], 'No Author')
+
+    def test_export_is_chunked(self):
+        # One streamed query for the books plus one genre prefetch per chunk
+        with self.assertNumQueries(3):
+            rows = list(exporting.export_rows(chunk_size=1))
+        self.assertEqual(len(rows), 2)
+
+    def test_export_catalog_command_round_trips_through_import(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'catalog.jsonl.gz')
+            call_command('export_catalog', path, format='jsonl', gzip=True, stdout=StringIO())
+            Book.objects.all().delete()
+            call_command('import_catalog', books=path, stdout=StringIO())
+        self.assertEqual(Book.objects.get(title='War and Peace').display_genre(), 'History, Classics')
+
+
+class BookCopyCountsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Book A', summary='Summary', isbn='1234567890123')
+        cls.other = Book.objects.create(title='Book B', summary='Summary', isbn='1234567890124')
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCounts(self, book, total, available, on_loan):
+        book.refresh_from_db()
+        self.assertEqual((book.copies_total, book.copies_available, book.copies_on_loan), (total, available, on_loan))
+
+    def test_counts_follow_copy_changes(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='m')
+        self.assertCounts(self.book, 2, 1, 0)
+
+        copy = BookInstance.objects.get(pk=copy.pk)
+        copy.status = 'o'
+        copy.save()
+        self.assertCounts(self.book, 2, 0, 1)
+
+        copy.book = self.other
+        copy.save()
+        self.assertCounts(self.book, 1, 0, 0)
+        self.assertCounts(self.other, 1, 0, 1)
+
+        copy.delete()
+        self.assertCounts(self.other, 0, 0, 0)
+
+    def test_save_of_deferred_copy_fetches_no_fields(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        copy = BookInstance.objects.only('id', 'status', 'book_id').get(pk=copy.pk)
+        copy.status = 'o'
+        with CaptureQueriesContext(connection) as queries:
+            copy.save(update_fields=['status'])
+        self.assertFalse([query for query in queries.captured_queries if 'SELECT "catalog_bookinstance"' in query['sql']])
+        self.assertEqual(set(copy.loaded_values), {'id', 'status', 'book_id'})
+        self.assertEqual(copy.get_deferred_fields(), {'imprint', 'due_back', 'borrower_id', 'updated_at'})
+        self.assertCounts(self.book, 1, 0, 1)
+
+    def test_save_of_unloaded_copy_recounts(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        BookInstance(pk=copy.pk, book=self.book, imprint='Imprint', status='o').save(force_update=True)
+        self.assertCounts(self.book, 1, 0, 1)
+
+    def test_save_of_stale_book_keeps_counts(self):
+        stale = Book.objects.get(pk=self.book.pk)
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        stale.title = 'Book A, revised'
+        stale.save()
+        self.assertCounts(stale, 1, 1, 0)
+        self.assertEqual(stale.title, 'Book A, revised')
+
+    def test_copying_a_book(self):
+        book = Book.objects.get(pk=self.book.pk)
+        book.pk = None
+        book._state.adding = True
+        book.save()
+        self.assertNotEqual(book.pk, self.book.pk)
+        self.assertEqual(Book.objects.filter(title='Book A').count(), 2)
+        book.pk = None
+        book.save()
+        self.assertEqual(Book.objects.filter(title='Book A').count(), 3)
+
+    def test_reconcile_command_fixes_drift(self):
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        Book.objects.update(copies_total=7, copies_available=0)
+        out = StringIO()
+        call_command('reconcile_book_copies', stdout=out)
+        self.assertIn('Corrected the copy counts of 2 books', out.getvalue())
+        self.assertCounts(self.book, 1, 1, 0)
+        self.assertCounts(self.other, 0, 0, 0)
+
+    def test_book_list_available_filter(self):
+        BookInstance.objects.create(book=self.other, imprint='Imprint', status='a')
+        response = self.client.get(reverse('books'), {'available': '1'})
+        self.assertEqual(list(response.context['book_list']), [self.other])
+        self.assertContains(response, '1 copies, 1 available')
+
+    def test_book_list_pages_keep_the_filter(self):
+        books = Book.objects.bulk_create([
+            Book(title='Book %02d' % i, summary='Summary', isbn='1234567890%03d' % i) for i in range(12)
+        ])
+        for book in books[::2]:
+            BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        response = self.client.get(reverse('books'), {'available': '1'})
+        next_link = html.unescape(re.search(r'href="(\?[^"]*)">next', response.content.decode())[1])
+        self.assertIn('available=1', next_link)
+        response = self.client.get(reverse('books') + next_link)
+        self.assertTrue(response.context['book_list'])
+        self.assertTrue(all(book.copies_available for book in response.context['book_list']))
+
+
+class CatalogPageCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.book = Book.objects.create(title='War and Peace', author=cls.author, summary='Summary', isbn='9780199232765')
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Penguin', status='a')
+        cls.user = User.objects.create_user(username='testuser', password='12345')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        for url in [reverse('books'), reverse('book-detail', args=[self.book.pk]), reverse('authors'), reverse('author-detail', args=[self.author.pk])]:
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                with self.assertNumQueries(0):
+                    second = self.client.get(url)
+                self.assertEqual(second.content, first.content)
+
+    def test_copy_change_evicts_dependent_pages(self):
+        book_url = reverse('book-detail', args=[self.book.pk])
+        author_url = reverse('author-detail', args=[self.author.pk])
+        self.assertContains(self.client.get(book_url), '1 copies, 1 available')
+        self.assertContains(self.client.get(author_url), '1 copies, 1 available')
+        self.client.get(reverse('authors'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = BookInstance.objects.get(pk=self.copy.pk)
+            copy.status = 'o'
+            copy.save()
+        self.assertContains(self.client.get(book_url), '1 copies, 0 available')
+        self.assertContains(self.client.get(author_url), '1 copies, 0 available')
+        # Pages that do not show copies stay cached
+        with self.assertNumQueries(0):
+            self.client.get(reverse('authors'))
+
+    def test_author_rename_evicts_book_pages(self):
+        book_url = reverse('book-detail', args=[self.book.pk])
+        self.client.get(book_url)
+        self.client.get(reverse('books'))
+        self.author.last_name = 'Tolstoi'
+        self.author.save()
+        self.assertContains(self.client.get(book_url), 'Tolstoi')
+        self.assertContains(self.client.get(reverse('books')), 'Tolstoi')
+
+    def test_pages_expire_soon_with_a_process_local_cache(self):
+        self.assertEqual(caching.CACHE_TIMEOUT, 60)
+        url = reverse('book-detail', args=[self.book.pk])
+        self.assertNotContains(self.client.get(url), 'On loan')
+        # A change whose tag bump only reached another process's cache
+        BookInstance.objects.filter(pk=self.copy.pk).update(status='o')
+        self.assertNotContains(self.client.get(url), 'On loan')
+        later = time.time() + caching.CACHE_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertContains(self.client.get(url), 'On loan')
+
+    def test_page_key_varies_on_page_and_language(self):
+        request = RequestFactory().get(reverse('books'), {'page': '2'})
+        key = caching.page_cache_key(request, ['books'])
+        self.assertNotEqual(key, caching.page_cache_key(RequestFactory().get(reverse('books')), ['books']))
+        with translation.override('fr'):
+            self.assertNotEqual(key, caching.page_cache_key(request, ['books']))
+
+    def test_authenticated_users_get_fragments_not_pages(self):
+        self.client.force_login(self.user)
+        url = reverse('book-detail', args=[self.book.pk])
+        self.client.get(url)
+        # session, user, book, genres and the sidebar's two permission queries;
+        # the copies come from the cached fragment
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertContains(response, 'Penguin')
+        self.assertTemplateUsed(response, 'catalog/book_detail.html')
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.book = Book.objects.create(title='War and Peace', author=cls.author, summary='Summary', isbn='9780199232765')
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Penguin', status='a')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_unchanged_pages_answer_304(self):
+        for url in [reverse('books'), reverse('book-detail', args=[self.book.pk]), reverse('authors'), reverse('author-detail', args=[self.author.pk])]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertIn('Last-Modified', response)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+
+    def test_copy_change_refreshes_book_and_author_pages(self):
+        book_url = reverse('book-detail', args=[self.book.pk])
+        author_url = reverse('author-detail', args=[self.author.pk])
+        book_etag = self.client.get(book_url)['ETag']
+        author_etag = self.client.get(author_url)['ETag']
+        # Make sure the new timestamps differ from the old ones
+        Book.objects.update(updated_at=F('updated_at') - datetime.timedelta(seconds=5))
+        BookInstance.objects.update(updated_at=F('updated_at') - datetime.timedelta(seconds=5))
+        cache.clear()
+
+        copy = BookInstance.objects.get(pk=self.copy.pk)
+        copy.status = 'o'
+        copy.save()
+        self.assertEqual(self.client.get(book_url, HTTP_IF_NONE_MATCH=book_etag).status_code, 200)
+        self.assertEqual(self.client.get(author_url, HTTP_IF_NONE_MATCH=author_etag).status_code, 200)
+
+    def test_deleted_copy_changes_etag(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        etag = self.client.get(url)['ETag']
+        BookInstance.objects.get(pk=self.copy.pk).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_differs_per_user(self):
+        url = reverse('books')
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(User.objects.create_user(username='testuser', password='12345'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_author_rename_touches_books(self):
+        Book.objects.update(updated_at=F('updated_at') - datetime.timedelta(seconds=5))
+        before = Book.objects.get(pk=self.book.pk).updated_at
+        self.author.first_name = 'Lev'
+        self.author.save()
+        self.assertGreater(Book.objects.get(pk=self.book.pk).updated_at, before)
+
+
+class CatalogApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.genre = Genre.objects.create(name='Fiction')
+        cls.books = []
+        for i in range(5):
+            book = Book.objects.create(title='Book %s' % i, author=cls.author, summary='Summary', isbn='978000000000%s' % i)
+            book.genre.add(cls.genre)
+            cls.books.append(book)
+        cls.copy = BookInstance.objects.create(book=cls.books[0], imprint='Penguin', status='a')
+
+    def get_json(self, url, status=200):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def test_sparse_fieldset_reads_only_requested_columns(self):
+        url = reverse('api-list', args=['books']) + '?fields=title'
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get_json(url)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('summary', queries[0]['sql'])
+        self.assertEqual(data['results'][0], {'id': self.books[0].pk, 'title': 'Book 0'})
+
+    def test_genres_are_fetched_in_one_query_per_page(self):
+        with self.assertNumQueries(2):
+            data = self.get_json(reverse('api-list', args=['books']))
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual(data['results'][0]['genres'], [self.genre.pk])
+        self.assertEqual(data['results'][0]['author'], self.author.pk)
+        self.assertEqual(data['results'][0]['copies_available'], 1)
+
+    def test_batch_lookup_by_ids(self):
+        ids = [self.books[3].pk, self.books[1].pk]
+        data = self.get_json(reverse('api-list', args=['books']) + '?fields=isbn&ids=%s,%s' % tuple(ids))
+        self.assertEqual([book['id'] for book in data['results']], sorted(ids))
+
+    def test_cursor_pagination(self):
+        url = reverse('api-list', args=['books']) + '?fields=title&limit=2'
+        seen = []
+        while url:
+            data = self.get_json(url)
+            seen.extend(book['id'] for book in data['results'])
+            url = data['next']
+        self.assertEqual(seen, [book.pk for book in self.books])
+
+    def test_copies_by_uuid(self):
+        data = self.get_json(reverse('api-list', args=['copies']) + '?ids=%s' % self.copy.pk)
+        self.assertEqual(data['results'][0]['id'], str(self.copy.pk))
+        self.assertNotIn('borrower', data['results'][0])
+        data = self.get_json(reverse('api-detail', args=['copies', self.copy.pk]))
+        self.assertEqual(data['book'], self.books[0].pk)
+
+    def test_detail(self):
+        data = self.get_json(reverse('api-detail', args=['authors', self.author.pk]) + '?fields=last_name')
+        self.assertEqual(data, {'id': self.author.pk, 'last_name': 'Tolstoy'})
+        self.get_json(reverse('api-detail', args=['authors', 999999]), status=404)
+
+    def test_bad_parameters(self):
+        self.get_json(reverse('api-list', args=['books']) + '?fields=password', status=400)
+        self.get_json(reverse('api-list', args=['books']) + '?ids=1,x', status=400)
+        self.get_json(reverse('api-list', args=['books']) + '?ids=99999999999999999999', status=400)
+        self.get_json(reverse('api-detail', args=['books', '-99999999999999999999']), status=400)
+        self.get_json(reverse('api-list', args=['books']) + '?cursor=bogus', status=400)
+        self.get_json(reverse('api-list', args=['borrowers']), status=404)
+        self.assertEqual(self.client.post(reverse('api-list', args=['books'])).status_code, 405)
+
+
+class BulkCirculationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.borrower = User.objects.create_user(username='reader', password='12345')
+        cls.librarian = User.objects.create_user(username='librarian', password='12345')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.book = Book.objects.create(title='War and Peace', author=author, summary='Summary', isbn='9780199232765')
+        cls.available = [BookInstance.objects.create(book=cls.book, imprint='Penguin', status='a') for i in range(3)]
+        cls.on_loan = BookInstance.objects.create(
+            book=cls.book, imprint='Penguin', status='o', borrower=cls.borrower,
+            due_back=datetime.date.today() + datetime.timedelta(days=3),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCountsInSync(self):
+        book = Book.objects.get(pk=self.book.pk)
+        self.assertEqual(
+            (book.copies_total, book.copies_available, book.copies_on_loan),
+            (4, BookInstance.objects.filter(status='a').count(), BookInstance.objects.filter(status='o').count()),
+        )
+        self.assertEqual(get_counters(), compute_counters())
+
+    def test_checkout_reports_each_copy(self):
+        get_counters()
+        missing = '00000000-0000-0000-0000-000000000000'
+        ids = [copy.pk for copy in self.available] + [self.on_loan.pk, missing, 'bogus']
+        with self.captureOnCommitCallbacks(execute=True):
+            outcomes = circulation.checkout(ids, self.borrower)
+        self.assertEqual([outcome['ok'] for outcome in outcomes], [True, True, True, False, False, False])
+        self.assertEqual(outcomes[3]['error'], 'Copy is not available')
+        self.assertEqual(outcomes[4]['error'], 'No such copy')
+        self.assertEqual(outcomes[5]['error'], 'Invalid copy id')
+        self.assertEqual(BookInstance.objects.filter(status='o', borrower=self.borrower).count(), 4)
+        self.assertCountsInSync()
+
+    def test_batch_uses_one_update(self):
+        ids = [copy.pk for copy in self.available]
+        with CaptureQueriesContext(connection) as queries:
+            circulation.checkout(ids, self.borrower)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "catalog_bookinstance"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('imprint', updates[0])
+
+    def test_return_and_renew(self):
+        get_counters()
+        with self.captureOnCommitCallbacks(execute=True):
+            outcomes = circulation.return_copies([self.on_loan.pk, self.available[0].pk])
+        self.assertEqual([outcome['error'] for outcome in outcomes], ['', 'Copy is not on loan'])
+        copy = BookInstance.objects.get(pk=self.on_loan.pk)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back), ('a', None, None))
+        self.assertCountsInSync()
+
+        circulation.checkout([self.on_loan.pk], self.borrower)
+        today = datetime.date.today()
+        outcomes = circulation.renew([
+            (self.on_loan.pk, today + datetime.timedelta(weeks=2)),
+            (self.on_loan.pk, today + datetime.timedelta(weeks=2)),
+        ])
+        self.assertEqual([outcome['error'] for outcome in outcomes], ['', 'Duplicate copy id'])
+        outcomes = circulation.renew([(self.on_loan.pk, today - datetime.timedelta(days=1))])
+        self.assertEqual(outcomes[0]['error'], 'Invalid date - renewal in past')
+        self.assertEqual(BookInstance.objects.get(pk=self.on_loan.pk).due_back, today + datetime.timedelta(weeks=2))
+
+    def test_book_page_is_refreshed(self):
+        url = reverse('book-detail', args=[self.book.pk])
+        self.assertContains(self.client.get(url), '4 copies, 3 available, 1 on loan')
+        with self.captureOnCommitCallbacks(execute=True):
+            circulation.checkout([self.available[0].pk], self.borrower)
+        self.assertContains(self.client.get(url), '4 copies, 2 available, 2 on loan')
+
+    def test_view(self):
+        url = reverse('bulk-return')
+        self.client.force_login(self.borrower)
+        self.assertEqual(self.client.post(url, {'ids': str(self.on_loan.pk)}).status_code, 403)
+        self.client.force_login(self.librarian)
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertEqual(self.client.post(url, {'ids': ''}).status_code, 400)
+        response = self.client.post(url, {'ids': '%s, %s' % (self.on_loan.pk, self.available[0].pk)})
+        self.assertEqual(response.json()['succeeded'], 1)
+        self.assertEqual(response.json()['failed'], 1)
+
+        response = self.client.post(reverse('bulk-checkout'), {'ids': str(self.on_loan.pk), 'borrower': 'nobody'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('bulk-checkout'), {'ids': str(self.on_loan.pk), 'borrower': 'reader'})
+        self.assertEqual(response.json()['results'][0]['ok'], True)
+        response = self.client.post(reverse('bulk-renew'), {'ids': str(self.on_loan.pk)})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('\n'.join(str(copy.pk) for copy in self.available))
+        self.addCleanup(os.remove, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('circulation', 'checkout', str(self.on_loan.pk), file=f.name, borrower='reader',
+                     batch_size=2, stdout=out, stderr=err)
+        self.assertIn('checkout: 3 succeeded, 1 failed', out.getvalue())
+        self.assertIn('Copy is not available', err.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('circulation', 'renew', str(self.on_loan.pk))
+
+
+class AsyncViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        for i in range(3):
+            Book.objects.create(title='Book %s' % i, author=author, summary='Summary', isbn='978000000000%s' % i)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_views_are_coroutines(self):
+        for view in (views.index, views.search, views.api_list, views.api_detail):
+            self.assertTrue(asyncio.iscoroutinefunction(view), view)
+        for view in (views.BookListView, views.BookDetailView, views.AuthorListView, views.AuthorDetailView):
+            self.assertTrue(view.view_is_async, view)
+
+    async def test_aget_counters(self):
+        counters = await aget_counters()
+        self.assertEqual(counters['num_books'], 3)
+        # Served from the cache the second time
+        self.assertEqual(await aget_counters(), counters)
+
+    async def test_cursor_paginator_apage(self):
+        paginator = CursorPaginator(Book.objects.order_by('pk'), ('title', 'id'), 2)
+        page = await paginator.apage()
+        self.assertEqual([book.title for book in page], ['Book 0', 'Book 1'])
+        page = await paginator.apage(page.next_cursor)
+        self.assertEqual([book.title for book in page], ['Book 2'])
+        self.assertFalse(page.has_next())
+
+    async def test_async_client(self):
+        response = await self.async_client.get(reverse('api-list', args=['books']) + '?fields=title')
+        self.assertEqual(len(response.json()['results']), 3)
+        response = await self.async_client.get(reverse('index'))
+        self.assertContains(response, '<strong>Books:</strong> 3')
+
+    async def test_async_list_and_detail_views(self):
+        book = await Book.objects.aget(title='Book 2')
+        response = await self.async_client.get(reverse('books'), {'page': 'last'})
+        self.assertEqual([book.title for book in response.context['book_list']], ['Book 0', 'Book 1', 'Book 2'])
+        response = await self.async_client.get(reverse('books'), {'cursor': ''})
+        self.assertContains(response, 'Book 2')
+        response = await self.async_client.get(reverse('book-detail', args=[book.pk]))
+        self.assertContains(response, 'Tolstoy')
+        etag = response['ETag']
+        response = await self.async_client.get(reverse('book-detail', args=[book.pk]), headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get(reverse('author-detail', args=[book.author_id]))
+        self.assertContains(response, 'Book 1')
+        response = await self.async_client.get(reverse('book-detail', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse('authors'), {'page': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_handlers', reverse('api-list', args=['genres']), requests=4, concurrency=2, host='testserver', stdout=out)
+        self.assertIn('wsgi', out.getvalue())
+        self.assertIn('asgi', out.getvalue())
+        self.assertNotRegex(out.getvalue(), r'errors [1-9]')
+
+
+class OverdueLoansTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username='alice', password='12345')
+        cls.bob = User.objects.create_user(username='bob', password='12345')
+        book = Book.objects.create(title='War and Peace', summary='Summary', isbn='9780199232765')
+        today = datetime.date.today()
+        cls.late = [
+            BookInstance.objects.create(book=book, imprint='A', status='o', borrower=cls.alice, due_back=today - datetime.timedelta(days=2)),
+            BookInstance.objects.create(book=book, imprint='B', status='o', borrower=cls.bob, due_back=today - datetime.timedelta(days=9)),
+            BookInstance.objects.create(book=book, imprint='C', status='o', borrower=cls.alice, due_back=today - datetime.timedelta(days=5)),
+        ]
+        # On loan but not due yet, and past due but not on loan
+        BookInstance.objects.create(book=book, imprint='D', status='o', borrower=cls.bob, due_back=today + datetime.timedelta(days=1))
+        BookInstance.objects.create(book=book, imprint='E', status='m', due_back=today - datetime.timedelta(days=1))
+
+    def test_overdue_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(BookInstance.objects.overdue().count(), 3)
+        self.assertEqual(BookInstance.objects.overdue(datetime.date.today() + datetime.timedelta(days=7)).count(), 4)
+
+    def test_with_overdue_matches_property(self):
+        copies = list(BookInstance.objects.with_overdue())
+        for copy in copies:
+            self.assertEqual(copy.overdue, copy.due_back is not None and copy.due_back < datetime.date.today())
+            self.assertEqual(copy.is_overdue, copy.overdue)
+
+    def test_borrowed_view_filters_overdue(self):
+        librarian = User.objects.create_user(username='librarian', password='12345')
+        librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.client.force_login(librarian)
+        response = self.client.get(reverse('all-borrowed') + '?overdue=1')
+        self.assertEqual(len(response.context['bookinstance_list']), 3)
+        self.assertTrue(all(copy.is_overdue for copy in response.context['bookinstance_list']))
+
+    def test_borrowed_pages_keep_the_filter(self):
+        librarian = User.objects.create_user(username='librarian', password='12345')
+        librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        book = Book.objects.get(title='War and Peace')
+        BookInstance.objects.bulk_create([
+            BookInstance(book=book, imprint='F', status='o', borrower=self.bob, due_back=datetime.date.today() + datetime.timedelta(days=i))
+            for i in range(1, 12)
+        ])
+        self.client.force_login(librarian)
+        response = self.client.get(reverse('all-borrowed') + '?overdue=1')
+        self.assertFalse(response.context['page_obj'].has_next())
+        response = self.client.get(reverse('all-borrowed'))
+        next_link = html.unescape(re.search(r'href="(\?[^"]*)">next', response.content.decode())[1])
+        self.assertNotIn('overdue', next_link)
+
+        BookInstance.objects.filter(imprint='F').update(due_back=datetime.date.today() - datetime.timedelta(days=1))
+        response = self.client.get(reverse('all-borrowed') + '?overdue=1')
+        next_link = html.unescape(re.search(r'href="(\?[^"]*)">next', response.content.decode())[1])
+        self.assertIn('overdue=1', next_link)
+        response = self.client.get(reverse('all-borrowed') + next_link)
+        self.assertEqual(len(response.context['bookinstance_list']), 4)
+        self.assertTrue(all(copy.is_overdue for copy in response.context['bookinstance_list']))
+
+    def test_report_groups_by_borrower(self):
+        out = StringIO()
+        with self.assertNumQueries(1):
+            call_command('overdue_report', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'alice (2 overdue)')
+        # Oldest due date first within a borrower
+        self.assertIn(str(self.late[2].pk), lines[1])
+        self.assertEqual(lines[3], 'bob (1 overdue)')
+        self.assertEqual(lines[-1], '3 overdue loans, 2 borrowers')
+
+    def test_report_csv_and_count(self):
+        out = StringIO()
+        call_command('overdue_report', format='csv', stdout=out)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(rows[0], ['borrower', 'copy', 'title', 'due_back'])
+        self.assertEqual([row[0] for row in rows[1:]], ['alice', 'alice', 'bob'])
+        out = StringIO()
+        call_command('overdue_report', count_only=True, stdout=out)
+        self.assertEqual(out.getvalue().strip(), '3')
+
+
+class VisitCounterTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def get_num_visits(self):
+        return self.client.get(reverse('index')).context['num_visits']
+
+    def test_signed_cookie_counter(self):
+        self.assertEqual([self.get_num_visits() for i in range(3)], [0, 1, 2])
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+        # A tampered cookie starts over
+        self.client.cookies['num_visits'] = '99'
+        self.assertEqual(self.get_num_visits(), 0)
+
+    @override_settings(CATALOG_VISIT_COUNTER='cache')
+    def test_cache_counter(self):
+        self.assertEqual([self.get_num_visits() for i in range(3)], [0, 1, 2])
+        self.assertIn('visitor', self.client.cookies)
+        self.assertEqual(Client().get(reverse('index')).context['num_visits'], 0)
+
+    @override_settings(CATALOG_VISIT_COUNTER='session')
+    def test_session_counter(self):
+        self.assertEqual([self.get_num_visits() for i in range(2)], [0, 1])
+        self.assertEqual(self.client.session['num_visits'], 2)
+
+    def test_logged_in_visit_does_not_save_session(self):
+        self.client.force_login(User.objects.create_user(username='testuser', password='12345'))
+        self.get_num_visits()
+        with CaptureQueriesContext(connection) as queries:
+            self.get_num_visits()
+        self.assertFalse([query for query in queries if 'django_session' in query['sql'] and 'UPDATE' in query['sql']])
+
+
+class InstrumentationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        Book.objects.create(title='War and Peace', author=author, summary='Summary', isbn='9780199232765')
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.registry.clear()
+
+    def server_timing(self, response):
+        return dict(re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing'])), response['Server-Timing']
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('books'))
+        timings, header = self.server_timing(response)
+        self.assertEqual(set(timings), {'total', 'db', 'tpl'})
+        self.assertGreater(float(timings['tpl']), 0)
+        # The ETag state, the counters, the paginator's COUNT and the page itself
+        self.assertIn('desc="4 queries"', header)
+
+    def test_async_view_queries_are_counted(self):
+        response = self.client.get(reverse('api-list', args=['books']))
+        timings, header = self.server_timing(response)
+        self.assertIn('desc="2 queries"', header)
+
+    def test_metrics_page(self):
+        for i in range(3):
+            self.client.get(reverse('books'))
+        self.client.get(reverse('authors'))
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(User.objects.create_user(username='staff', password='12345', is_staff=True))
+        views = self.client.get(url).json()['views']
+        self.assertEqual(views['books']['count'], 3)
+        self.assertEqual(views['authors']['count'], 1)
+        self.assertEqual(set(views['books']), {'count', 'wall_ms', 'db_ms', 'queries', 'template_ms', 'size'})
+        self.assertGreater(views['books']['size']['p50'], 0)
+
+    def test_registry_keeps_last_samples(self):
+        registry = instrumentation.MetricsRegistry(max_samples=10)
+        for i in range(100):
+            registry.add('view', (i, 0, i, 0, None))
+        summary = registry.summary()['view']
+        self.assertEqual(summary['count'], 10)
+        self.assertEqual(summary['queries'], {'p50': 95, 'p90': 99, 'p99': 99})
+        self.assertEqual(summary['size'], {})
+
+
+class BenchmarkSuiteTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_is_consistent(self):
+        created = benchmarks.seed(30, copies_per_book=2, batch_size=7)
+        self.assertEqual(created['books'], 30)
+        size = benchmarks.dataset_size()
+        self.assertEqual(size['books'], 30)
+        self.assertEqual(size['copies'], 60)
+        self.assertEqual(size['authors'], 3)
+        self.assertEqual(BookInstance.objects.on_loan().filter(borrower__isnull=True).count(), 0)
+        self.assertEqual(availability.recount_books(), 0)
+        self.assertEqual(get_counters(), compute_counters())
+
+    def test_scenarios_cover_every_catalog_url(self):
+        benchmarks.seed(10)
+        names = {pattern.name for pattern in catalog_urls.urlpatterns}
+        paths = [scenario['path'] for scenario in benchmarks.scenarios()]
+        for name in names:
+            with self.subTest(name=name):
+                self.assertTrue(any(resolve(path.split('?')[0]).url_name == name for path in paths))
+
+    def test_command_writes_json(self):
+        benchmarks.seed(10)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'results.json')
+            call_command('benchmark_catalog', iterations=1, host='testserver', allow_writes=True, output=path, stderr=StringIO())
+            with open(path) as f:
+                results = json.load(f)
+            self.assertEqual(results['dataset']['books'], 10)
+            by_name = {result['name']: result for result in results['client']}
+            self.assertEqual(by_name['books']['status'], [200])
+            self.assertEqual(by_name['admin-bookinstance']['status'], [200])
+            self.assertEqual(by_name['renew-book-librarian-post']['status'], [302])
+            self.assertEqual(by_name['bulk-checkout']['status'], [200])
+            for result in results['client']:
+                self.assertLess(max(result['status']), 400, result)
+
+            # Comparing a run against itself finds nothing; more queries is a regression
+            self.assertEqual(benchmarks.compare(results, results), [])
+            slower = json.loads(json.dumps(results))
+            slower['client'][0]['queries'] += 1
+            self.assertEqual(len(benchmarks.compare(results, slower)), 1)
+
+
+    def test_command_is_read_only_by_default(self):
+        benchmarks.seed(10)
+        loans = list(BookInstance.objects.on_loan().values_list('pk', 'borrower_id', 'due_back').order_by('pk'))
+        users = User.objects.count()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'results.json')
+            call_command('benchmark_catalog', iterations=1, host='testserver', output=path, stderr=StringIO())
+            with open(path) as f:
+                results = json.load(f)
+        by_name = {result['name']: result for result in results['client']}
+        self.assertEqual(by_name['admin-bookinstance']['status'], [200])
+        self.assertFalse([name for name, result in by_name.items() if result['method'] == 'POST'])
+        self.assertEqual(list(BookInstance.objects.on_loan().values_list('pk', 'borrower_id', 'due_back').order_by('pk')), loans)
+        self.assertEqual(User.objects.count(), users)
+        self.assertFalse(Hold.objects.exists())
+        with self.assertRaises(CommandError):
+            call_command('benchmark_catalog', holds=10, stderr=StringIO())
+
+
+class AdminScalingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('admin', password='12345')
+        genres = [Genre.objects.create(name='Genre %s' % i) for i in range(3)]
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        for i in range(10):
+            book = Book.objects.create(title='Book %s' % i, author=author, summary='Summary', isbn='978000000000%s' % i)
+            book.genre.set(genres)
+            BookInstance.objects.create(book=book, imprint='Penguin', status='o', borrower=cls.admin_user)
+        cls.book = book
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def changelist_queries(self, model):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:catalog_%s_changelist' % model))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        before = {model: self.changelist_queries(model) for model in ('book', 'bookinstance')}
+        author = Author.objects.get()
+        for i in range(10):
+            book = Book.objects.create(title='More %s' % i, author=author, summary='Summary', isbn='979000000000%s' % i)
+            book.genre.set(Genre.objects.all())
+            BookInstance.objects.create(book=book, imprint='Penguin', status='o', borrower=self.admin_user)
+        after = {model: self.changelist_queries(model) for model in ('book', 'bookinstance')}
+        self.assertEqual(before, after)
+
+    def test_estimated_count_paginator(self):
+        queryset = BookInstance.objects.order_by('pk')
+        paginator = EstimatedCountPaginator(queryset, 5)
+        self.assertEqual(paginator.count, 10)
+        paginator = EstimatedCountPaginator(queryset, 5)
+        paginator.estimate_threshold = 1
+        with self.assertNumQueries(1):
+            self.assertGreaterEqual(paginator.count, 10)
+        self.assertIsNotNone(estimate_count(Book))
+        # Filtered querysets are always counted exactly
+        paginator = EstimatedCountPaginator(queryset.filter(status='a'), 5)
+        paginator.estimate_threshold = 1
+        self.assertEqual(paginator.count, 0)
+
+    def test_copies_inline_is_dropped_for_large_books(self):
+        url = reverse('admin:catalog_book_change', args=[self.book.pk])
+        self.assertEqual(len(self.client.get(url).context['inline_admin_formsets']), 1)
+        Book.objects.filter(pk=self.book.pk).update(copies_total=BooksInstanceInline.max_copies + 1)
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['inline_admin_formsets']), 0)
+        self.assertContains(response, 'book__id__exact=%s' % self.book.pk)
+        response = self.client.get(reverse('admin:catalog_bookinstance_changelist') + '?book__id__exact=%s' % self.book.pk)
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class AutocompleteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('admin', password='12345')
+        cls.tolstoy = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.bronte = Author.objects.create(first_name='Charlotte', last_name='Brontë')
+        cls.genre = Genre.objects.create(name='History')
+        cls.book = Book.objects.create(title='War and Peace', author=cls.tolstoy, summary='Summary', isbn='9780199232765')
+        cls.book.genre.set([cls.genre])
+        Book.objects.create(title='Jane Eyre', author=cls.bronte, summary='Summary', isbn='9780141441146')
+
+    def setUp(self):
+        cache.clear()
+
+    def results(self, kind, q):
+        response = self.client.get(reverse('autocomplete', args=[kind]), {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [(result['id'], result['text']) for result in response.json()['results']]
+
+    def test_normalize_search_key(self):
+        self.assertEqual(normalize_search_key('  Brontë,  CHARLOTTE '), 'bronte charlotte')
+        self.assertEqual(normalize_search_key("L'Étranger!"), 'l etranger')
+        self.assertEqual(self.bronte.search_key, 'bronte charlotte')
+        self.assertEqual(self.book.search_key, 'war and peace')
+
+    def test_search_key_follows_updates(self):
+        self.tolstoy.last_name = 'Tolstoi'
+        self.tolstoy.save(update_fields=['last_name'])
+        self.assertEqual(Author.objects.get(pk=self.tolstoy.pk).search_key, 'tolstoi leo')
+
+    def test_endpoint(self):
+        self.assertEqual(self.results('authors', 'bron'), [(self.bronte.pk, 'Brontë, Charlotte')])
+        self.assertEqual(self.results('authors', 'BRONTË CH'), [(self.bronte.pk, 'Brontë, Charlotte')])
+        self.assertEqual(self.results('books', 'war and'), [(self.book.pk, 'War and Peace')])
+        self.assertEqual(self.results('genres', 'hist'), [(self.genre.pk, 'History')])
+        self.assertEqual(self.results('books', 'peace'), [])
+        self.assertEqual(self.results('books', '  '), [])
+        self.assertEqual(self.client.get(reverse('autocomplete', args=['copies'])).status_code, 404)
+
+    def test_results_are_cached_until_the_rows_change(self):
+        self.assertEqual(len(self.results('authors', 't')), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.results('authors', 't')), 1)
+        Author.objects.create(first_name='Mark', last_name='Twain')
+        self.assertEqual(len(self.results('authors', 't')), 2)
+
+    def test_prefix_query_uses_index(self):
+        plan = Author.objects.filter(autocomplete.prefix_q('tol')).order_by('search_key').explain()
+        self.assertIn('catalog_author_search_key_idx', plan)
+
+    def test_book_form_renders_only_selected_choices(self):
+        self.client.force_login(self.admin_user)
+        response = self.client.get(reverse('book_update', args=[self.book.pk]))
+        self.assertContains(response, 'data-autocomplete-url="%s"' % reverse('autocomplete', args=['authors']))
+        self.assertContains(response, 'js/autocomplete.js')
+        self.assertContains(response, 'Tolstoy, Leo')
+        self.assertNotContains(response, 'Brontë, Charlotte')
+
+        def create_form_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(reverse('book_create')).status_code, 200)
+            return len(queries)
+
+        before = create_form_queries()
+        Author.objects.bulk_create(Author(first_name='A', last_name='Author %s' % i) for i in range(20))
+        self.assertEqual(create_form_queries(), before)
+
+    def test_book_form_saves(self):
+        self.client.force_login(self.admin_user)
+        response = self.client.post(reverse('book_update', args=[self.book.pk]), {
+            'title': 'War & Peace', 'author': self.tolstoy.pk, 'summary': 'Summary',
+            'isbn': '9780199232765', 'genre': [self.genre.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).search_key, 'war peace')
+
+    def test_book_form_rejects_malformed_choices(self):
+        self.client.force_login(self.admin_user)
+        response = self.client.post(reverse('book_create'), {
+            'title': 'Anna Karenina', 'author': 'abc', 'summary': 'Summary', 'isbn': '9780143035008',
+            'genre': ['x', self.genre.pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['author'])
+        self.assertContains(response, '<option value="%s" selected>History</option>' % self.genre.pk, html=True)
+        self.assertFalse(Book.objects.filter(title='Anna Karenina').exists())
+
+    def test_admin_search(self):
+        self.client.force_login(self.admin_user)
+        # The changelists keep the search_fields search, any word of a field
+        for url, q, expected in [
+            (reverse('admin:catalog_author_changelist'), 'Charlotte', [self.bronte]),
+            (reverse('admin:catalog_author_changelist'), 'Brontë', [self.bronte]),
+            (reverse('admin:catalog_book_changelist'), 'Peace', [self.book]),
+            (reverse('admin:catalog_book_changelist'), '9780199232765', [self.book]),
+        ]:
+            with self.subTest(url=url, q=q):
+                response = self.client.get(url, {'q': q})
+                self.assertEqual(list(response.context['cl'].result_list), expected)
+        # The autocomplete endpoint matches indexed prefixes
+        for term, expected in [('tol', ['Tolstoy, Leo']), ('bronte', ['Brontë, Charlotte']), ('leo', [])]:
+            with self.subTest(term=term):
+                response = self.client.get(reverse('admin:autocomplete'), {
+                    'term': term, 'app_label': 'catalog', 'model_name': 'book', 'field_name': 'author',
+                })
+                self.assertEqual([result['text'] for result in response.json()['results']], expected)
+
+
+class DatabaseProfileTest(TestCase):
+    def test_development_keeps_django_defaults(self):
+        config = database_settings('/srv', {})
+        self.assertEqual(config['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(config['NAME'], os.path.join('/srv', 'db.sqlite3'))
+        self.assertEqual(config['CONN_MAX_AGE'], 0)
+        self.assertEqual(config['OPTIONS'], {})
+
+    def test_sqlite_production(self):
+        config = database_settings('/srv', {'DATABASE_PROFILE': 'production', 'SQLITE_MMAP_SIZE': '0'})
+        self.assertEqual(config['CONN_MAX_AGE'], 600)
+        self.assertEqual(config['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertEqual(config['OPTIONS']['timeout'], 20.0)
+        init_command = config['OPTIONS']['init_command']
+        self.assertIn('PRAGMA journal_mode=WAL', init_command)
+        self.assertIn('PRAGMA synchronous=NORMAL', init_command)
+        self.assertIn('PRAGMA cache_size=-65536', init_command)
+        self.assertNotIn('mmap_size', init_command)
+
+    def test_postgresql(self):
+        config = database_settings('/srv', {
+            'DATABASE_ENGINE': 'postgresql', 'DATABASE_PROFILE': 'production', 'DATABASE_NAME': 'library',
+            'DATABASE_HOST': 'db', 'DATABASE_SERVER_SIDE_CURSORS': '0',
+        })
+        self.assertEqual(config['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((config['NAME'], config['HOST']), ('library', 'db'))
+        self.assertEqual(config['CONN_MAX_AGE'], 600)
+        self.assertTrue(config['CONN_HEALTH_CHECKS'])
+        self.assertTrue(config['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertEqual(config['OPTIONS'], {'connect_timeout': 5})
+        self.assertFalse(database_settings('/srv', {'DATABASE_ENGINE': 'postgresql'})['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_rejects_unknown_values(self):
+        with self.assertRaises(ValueError):
+            database_settings('/srv', {'DATABASE_ENGINE': 'oracle'})
+        with self.assertRaises(ValueError):
+            database_settings('/srv', {'DATABASE_PROFILE': 'fast'})
+
+
+class ContentionBenchmarkTest(TransactionTestCase):
+    def test_reads_while_renewing(self):
+        benchmarks.seed(20, loan_ratio=0.5)
+        result = benchmarks.run_contention(duration=0.5, readers=2, batch_size=5)
+        self.assertEqual(result['profile']['vendor'], connection.vendor)
+        self.assertGreater(result['reads'] + result['read_errors'], 0)
+        self.assertGreater(result['renewal_batches'] + result['write_errors'], 0)
+
+
+class ReservationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.readers = [User.objects.create_user(username='reader%d' % i, password='12345') for i in range(3)]
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.book = Book.objects.create(title='War and Peace', author=author, summary='Summary', isbn='9780199232765')
+        cls.loans = [
+            BookInstance.objects.create(
+                book=cls.book, imprint='Penguin', status='o', borrower=cls.readers[0],
+                due_back=datetime.date.today() + datetime.timedelta(days=3),
+            )
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def assertReservedFor(self, copy, user):
+        copy = BookInstance.objects.get(pk=copy.pk)
+        self.assertEqual((copy.status, copy.borrower), ('r', user))
+        hold = Hold.objects.ready().get(copy=copy)
+        self.assertEqual((hold.status, hold.user), ('r', user))
+
+    def test_returns_serve_the_queue_by_priority_then_arrival(self):
+        first = reservations.place_hold(self.readers[1], self.book)
+        second = reservations.place_hold(self.readers[2], self.book)
+        urgent = reservations.place_hold(self.readers[0], self.book, priority=1)
+        self.assertEqual(first.status, 'w')
+        circulation.return_copies([self.loans[0].pk])
+        self.assertReservedFor(self.loans[0], self.readers[0])
+        circulation.return_copies([self.loans[1].pk])
+        self.assertReservedFor(self.loans[1], self.readers[1])
+        self.assertEqual(Hold.objects.get(pk=second.pk).status, 'w')
+        self.assertEqual(Hold.objects.get(pk=urgent.pk).expires_at.date(), BookInstance.objects.get(pk=self.loans[0].pk).due_back)
+
+        book = Book.objects.get(pk=self.book.pk)
+        self.assertEqual((book.copies_total, book.copies_available, book.copies_on_loan), (2, 0, 0))
+        self.assertEqual(get_counters(), compute_counters())
+
+    def test_hold_is_ready_at_once_when_a_copy_is_on_the_shelf(self):
+        circulation.return_copies([self.loans[0].pk])
+        hold = reservations.place_hold(self.readers[1], self.book)
+        self.assertEqual((hold.status, hold.copy_id), ('r', self.loans[0].pk))
+        with self.assertRaisesMessage(reservations.HoldError, 'already have a hold'):
+            reservations.place_hold(self.readers[1], self.book)
+
+    def test_checkout_fulfils_the_hold(self):
+        reservations.place_hold(self.readers[1], self.book)
+        circulation.return_copies([self.loans[0].pk])
+        outcomes = circulation.checkout([self.loans[0].pk], self.readers[2])
+        self.assertEqual(outcomes[0]['error'], 'Copy is reserved for another borrower')
+        outcomes = circulation.checkout([self.loans[0].pk], self.readers[1])
+        self.assertTrue(outcomes[0]['ok'])
+        self.assertEqual(Hold.objects.get(user=self.readers[1]).status, 'f')
+        # A new hold can be placed once the last one is fulfilled
+        self.assertEqual(reservations.place_hold(self.readers[1], self.book).status, 'w')
+
+    def test_cancelled_and_expired_holds_pass_the_copy_on(self):
+        ready = reservations.place_hold(self.readers[1], self.book)
+        waiting = reservations.place_hold(self.readers[2], self.book)
+        circulation.return_copies([self.loans[0].pk])
+        reservations.cancel_hold(ready)
+        self.assertEqual(Hold.objects.get(pk=ready.pk).status, 'c')
+        self.assertReservedFor(self.loans[0], self.readers[2])
+        with self.assertRaises(reservations.HoldError):
+            reservations.cancel_hold(ready)
+
+        expired = reservations.expire_holds(now=timezone.now() + reservations.PICKUP_PERIOD + datetime.timedelta(days=1))
+        self.assertEqual(expired, 1)
+        self.assertEqual(Hold.objects.get(pk=waiting.pk).status, 'x')
+        copy = BookInstance.objects.get(pk=self.loans[0].pk)
+        self.assertEqual((copy.status, copy.borrower, copy.due_back), ('a', None, None))
+        self.assertEqual(Book.objects.get(pk=self.book.pk).copies_available, 1)
+
+    def test_single_save_allocates_on_commit(self):
+        reservations.place_hold(self.readers[1], self.book)
+        copy = BookInstance.objects.get(pk=self.loans[0].pk)
+        copy.status, copy.borrower, copy.due_back = 'a', None, None
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.save()
+        self.assertReservedFor(copy, self.readers[1])
+
+    def test_allocation_reads_only_the_head_of_the_queue(self):
+        plan = Hold.objects.queue().filter(book=self.book)[:1].explain()
+        self.assertIn('catalog_hold_queue_idx', plan)
+        Hold.objects.bulk_create([Hold(book=self.book, user=User.objects.create(username='queued%d' % i)) for i in range(20)])
+        circulation.return_copies([self.loans[0].pk])
+        with CaptureQueriesContext(connection) as queries:
+            circulation.return_copies([self.loans[1].pk])
+        hold_reads = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and 'catalog_hold' in query['sql']]
+        self.assertEqual(len(hold_reads), 2)
+        self.assertIn('LIMIT 1', hold_reads[1])
+        self.assertEqual(Hold.objects.ready().count(), 2)
+
+    def test_views(self):
+        self.client.force_login(self.readers[1])
+        url = reverse('place-hold', args=[self.book.pk])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        response = self.client.post(url, follow=True)
+        self.assertContains(response, 'You are in the queue for War and Peace')
+        self.assertContains(response, '(waiting)')
+        self.assertContains(self.client.post(url, follow=True), 'You already have a hold on this book')
+        self.assertContains(self.client.get(reverse('book-detail', args=[self.book.pk])), 'Place a hold')
+
+        hold = Hold.objects.get(user=self.readers[1])
+        self.client.force_login(self.readers[2])
+        self.assertEqual(self.client.post(reverse('cancel-hold', args=[hold.pk])).status_code, 404)
+        self.client.force_login(self.readers[1])
+        self.assertContains(self.client.post(reverse('cancel-hold', args=[hold.pk]), follow=True), 'You have no holds.')
+
+    def test_command(self):
+        reservations.place_hold(self.readers[1], self.book)
+        BookInstance.objects.filter(pk=self.loans[0].pk).update(status='a', borrower=None, due_back=None)
+        out = StringIO()
+        call_command('allocate_holds', stdout=out)
+        self.assertIn('0 holds expired, 1 holds ready', out.getvalue())
+
+
+class HoldBenchmarkTest(TransactionTestCase):
+    def test_parallel_returns(self):
+        benchmarks.seed(20, loan_ratio=0.5)
+        result = benchmarks.run_holds(holds=40, workers=2, batch_size=3)
+        self.assertTrue(result['consistent'])
+        self.assertGreater(result['allocated'], 0)
+        self.assertEqual(result['allocated'], Hold.objects.ready().count())
+
+
+class LoanHistoryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', password='12345')
+        cls.librarian = User.objects.create_user(username='librarian', password='12345')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.book = Book.objects.create(title='War and Peace', author=author, summary='Summary', isbn='9780199232765')
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Penguin', status='a')
+
+    def test_circulation_appends_events(self):
+        today = datetime.date.today()
+        circulation.checkout([self.copy.pk], self.reader, today + datetime.timedelta(weeks=1))
+        circulation.renew([(self.copy.pk, today + datetime.timedelta(weeks=2))])
+        circulation.return_copies([self.copy.pk])
+        circulation.return_copies([self.copy.pk])
+        events = list(LoanEvent.objects.for_borrower(self.reader))
+        self.assertEqual(
+            [(event.kind, event.due_back) for event in events],
+            [(LoanEvent.RETURN, None), (LoanEvent.RENEWAL, today + datetime.timedelta(weeks=2)),
+             (LoanEvent.CHECKOUT, today + datetime.timedelta(weeks=1))],
+        )
+        self.assertEqual({(event.book_id, event.copy_id, event.day) for event in events}, {(self.book.pk, self.copy.pk, today)})
+        self.assertEqual(list(LoanEvent.objects.for_book(self.book)), events)
+        with self.assertRaisesMessage(ValueError, 'append-only'):
+            events[0].save()
+
+    def test_renewal_view_appends_an_event(self):
+        circulation.checkout([self.copy.pk], self.reader)
+        self.client.force_login(self.librarian)
+        renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
+        response = self.client.post(reverse('renew-book-librarian', args=[self.copy.pk]), {'renewal_date': renewal_date})
+        self.assertRedirects(response, reverse('all-borrowed'))
+        event = LoanEvent.objects.for_copy(self.copy).first()
+        self.assertEqual((event.kind, event.borrower, event.due_back), (LoanEvent.RENEWAL, self.reader, renewal_date))
+
+    def test_history_reads_use_their_index(self):
+        for queryset, index in (
+            (LoanEvent.objects.for_borrower(self.reader), 'catalog_loanevent_user_idx'),
+            (LoanEvent.objects.for_book(self.book), 'catalog_loanevent_book_idx'),
+            (LoanEvent.objects.for_copy(self.copy), 'catalog_loanevent_copy_idx'),
+        ):
+            plan = queryset[:20].explain()
+            self.assertIn(index, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_views_and_deleted_rows(self):
+        circulation.checkout([self.copy.pk], self.reader)
+        circulation.return_copies([self.copy.pk])
+        BookInstance.objects.get(pk=self.copy.pk).delete()
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('my-history'))
+        self.assertContains(response, 'War and Peace', count=2)
+        self.assertContains(response, 'Checkout')
+        self.assertEqual(self.client.get(reverse('book-history', args=[self.book.pk])).status_code, 403)
+        self.client.force_login(self.librarian)
+        self.assertContains(self.client.get(reverse('book-history', args=[self.book.pk])), 'reader', count=2)
+        self.assertEqual(LoanEvent.objects.for_book(self.book).count(), 2)
+
+    def test_history_pages_by_keyset(self):
+        LoanEvent.objects.bulk_create([
+            LoanEvent(kind=LoanEvent.CHECKOUT, day=datetime.date.today(), copy=self.copy, book=self.book, borrower=self.reader)
+            for i in range(45)
+        ])
+        expected = list(LoanEvent.objects.for_borrower(self.reader).values_list('pk', flat=True))
+        self.client.force_login(self.reader)
+        seen = []
+        url = reverse('my-history')
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql']])
+            self.assertFalse([query for query in queries.captured_queries if 'OFFSET' in query['sql']])
+            seen += [event.pk for event in response.context['loanevent_list']]
+            if not response.context['page_obj'].has_next():
+                break
+            url = reverse('my-history') + '?cursor=' + quote(response.context['page_obj'].next_cursor)
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(response.context['loanevent_list']), 5)
+
+        paginator = CursorPaginator(LoanEvent.objects.for_book(self.book), ('-id',), 20)
+        # The second page: an id range of the book's index, no sort
+        plan = paginator._queryset(paginator.page().next_cursor)[0].explain()
+        self.assertIn('catalog_loanevent_book_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_archive_command(self):
+        today = datetime.date.today()
+        old = history.month_start(today, -14)
+        LoanEvent.objects.bulk_create(
+            [LoanEvent(kind=LoanEvent.CHECKOUT, day=old + datetime.timedelta(days=i), copy=self.copy, book=self.book,
+                       borrower=self.reader, due_back=today) for i in range(5)]
+            + [LoanEvent(kind=LoanEvent.RETURN, day=history.month_start(today, -13), copy=self.copy, book=self.book)]
+            + [LoanEvent(kind=LoanEvent.RETURN, day=today, copy=self.copy, book=self.book, borrower=self.reader)]
+        )
+        expected = list(LoanEvent.objects.filter(day__lt=history.month_start(today, -12)).order_by('id').values(*history.FIELDS))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        rollups.refresh()
+        out = StringIO()
+        call_command('archive_loan_events', directory=directory, batch_size=2, stdout=out)
+        self.assertIn('%s: 5 events moved' % old.strftime('%Y-%m'), out.getvalue())
+        self.assertEqual(sorted(os.listdir(directory)), [
+            history.archive_name(old), history.archive_name(history.month_start(today, -13)),
+        ])
+        self.assertEqual(list(LoanEvent.objects.values_list('day', flat=True)), [today])
+        archived = [row for name in sorted(os.listdir(directory)) for row in history.read_archive(os.path.join(directory, name))]
+        self.assertEqual(archived, expected)
+
+
+class RollupTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', password='12345')
+        cls.staff = User.objects.create_user(username='staff', password='12345', is_staff=True)
+        cls.author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.genre = Genre.objects.create(name='Novel')
+        cls.book = Book.objects.create(title='War and Peace', author=cls.author, summary='Summary', isbn='9780199232765')
+        cls.book.genre.add(cls.genre)
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Penguin', status='a')
+        cls.other = BookInstance.objects.create(book=cls.book, imprint='Penguin', status='a')
+
+    def loan(self, copy, start, days):
+        LoanEvent.objects.bulk_create([
+            LoanEvent(kind=LoanEvent.CHECKOUT, day=start, copy=copy, book=self.book, borrower=self.reader),
+            LoanEvent(kind=LoanEvent.RENEWAL, day=start, copy=copy, book=self.book, borrower=self.reader),
+            LoanEvent(kind=LoanEvent.RETURN, day=start + datetime.timedelta(days=days), copy=copy, book=self.book,
+                      borrower=self.reader),
+        ])
+
+    def counts(self, dimension, period, start, key):
+        return CirculationRollup.objects.values_list('checkouts', 'returns', 'loan_days').get(
+            dimension=dimension, period=period, start=start, key=key,
+        )
+
+    def test_refresh_counts_loans_once(self):
+        month = datetime.date(2024, 3, 1)
+        self.loan(self.copy, month, 10)
+        self.loan(self.other, month + datetime.timedelta(days=2), 4)
+        self.assertEqual(rollups.refresh(batch_size=2), 6)
+        self.assertEqual(rollups.watermark(), LoanEvent.objects.latest('id').pk)
+        self.assertEqual(self.counts('l', 'm', month, 0), (2, 2, 14))
+        self.assertEqual(self.counts('b', 'm', month, self.book.pk), (2, 2, 14))
+        self.assertEqual(self.counts('a', 'm', month, self.author.pk), (2, 2, 14))
+        self.assertEqual(self.counts('g', 'm', month, self.genre.pk), (2, 2, 14))
+        self.assertEqual(self.counts('l', 'd', month, 0), (1, 0, 0))
+        self.assertEqual(self.counts('l', 'd', month + datetime.timedelta(days=6), 0), (0, 1, 4))
+        self.assertEqual(CirculationRollup.objects.get(dimension='a', period='m', key=self.author.pk).label, 'Tolstoy, Leo')
+
+        # Only the events appended since are read again
+        self.assertEqual(rollups.refresh(), 0)
+        self.loan(self.copy, month + datetime.timedelta(days=20), 3)
+        self.assertEqual(rollups.refresh(), 3)
+        self.assertEqual(self.counts('l', 'm', month, 0), (3, 3, 17))
+
+        CirculationRollup.objects.update(checkouts=0)
+        out = StringIO()
+        call_command('refresh_rollups', rebuild=True, stdout=out)
+        self.assertIn('9 events counted', out.getvalue())
+        self.assertEqual(self.counts('l', 'm', month, 0), (3, 3, 17))
+
+    def test_refresh_stops_at_the_horizon(self):
+        month = datetime.date(2024, 3, 1)
+        self.loan(self.copy, month, 10)
+        settled = LoanEvent.objects.latest('id').pk
+        self.assertEqual(rollups.horizon(), settled)
+        self.loan(self.other, month, 4)
+        # Events past the horizon may sit behind one still being committed
+        with mock.patch.object(rollups, 'horizon', return_value=settled):
+            self.assertEqual(rollups.refresh(), 3)
+        self.assertEqual(rollups.watermark(), settled)
+        self.assertEqual(rollups.refresh(), 3)
+        self.assertEqual(self.counts('l', 'm', month, 0), (2, 2, 14))
+
+    def test_authors_by_average_loan_length(self):
+        month = history.month_start(datetime.date.today())
+        brief = Author.objects.create(first_name='Anton', last_name='Chekhov')
+        story = Book.objects.create(title='The Lady with the Dog', author=brief, summary='Summary', isbn='9780140447873')
+        self.loan(self.copy, month, 20)
+        for copy in [self.copy, self.other]:
+            LoanEvent.objects.bulk_create([
+                LoanEvent(kind=LoanEvent.CHECKOUT, day=month, copy=copy, book=story),
+                LoanEvent(kind=LoanEvent.RETURN, day=month + datetime.timedelta(days=2), copy=copy, book=story),
+            ])
+        rollups.refresh()
+        authors = rollups.dashboard(month)['authors']
+        self.assertEqual([(row.label, row.average_loan_days) for row in authors], [('Tolstoy, Leo', 20), ('Chekhov, Anton', 2)])
+
+    def test_circulation_is_counted(self):
+        circulation.checkout([self.copy.pk], self.reader)
+        circulation.return_copies([self.copy.pk])
+        rollups.refresh()
+        self.assertEqual(self.counts('b', 'd', datetime.date.today(), self.book.pk), (1, 1, 0))
+
+    def test_dashboard_reads_only_rollups(self):
+        month = history.month_start(datetime.date.today())
+        self.loan(self.copy, month, 10)
+        rollups.refresh()
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('circulation-dashboard'))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.staff)
+        self.client.get(reverse('circulation-dashboard'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('circulation-dashboard'))
+        self.assertContains(response, 'War and Peace')
+        self.assertContains(response, 'Tolstoy, Leo')
+        self.assertContains(response, 'Novel')
+        self.assertEqual(response.context['total'].average_loan_days, 10)
+        # Besides the session, user and permission reads of every page
+        tables = {
+            table for query in queries.captured_queries
+            for table in re.findall(r'FROM "(catalog_\w+)"', query['sql'])
+        }
+        self.assertEqual(tables, {'catalog_circulationrollup', 'catalog_rollupwatermark'})
+
+        response = self.client.get(reverse('circulation-dashboard') + '?month=2024-02')
+        self.assertEqual(response.context['month'], datetime.date(2024, 2, 1))
+        self.assertContains(response, 'No checkouts this month.')
+        for value in ['2024-13', '0000-05', '0001-06', '9999-12']:
+            with self.subTest(month=value):
+                self.assertEqual(self.client.get(reverse('circulation-dashboard') + '?month=' + value).context['month'], month)
+        self.assertEqual(self.client.get(reverse('circulation-dashboard') + '?month=0002-01').status_code, 200)
+        self.assertEqual(self.client.get(reverse('circulation-dashboard') + '?month=9998-12').status_code, 200)
+
+    def test_archive_waits_for_refresh(self):
+        self.loan(self.copy, history.month_start(datetime.date.today(), -14), 3)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with self.assertRaisesMessage(CommandError, 'refresh_rollups'):
+            call_command('archive_loan_events', directory=directory, stdout=StringIO())
+        self.assertEqual(LoanEvent.objects.count(), 3)
+        rollups.refresh()
+        call_command('archive_loan_events', directory=directory, stdout=StringIO())
+        self.assertEqual(LoanEvent.objects.count(), 0)
+
+
+class StaticPipelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cls.static_root.cleanup)
+        cls.enterClassContext(override_settings(
+            STATIC_ROOT=cls.static_root.name,
+            STORAGES={**settings.STORAGES, 'staticfiles': {'BACKEND': 'catalog.assets.CatalogStaticFilesStorage'}},
+        ))
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def read(self, name):
+        with open(os.path.join(self.static_root.name, name), 'rb') as f:
+            return f.read()
+
+    def test_minify(self):
+        css = '/*! licence */\n/* note */\na  >  b ,  c {\n  content: "x  y";\n  color: red;\n}\n'
+        self.assertEqual(assets.minify_css(css), '/*! licence */\na>b,c{content:"x  y";color:red}\n')
+        self.assertEqual(assets.minify_js('  // note\n  var a = 1;\n\n  f(a);\n'), 'var a = 1;\nf(a);\n')
+
+    def test_assets_are_hashed_minified_and_precompressed(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        hashed = staticfiles_storage.stored_name('css/styles.css')
+        self.assertRegex(hashed, r'^css/styles\.[0-9a-f]{12}\.css$')
+        content = self.read(hashed)
+        self.assertNotIn(b'/*', content)
+        self.assertLess(len(content), len(self.read('css/styles.css')))
+        self.assertEqual(gzip.decompress(self.read(hashed + '.gz')), content)
+        # Third-party builds are hashed as they are
+        admin_js = staticfiles_storage.stored_name('admin/js/core.js')
+        self.assertEqual(self.read(admin_js), self.read('admin/js/core.js'))
+
+    def test_pages_use_local_hashed_assets(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, staticfiles_storage.url('css/vendor/bootstrap-3.3.7-subset.css'))
+        self.assertContains(response, staticfiles_storage.url('image/figure_photo.jpg'))
+        self.assertNotRegex(response.content.decode(), r'(src|href)="(https?:)?//')
+
+    def test_serve_static(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        hashed = staticfiles_storage.stored_name('js/autocomplete.js')
+        request = self.factory.get('/static/' + hashed, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        response = assets.serve_static(request, hashed)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/javascript')
+        self.assertEqual(response['Cache-Control'], assets.IMMUTABLE)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.read(hashed))
+        request = self.factory.get('/static/' + hashed, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(assets.serve_static(request, hashed).status_code, 304)
+
+        response = assets.serve_static(self.factory.get('/static/js/autocomplete.js'), 'js/autocomplete.js')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Cache-Control'], assets.SHORT_CACHE)
+        response.close()
+
+        for path in ['../db.sqlite3', 'missing.css']:
+            with self.subTest(path=path), self.assertRaises(Http404):
+                assets.serve_static(self.factory.get('/static/' + path), path)
+
+    def test_vendored_css_covers_template_classes(self):
+        css = ''.join(self.read(name).decode() for name in ['css/vendor/bootstrap-3.3.7-subset.css', 'css/styles.css'])
+        styled = set(re.findall(r'\.([a-zA-Z][\w-]*)', css))
+        # Markers for tests and scripts, unstyled on purpose
+        unstyled = {'page-links', 'page-current'}
+        used = set()
+        for directory in [os.path.join(settings.BASE_DIR, 'catalog', 'templates'), os.path.join(settings.BASE_DIR, 'templates')]:
+            for root, dirs, files in os.walk(directory):
+                for file in files:
+                    with open(os.path.join(root, file), encoding='utf-8') as f:
+                        for value in re.findall(r'class="([^"]*)"', f.read()):
+                            used.update(re.sub(r'\{[%{].*?[%}]\}', ' ', value).split())
+        self.assertIn('pagination', used)
+        self.assertEqual(used - styled - unstyled, set())
+
+    @skipUnless(assets.Image, 'Pillow is not installed')
+    def test_image_variants(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        with assets.Image.open(os.path.join(self.static_root.name, 'image/figure_photo.jpg')) as image:
+            width = image.width
+        variants = staticfiles_storage.image_variants('image/figure_photo.jpg')
+        expected = sorted({w for w in assets.RESPONSIVE_WIDTHS if w < width} | {width})
+        self.assertEqual(set(variants), {'.jpg', '.webp'})
+        for ext, image_format in [('.jpg', 'JPEG'), ('.webp', 'WEBP')]:
+            self.assertEqual([w for w, name in variants[ext]], expected)
+            for variant_width, name in variants[ext]:
+                hashed = staticfiles_storage.stored_name(name)
+                self.assertNotEqual(hashed, name)
+                with assets.Image.open(os.path.join(self.static_root.name, hashed)) as variant:
+                    self.assertEqual((variant.format, variant.width), (image_format, variant_width))
+
+    @skipUnless(assets.brotli, 'brotli is not installed')
+    def test_brotli_precompression(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        hashed = staticfiles_storage.stored_name('css/styles.css')
+        self.assertEqual(assets.brotli.decompress(self.read(hashed + '.br')), self.read(hashed))
+        request = self.factory.get('/static/' + hashed, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        response = assets.serve_static(request, hashed)
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(assets.brotli.decompress(b''.join(response.streaming_content)), self.read(hashed))
+
+    def test_responsive_image(self):
+        from django.contrib.staticfiles.storage import staticfiles_storage
+        html = Template('{% load catalog_assets %}{% responsive_image "image/figure_photo.jpg" "Photo" %}').render(Context())
+        if assets.Image is None:
+            self.assertEqual(html, '<img src="%s" alt="Photo" />' % staticfiles_storage.url('image/figure_photo.jpg'))
+        else:
+            variants = staticfiles_storage.image_variants('image/figure_photo.jpg')
+            self.assertIn('.webp', variants)
+            self.assertIn('<source type="image/webp"', html)
+            self.assertIn(' %dw' % variants['.jpg'][0][0], html)
+
+
+def template_settings(**options):
+    templates = [{**settings.TEMPLATES[0], 'OPTIONS': {**settings.TEMPLATES[0]['OPTIONS'], **options}}]
+    if 'loaders' in options:
+        templates[0]['APP_DIRS'] = False
+    return templates
+
+
+class TemplateProfileTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Leo', last_name='Tolstoy')
+        cls.book = Book.objects.create(title='War and Peace', author=author, summary='Summary', isbn='9780199232765')
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.template_profiler.clear()
+
+    def test_template_dirs_do_not_depend_on_working_directory(self):
+        for directory in settings.TEMPLATES[0]['DIRS']:
+            self.assertTrue(os.path.isabs(directory))
+
+    @override_settings(TEMPLATES=template_settings(debug=False, loaders=[
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]))
+    def test_warm_templates_fills_the_cached_loader(self):
+        compiled, errors, elapsed = templating.warm_templates()
+        self.assertEqual(errors, [])
+        self.assertIn('base_generic.html', compiled)
+        self.assertIn('catalog/book_detail.html', compiled)
+        self.assertNotIn('admin/base.html', compiled)
+        from django.template import engines
+        loader = engines['instrumentation'].engine.template_loaders[0]
+        self.assertGreaterEqual(len(loader.get_template_cache), len(compiled))
+
+        out = StringIO()
+        call_command('warm_templates', stdout=out)
+        self.assertIn('Compiled %d templates' % len(compiled), out.getvalue())
+
+    def test_warm_templates_reports_syntax_errors(self):
+        with tempfile.TemporaryDirectory(dir=settings.BASE_DIR) as directory:
+            with open(os.path.join(directory, 'broken.html'), 'w') as f:
+                f.write('{% if %}')
+            with override_settings(TEMPLATES=[{**template_settings()[0], 'DIRS': [directory]}]):
+                compiled, errors, elapsed = templating.warm_templates()
+                self.assertEqual([name for name, error in errors], ['broken.html'])
+                with self.assertRaises(CommandError):
+                    call_command('warm_templates', stdout=StringIO(), stderr=StringIO())
+                with self.assertRaises(ImproperlyConfigured), self.assertLogs('catalog.templating', 'ERROR') as logs:
+                    templating.warm_templates_on_startup()
+                self.assertIn('broken.html', logs.output[0])
+
+    @override_settings(TEMPLATES=template_settings(profile=True))
+    def test_block_profiler(self):
+        self.assertEqual(self.client.get(reverse('book-detail', args=[self.book.pk])).status_code, 200)
+        rows = {(row['template'], row['block']): row for row in instrumentation.template_profiler.report()}
+        page = rows[('catalog/book_detail.html', None)]
+        content = rows[('catalog/book_detail.html', 'content')]
+        self.assertEqual(page['calls'], 1)
+        self.assertEqual(page['share'], 1)
+        self.assertIn(('catalog/book_detail.html', 'sidebar'), rows)
+        self.assertLessEqual(content['total_ms'], page['total_ms'])
+
+    def test_profile_templates_command(self):
+        out = StringIO()
+        call_command('profile_templates', iterations=2, only=['book-detail'], host='testserver', json=True, stdout=out)
+        rows = json.loads(out.getvalue())
+        self.assertEqual({row['template'] for row in rows}, {'catalog/book_detail.html'})
+        self.assertEqual({row['calls'] for row in rows}, {2})
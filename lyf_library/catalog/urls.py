@@ -10,12 +10,27 @@ urlpatterns = [
     # path('anotherurl/', views.my_reused_view, {'my_template_name': 'another_path'}, name='anotherurl'),
     path('authors/', views.AuthorListView.as_view(), name='authors'),
     path('author/<int:pk>', views.AuthorDetailView.as_view(), name='author-detail'),
+    path('search/', views.search, name='search'),
+    path('export.csv', views.export_catalog, {'format': 'csv'}, name='export-csv'),
+    path('export.jsonl', views.export_catalog, {'format': 'jsonl'}, name='export-jsonl'),
+    path('api/<slug:resource>/', views.api_list, name='api-list'),
+    path('api/<slug:resource>/<str:pk>', views.api_detail, name='api-detail'),
+    path('autocomplete/<slug:kind>/', views.autocomplete, name='autocomplete'),
+    path('_metrics', views.metrics, name='metrics'),
 ]
 
 urlpatterns += [
     path('mybooks/', views.LoanedBooksByUserListView.as_view(), name='my-borrowed'),
+    path('mybooks/history/', views.LoanHistoryView.as_view(), name='my-history'),
+    path('book/<int:pk>/history/', views.BookLoanHistoryView.as_view(), name='book-history'),
     path('borrowed/', views.BorrowedBooksListView.as_view(), name='all-borrowed'),
+    path('book/<int:pk>/hold/', views.place_hold, name='place-hold'),
+    path('hold/<int:pk>/cancel/', views.cancel_hold, name='cancel-hold'),
     path('book/<uuid:pk>/renew/', views.renew_book_librarian, name='renew-book-librarian'),
+    path('circulation/dashboard/', views.circulation_dashboard, name='circulation-dashboard'),
+    path('circulation/checkout/', views.bulk_circulation, {'action': 'checkout'}, name='bulk-checkout'),
+    path('circulation/return/', views.bulk_circulation, {'action': 'return'}, name='bulk-return'),
+    path('circulation/renew/', views.bulk_circulation, {'action': 'renew'}, name='bulk-renew'),
 ]
 
 urlpatterns += [
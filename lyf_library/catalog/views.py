@@ -2,37 +2,182 @@ from django.shortcuts import render
 from django.views import generic
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 # Create your views here.
-from .models import Book, Author, BookInstance, Genre
-from django.contrib.auth.decorators import permission_required
-
-from django.shortcuts import get_object_or_404
-from django.http import HttpResponseRedirect, HttpResponseForbidden
+from .models import Book, Author, BookInstance, Genre, Hold, LoanEvent
+from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib import messages
+from django.contrib.auth.models import User
+
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseRedirect, HttpResponseForbidden, StreamingHttpResponse, JsonResponse
+from django.views.decorators.http import require_POST, require_safe
+from django.utils.cache import patch_vary_headers
 from django.urls import reverse, reverse_lazy
 import datetime
+import re
 from django.utils.translation import gettext_lazy as _
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .forms import BookForm, BulkCirculationForm, RenewBookForm
+from . import circulation, history, reservations, rollups
+from .counters import aget_counters
+from .visits import get_visit_counter
+from .instrumentation import metrics_summary
+from django.contrib.admin.views.decorators import staff_member_required
+from .pagination import CursorPaginationMixin
+from .caching import CachedPageMixin
+from .conditional import ConditionalGetMixin, latest
+from .search import search_books
+from .exporting import FORMATS, export_lines, gzip_stream
+from .api import RESOURCES, ApiError
+from .autocomplete import SOURCES as AUTOCOMPLETE_SOURCES, complete
+
+async def arender(request, template_name, context):
+    """
+    Render a template from an async view. The sidebar reads the user and their
+    permissions, which can query the database, so this runs in a thread.
+    """
+    return await sync_to_async(render)(request, template_name, context)
+
+class AsyncListMixin:
+    """
+    Async get() for a ListView: the page is fetched with the async ORM (see
+    CursorPaginationMixin.apaginate_queryset) and rendered with arender().
+    """
+    async def get(self, request, *args, **kwargs):
+        self.object_list = self.get_queryset()
+        await self.apaginate_queryset(self.object_list, self.get_paginate_by(self.object_list))
+        return await arender(request, self.get_template_names(), self.get_context_data())
 
-from .forms import RenewBookForm
-def index(request):
+class AsyncDetailMixin:
+    """
+    Async get() for a DetailView, fetching the object with the async ORM.
+    """
+    async def get(self, request, *args, **kwargs):
+        self.object = await aget_object_or_404(self.get_queryset(), pk=self.kwargs[self.pk_url_kwarg])
+        return await arender(request, self.get_template_names(), self.get_context_data(object=self.object))
+
+async def index(request):
     """
     View function for home page of site.
     """
-    # Generate counts of some of the main objects
-    num_books=Book.objects.all().count()
-    num_instances=BookInstance.objects.all().count()
-    # Available books (status = 'a')
-    num_instances_available=BookInstance.objects.filter(status__exact='a').count()
-    num_authors=Author.objects.count()  # The 'all()' is implied by default.
+    # Counts of the main objects, read from the cache (see catalog.counters)
+    counters = await aget_counters()
 
-    # Number of visits to this view, as counted in the session variable.
-    num_visits = request.session.get('num_visits', 0)
-    request.session['num_visits'] = num_visits + 1
+    # Number of visits to this view, counted without writing the session (see catalog.visits)
+    visit_counter = get_visit_counter()
+    num_visits = await visit_counter.arecord(request)
     # Render the HTML template index.html with the data in the context variable
-    return render(
+    response = await arender(
         request,
         'index.html',
-        context={'num_books':num_books,'num_instances':num_instances,'num_instances_available':num_instances_available,'num_authors':num_authors,
+        context={**counters,
             'num_visits':num_visits}, # num_visits appended
     )
+    visit_counter.save(request, response)
+    return response
+
+# Deeper search pages are not served (their offset would be unbounded)
+SEARCH_MAX_PAGE = 1000
+
+async def search(request):
+    """
+    View function for full-text catalog search, ranked best match first.
+    """
+    query = request.GET.get('q', '')
+    try:
+        page_number = min(max(int(request.GET.get('page', 1)), 1), SEARCH_MAX_PAGE)
+    except ValueError:
+        page_number = 1
+    per_page = 10
+
+    # Ask for one extra result to know whether there is a next page
+    # (the FTS5 backend uses a raw cursor, which has no async version)
+    book_ids = await sync_to_async(search_books)(query, offset=(page_number - 1) * per_page, limit=per_page + 1)
+    books = await Book.objects.select_related('author').ain_bulk(book_ids[:per_page])
+    book_list = [books[pk] for pk in book_ids[:per_page] if pk in books]
+
+    return await arender(
+        request,
+        'catalog/search.html',
+        context={'query': query, 'book_list': book_list, 'page_number': page_number,
+            'has_previous': page_number > 1, 'has_next': len(book_ids) > per_page},
+    )
+
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def export_catalog(request, format):
+    """
+    View function streaming the whole catalog as CSV or JSON lines, gzipped on
+    the fly when the client accepts it. Each request reads every book, so
+    only librarians (can_mark_returned permission) may download it.
+    """
+    lines = export_lines(format)
+    if re.search(r'\bgzip\b', request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = StreamingHttpResponse(gzip_stream(lines), content_type=FORMATS[format])
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(lines, content_type=FORMATS[format])
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Disposition'] = 'attachment; filename="catalog.%s"' % format
+    return response
+
+@require_safe
+async def api_list(request, resource):
+    """
+    JSON API: one cursor page of a resource, optionally restricted to ``ids``
+    and to the columns listed in ``fields``.
+    """
+    resource = RESOURCES.get(resource)
+    if resource is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    try:
+        objects, next_cursor, previous_cursor = await resource.alist(request.GET)
+    except ApiError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    def page_url(cursor):
+        if cursor is None:
+            return None
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        return '%s?%s' % (request.path, params.urlencode())
+
+    return JsonResponse({'results': objects, 'next': page_url(next_cursor), 'previous': page_url(previous_cursor)})
+
+@require_safe
+async def api_detail(request, resource, pk):
+    """
+    JSON API: a single object of a resource.
+    """
+    resource = RESOURCES.get(resource)
+    try:
+        obj = await resource.aget(pk, request.GET) if resource is not None else None
+    except ApiError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if obj is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    return JsonResponse(obj)
+
+@require_safe
+def autocomplete(request, kind):
+    """
+    View function returning the authors, books or genres starting with ``q``
+    as JSON, for the autocomplete widgets.
+    """
+    if kind not in AUTOCOMPLETE_SOURCES:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    query = request.GET.get('q', '')
+    results = complete(kind, query) if query.strip() else []
+    return JsonResponse({'results': [{'id': pk, 'text': text} for pk, text in results]})
+
+@staff_member_required
+def metrics(request):
+    """
+    View function reporting per-view timing, query and size percentiles
+    recorded by the instrumentation middleware (in this process).
+    """
+    return JsonResponse({'views': metrics_summary()})
 
 '''
 class BookListView(generic.ListView):
@@ -44,9 +189,27 @@ class BookListView(generic.ListView):
     def get_queryset(self):
         return Book.objects.filter(title__icontains='war')[:5]  # Get 5 books containing the title war
 '''
-class BookListView(generic.ListView):
+class BookListView(ConditionalGetMixin, CachedPageMixin, AsyncListMixin, CursorPaginationMixin, generic.ListView):
     model = Book
     paginate_by = 5 # 添加这行，只要你有超过5条记录，视图就会开始对它发送到模板的数据，进行分页
+    cursor_ordering = ('title', 'id')
+
+    def get_cache_tags(self):
+        return ['books']
+
+    async def aget_modification_state(self):
+        # Author renames touch their books, so the books' timestamps cover the page;
+        # the (cached) count catches deletions
+        state = await Book.objects.aaggregate(Max('updated_at'))
+        return state['updated_at__max'], (await aget_counters())['num_books']
+
+    def get_queryset(self):
+        # The template shows each book's author, so join it in the same query
+        queryset = Book.objects.select_related('author').order_by('title', 'id')
+        if self.request.GET.get('available'):
+            # Only books with a copy on the shelf (uses the stored count, no join)
+            queryset = queryset.filter(copies_available__gt=0)
+        return queryset
 
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get the context
@@ -55,9 +218,23 @@ class BookListView(generic.ListView):
         context['some_data'] = 'This is just some data'
         return context
 
-class BookDetailView(generic.DetailView):
+class BookDetailView(ConditionalGetMixin, CachedPageMixin, AsyncDetailMixin, generic.DetailView):
     model = Book
 
+    def get_cache_tags(self):
+        return ['book:%s' % self.kwargs['pk']]
+
+    async def aget_modification_state(self):
+        state = await Book.objects.filter(pk=self.kwargs['pk']).aaggregate(
+            book=Max('updated_at'), copies=Max('bookinstance__updated_at'), num_copies=Count('bookinstance'),
+        )
+        return latest(state['book'], state['copies']), state['num_copies']
+
+    def get_queryset(self):
+        # Author and genres are always rendered; the copies are only read
+        # (in one query) when their cached template fragment is stale
+        return Book.objects.select_related('author').prefetch_related('genre')
+
 
 class Http404:
     pass
@@ -77,43 +254,151 @@ def book_detail_view(request,pk):
         context={'book':book_id,}
     )
 
-class AuthorListView(generic.ListView):
+class AuthorListView(ConditionalGetMixin, CachedPageMixin, AsyncListMixin, CursorPaginationMixin, generic.ListView):
     """
     Generic class-based view for a list of authors.
     """
     model = Author
     paginate_by = 5 # 可以根据需要调整每页显示的作者数量
+    ordering = ['last_name', 'id']
+    cursor_ordering = ('last_name', 'id')
+
+    def get_cache_tags(self):
+        return ['authors']
 
+    async def aget_modification_state(self):
+        state = await Author.objects.aaggregate(Max('updated_at'))
+        return state['updated_at__max'], (await aget_counters())['num_authors']
 
-class AuthorDetailView(generic.DetailView):
+
+class AuthorDetailView(ConditionalGetMixin, CachedPageMixin, AsyncDetailMixin, generic.DetailView):
     """
     Generic class-based detail view for an author.
     """
     model = Author
     paginate_by = 5
 
-class LoanedBooksByUserListView(LoginRequiredMixin,generic.ListView):
+    def get_cache_tags(self):
+        return ['author:%s' % self.kwargs['pk']]
+
+    async def aget_modification_state(self):
+        state = await Author.objects.filter(pk=self.kwargs['pk']).aaggregate(
+            author=Max('updated_at'), books=Max('book__updated_at'), num_books=Count('book'),
+        )
+        return latest(state['author'], state['books']), state['num_books']
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Lazy: only queried (once) when the cached books fragment is stale
+        context['book_list'] = self.object.book_set.order_by('title', 'id')
+        return context
+
+class LoanedBooksByUserListView(LoginRequiredMixin,CursorPaginationMixin,generic.ListView):
     """
     Generic class-based view listing books on loan to current user.
     """
     model = BookInstance
     template_name ='catalog/bookinstance_list_borrowed_user.html'
     paginate_by = 10
+    cursor_ordering = ('due_back', 'id')
+
+    def get_queryset(self):
+        return BookInstance.objects.select_related('book').filter(borrower=self.request.user).on_loan().with_overdue().order_by('due_back')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['hold_list'] = Hold.objects.active().filter(user=self.request.user).select_related('book').order_by('created_at')
+        return context
+
+
+class LoanHistoryPaginationMixin(CursorPaginationMixin):
+    """
+    Keyset pages down the ``(..., -id)`` history indexes: no COUNT(*) or
+    OFFSET, so a page costs the same however long the history is.
+    """
+    cursor_ordering = ('-id',)
+    paginate_by = 20
+
+    def uses_cursor_pagination(self):
+        return True
+
+
+class LoanHistoryView(LoginRequiredMixin, LoanHistoryPaginationMixin, generic.ListView):
+    """
+    Generic class-based view listing the current user's loan history, newest first.
+    """
+    template_name = 'catalog/loanevent_list.html'
 
     def get_queryset(self):
-        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+        return LoanEvent.objects.for_borrower(self.request.user).select_related('book')
 
-class BorrowedBooksListView(generic.ListView, PermissionRequiredMixin):
+
+class BookLoanHistoryView(PermissionRequiredMixin, LoanHistoryPaginationMixin, generic.ListView):
+    """
+    Generic class-based view listing a book's loan history, newest first.
+    Only visible to users with can_mark_returned permission.
+    """
+    permission_required = 'catalog.can_mark_returned'
+    template_name = 'catalog/loanevent_list.html'
+
+    def get_queryset(self):
+        self.book = get_object_or_404(Book, pk=self.kwargs['pk'])
+        return LoanEvent.objects.for_book(self.book).select_related('borrower')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['book'] = self.book
+        return context
+
+
+@require_POST
+@login_required
+def place_hold(request, pk):
+    """
+    View function queueing the current user for a copy of a book.
+    """
+    book = get_object_or_404(Book, pk=pk)
+    try:
+        hold = reservations.place_hold(request.user, book)
+    except reservations.HoldError as e:
+        messages.error(request, e)
+    else:
+        if hold.status == 'r':
+            messages.success(request, 'A copy of %s is waiting for you.' % book.title)
+        else:
+            messages.success(request, 'You are in the queue for %s.' % book.title)
+    return HttpResponseRedirect(reverse('my-borrowed'))
+
+
+@require_POST
+@login_required
+def cancel_hold(request, pk):
+    """
+    View function withdrawing one of the current user's holds.
+    """
+    hold = get_object_or_404(Hold, pk=pk, user=request.user)
+    try:
+        reservations.cancel_hold(hold)
+    except reservations.HoldError as e:
+        messages.error(request, e)
+    return HttpResponseRedirect(reverse('my-borrowed'))
+
+class BorrowedBooksListView(CursorPaginationMixin, generic.ListView, PermissionRequiredMixin):
     """Generic class-based view listing all borrowed books.
     Only visible to users with can_mark_returned permission."""
     model = BookInstance
     permission_required = 'catalog.can_mark_returned'
     template_name = 'catalog/bookinstance_list_borrowed_librarian.html'
     paginate_by = 10
+    cursor_ordering = ('due_back', 'id')
 
     def get_queryset(self):
         # Filter by book instances that are not available
-        return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+        queryset = BookInstance.objects.select_related('book', 'borrower').on_loan().with_overdue().order_by('due_back')
+        if self.request.GET.get('overdue'):
+            # Only loans past their due date (a range on the on-loan due_back index)
+            queryset = queryset.overdue()
+        return queryset
 
 def renew_book_librarian(request, pk):
     """
@@ -123,7 +408,7 @@ def renew_book_librarian(request, pk):
     if not request.user.has_perm('catalog.can_mark_returned'):
         return HttpResponseForbidden("You do not have permission to renew books.")
 
-    book_inst=get_object_or_404(BookInstance, pk = pk)
+    book_inst=get_object_or_404(BookInstance.objects.select_related('book', 'borrower'), pk = pk)
 
     # If this is a POST request then process the Form data
     if request.method == 'POST':
@@ -135,7 +420,9 @@ def renew_book_librarian(request, pk):
         if form.is_valid():
             # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
             book_inst.due_back = form.cleaned_data['renewal_date']
-            book_inst.save()
+            with transaction.atomic():
+                book_inst.save()
+                history.record(LoanEvent.RENEWAL, [book_inst])
 
             # redirect to a new URL:
             return HttpResponseRedirect(reverse('all-borrowed') )
@@ -151,6 +438,55 @@ def renew_book_librarian(request, pk):
     # Render the template for GET requests
     return render(request, 'catalog/book_renew_librarian.html', {'form': form, 'bookinst':book_inst})
 
+@require_POST
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def bulk_circulation(request, action):
+    """
+    View function checking out, returning or renewing a batch of copies in one
+    transaction. Takes ``ids`` (UUIDs separated by commas or whitespace) plus
+    ``borrower`` (a username) and optional ``due_back`` for checkouts, or
+    ``renewal_date`` for renewals. Answers with one JSON outcome per copy.
+    """
+    copy_ids = re.split(r'[\s,]+', request.POST.get('ids', '').strip())
+    copy_ids = [copy_id for copy_id in copy_ids if copy_id]
+    if not copy_ids or len(copy_ids) > circulation.MAX_BATCH:
+        return JsonResponse({'error': 'Give between 1 and %d copy ids' % circulation.MAX_BATCH}, status=400)
+
+    form = BulkCirculationForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'error': form.errors.get_json_data()}, status=400)
+    data = form.cleaned_data
+    if action == 'checkout':
+        borrower = User.objects.filter(username=data['borrower']).first()
+        if borrower is None:
+            return JsonResponse({'error': 'Unknown borrower'}, status=400)
+        outcomes = circulation.checkout(copy_ids, borrower, data['due_back'])
+    elif action == 'return':
+        outcomes = circulation.return_copies(copy_ids)
+    else:
+        if data['renewal_date'] is None:
+            return JsonResponse({'error': 'renewal_date is required'}, status=400)
+        outcomes = circulation.renew([(copy_id, data['renewal_date']) for copy_id in copy_ids])
+    return JsonResponse({
+        'results': outcomes,
+        'succeeded': sum(outcome['ok'] for outcome in outcomes),
+        'failed': sum(not outcome['ok'] for outcome in outcomes),
+    })
+
+@staff_member_required
+def circulation_dashboard(request):
+    """
+    View function showing the most borrowed books, loans per genre and
+    average loan lengths for a month (``?month=YYYY-MM``, by default the
+    current one), read from the circulation rollups only.
+    """
+    month = datetime.date.today()
+    match = re.fullmatch(r'(\d{4})-(\d{2})', request.GET.get('month', ''))
+    # The dashboard also reads the year before and the month after
+    if match and datetime.MINYEAR < int(match[1]) < datetime.MAXYEAR and 1 <= int(match[2]) <= 12:
+        month = datetime.date(int(match[1]), int(match[2]), 1)
+    return render(request, 'catalog/circulation_dashboard.html', rollups.dashboard(month))
+
 class AuthorCreate(generic.CreateView):
     model = Author
     fields = '__all__'
@@ -165,11 +501,11 @@ class AuthorDelete(generic.DeleteView):
 
 class BookCreate(generic.CreateView):
     model = Book
-    fields = '__all__'
+    form_class = BookForm
 
 class BookUpdate(generic.UpdateView):
     model = Book
-    fields = '__all__' # Or specify a list of fields like for AuthorUpdate
+    form_class = BookForm
 
 class BookDelete(generic.DeleteView):
     model = Book
@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lyf_library.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402 (needs the settings module set above)
+
+if settings.CATALOG_WARM_TEMPLATES:
+    from catalog.templating import warm_templates_on_startup
+
+    warm_templates_on_startup()
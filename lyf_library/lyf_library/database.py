@@ -0,0 +1,117 @@
+"""
+Environment-driven database settings.
+
+``DATABASE_ENGINE`` picks ``sqlite`` (the default) or ``postgresql``, with
+``DATABASE_NAME``, ``DATABASE_USER``, ``DATABASE_PASSWORD``,
+``DATABASE_HOST`` and ``DATABASE_PORT``. ``DATABASE_PROFILE`` picks the
+tuning: ``development`` (the default) keeps Django's defaults, ``production``
+applies the settings below. Each can be overridden on its own.
+
+SQLite (production): WAL journal so readers are not blocked by a writer,
+``synchronous=NORMAL`` (durable at checkpoints, safe with WAL), a memory map
+and a larger page cache, all set per connection through ``init_command``;
+a busy timeout and ``BEGIN IMMEDIATE`` transactions so concurrent writers
+queue for the lock instead of failing with "database is locked".
+
+PostgreSQL (production): persistent connections with health checks.
+Server-side cursors (used by ``.iterator()`` in the export and report
+streaming paths) stay on unless ``DATABASE_SERVER_SIDE_CURSORS=0``, which is
+needed behind a transaction-pooling PgBouncer.
+"""
+import os
+
+PROFILES = ('development', 'production')
+
+SQLITE_DEFAULTS = {
+    'development': {},
+    'production': {
+        'SQLITE_CACHE_SIZE': '65536',  # KiB
+        'SQLITE_MMAP_SIZE': str(256 * 1024 * 1024),  # bytes
+        'SQLITE_BUSY_TIMEOUT': '20',  # seconds
+        'DATABASE_CONN_MAX_AGE': '600',
+    },
+}
+
+POSTGRESQL_DEFAULTS = {
+    'development': {},
+    'production': {
+        'DATABASE_CONN_MAX_AGE': '600',
+        'DATABASE_CONN_HEALTH_CHECKS': '1',
+        'DATABASE_CONNECT_TIMEOUT': '5',
+    },
+}
+
+
+def _flag(value):
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def sqlite_init_command(cache_size=None, mmap_size=None, wal=False):
+    """
+    The PRAGMAs run on every new SQLite connection.
+    """
+    pragmas = []
+    cache_size = int(cache_size or 0)
+    mmap_size = int(mmap_size or 0)
+    if wal:
+        pragmas += ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL']
+    if cache_size:
+        # Negative sizes are in KiB rather than pages
+        pragmas.append('PRAGMA cache_size=-%d' % cache_size)
+    if mmap_size:
+        pragmas.append('PRAGMA mmap_size=%d' % mmap_size)
+    if pragmas:
+        pragmas.append('PRAGMA temp_store=MEMORY')
+    return ';'.join(pragmas)
+
+
+def database_settings(base_dir, environ=None):
+    """
+    Return the ``default`` DATABASES entry described by ``environ``
+    (``os.environ`` by default).
+    """
+    environ = os.environ if environ is None else environ
+    engine = environ.get('DATABASE_ENGINE', 'sqlite')
+    profile = environ.get('DATABASE_PROFILE', 'development')
+    if profile not in PROFILES:
+        raise ValueError('DATABASE_PROFILE must be one of %s, not %r' % (', '.join(PROFILES), profile))
+
+    if engine == 'sqlite':
+        env = {**SQLITE_DEFAULTS[profile], **environ}
+        options = {}
+        init_command = sqlite_init_command(
+            env.get('SQLITE_CACHE_SIZE'), env.get('SQLITE_MMAP_SIZE'),
+            wal=_flag(env.get('SQLITE_WAL', '1' if profile == 'production' else '0')),
+        )
+        if init_command:
+            options['init_command'] = init_command
+        if env.get('SQLITE_BUSY_TIMEOUT'):
+            options['timeout'] = float(env['SQLITE_BUSY_TIMEOUT'])
+        if profile == 'production':
+            options['transaction_mode'] = 'IMMEDIATE'
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env.get('DATABASE_NAME') or os.path.join(base_dir, 'db.sqlite3'),
+            'CONN_MAX_AGE': int(env.get('DATABASE_CONN_MAX_AGE', 0)),
+            'OPTIONS': options,
+        }
+
+    if engine == 'postgresql':
+        env = {**POSTGRESQL_DEFAULTS[profile], **environ}
+        options = {}
+        if env.get('DATABASE_CONNECT_TIMEOUT'):
+            options['connect_timeout'] = int(env['DATABASE_CONNECT_TIMEOUT'])
+        return {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': env.get('DATABASE_NAME', 'lyf_library'),
+            'USER': env.get('DATABASE_USER', ''),
+            'PASSWORD': env.get('DATABASE_PASSWORD', ''),
+            'HOST': env.get('DATABASE_HOST', ''),
+            'PORT': env.get('DATABASE_PORT', ''),
+            'CONN_MAX_AGE': int(env.get('DATABASE_CONN_MAX_AGE', 0)),
+            'CONN_HEALTH_CHECKS': _flag(env.get('DATABASE_CONN_HEALTH_CHECKS', '0')),
+            'DISABLE_SERVER_SIDE_CURSORS': not _flag(env.get('DATABASE_SERVER_SIDE_CURSORS', '1')),
+            'OPTIONS': options,
+        }
+
+    raise ValueError('DATABASE_ENGINE must be sqlite or postgresql, not %r' % engine)
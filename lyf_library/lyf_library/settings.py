@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 
+from .database import database_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Server-Timing headers and the staff /catalog/_metrics page; remove to disable
+    'catalog.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,32 +56,67 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'lyf_library.urls'
 
+# TEMPLATE_PROFILE=production reads and compiles each template once per
+# process (the cached loader without autoreload), drops the template debug
+# information, and compiles every template at startup (wsgi.py/asgi.py).
+# TEMPLATE_PROFILING=1 also times every {% block %}; see
+# `manage.py profile_templates`.
+TEMPLATE_PROFILE = os.environ.get('TEMPLATE_PROFILE', 'development')
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': ['./templates',],
-        'APP_DIRS': True,
+        # DjangoTemplates that also times rendering for the instrumentation middleware
+        'BACKEND': 'catalog.instrumentation.InstrumentedDjangoTemplates',
+        'DIRS': [os.path.join(BASE_DIR, 'templates')],
+        'APP_DIRS': TEMPLATE_PROFILE != 'production',
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'profile': os.environ.get('TEMPLATE_PROFILING', '0') == '1',
         },
     },
 ]
 
+if TEMPLATE_PROFILE == 'production':
+    TEMPLATES[0]['OPTIONS'].update({
+        'debug': False,
+        'loaders': [
+            ('django.template.loaders.cached.Loader', [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ]),
+        ],
+    })
+
+CATALOG_WARM_TEMPLATES = TEMPLATE_PROFILE == 'production'
+
 WSGI_APPLICATION = 'lyf_library.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Configured from the DATABASE_* environment variables, SQLite db.sqlite3 by
+# default; DATABASE_PROFILE=production turns on the tuning described in
+# lyf_library/database.py.
 DATABASES = {
+    'default': database_settings(BASE_DIR),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# LocMemCache is per process: with several workers, use a shared backend
+# (memcached, Redis, the database cache) so page invalidations reach all of
+# them; see catalog.caching.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-        # 'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'lyf-library',
     }
 }
 
@@ -119,6 +158,33 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# collectstatic output
+STATIC_ROOT = os.environ.get('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+
+# STATIC_PROFILE=production collects minified, content-hashed, precompressed
+# assets (catalog/assets.py) and serves them from STATIC_ROOT with far-future
+# caching; set STATIC_SERVE=0 when a front-end server serves STATIC_ROOT.
+STATIC_PROFILE = os.environ.get('STATIC_PROFILE', 'development')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'catalog.assets.CatalogStaticFilesStorage' if STATIC_PROFILE == 'production'
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+
+CATALOG_SERVE_STATIC = STATIC_PROFILE == 'production' and os.environ.get('STATIC_SERVE', '1') != '0'
+
+# `manage.py archive_loan_events` moves loan history older than this many
+# months to gzipped per-month CSV files in LOAN_ARCHIVE_DIR
+CATALOG_LOAN_HISTORY_MONTHS = int(os.environ.get('LOAN_HISTORY_MONTHS', 12))
+LOAN_ARCHIVE_DIR = os.environ.get('LOAN_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lyf_library.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402 (needs the settings module set above)
+
+if settings.CATALOG_WARM_TEMPLATES:
+    from catalog.templating import warm_templates_on_startup
+
+    warm_templates_on_startup()